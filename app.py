@@ -1,11 +1,23 @@
 import dash
+import flask
+import pandas as pd
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
-from src.ah_forecast_sales.pipeline.fbProphetMultivariate import fbProphetMultivariate
+from src.ah_forecast_sales.pipeline.forecast_api import ForecastAPI
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.pipeline.forecast_store import get_forecast_items
+from src.ah_forecast_sales.pipeline.forecast_store import get_forecast_vizualisation
+from src.ah_forecast_sales.pipeline.forecast_store import read_forecast
+from src.ah_forecast_sales.pipeline.forecast_store import get_item_store_forecast
 from src.ah_forecast_sales.utils.exploratory_analysis import get_procceed_data
 from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.instrumentation import get_prometheus_metrics
+from src.ah_forecast_sales.utils.instrumentation import stage
+from src.ah_forecast_sales.utils.job_queue import JobQueue
 
 
 # ---------- Parameter of the app
@@ -21,16 +33,107 @@ app_color = {"graph_bg": "#F2F6FC", "graph_line": "#007ACE"}
 server = app.server
 
 
+# ---------- Timings of the stages of the pipeline for Prometheus
+@server.route('/metrics')
+def metrics():
+    return flask.Response(
+        get_prometheus_metrics(),
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
+# ---------- Fitted models already trained are loaded from the registry
+registry = ModelRegistry('./assets/models')
+
+
+# ---------- Read the forecasts precomputed by build_forecast_store
+# When the store exists the app does not need the dataset nor to fit models
+forecast_store = './assets/forecasts'
+items = get_forecast_items(forecast_store)
+
+
 # ---------- Read the file
-data = get_procceed_data()
-data = data[
-    data.ItemNumber.isin(get_sample(data, n=1000).ItemNumber)
-]
+if len(items) > 0:
+    data = None
+else:
+    # Only the columns to select the sample, then only the rows of the sample
+    sample = get_sample(get_procceed_data(columns=['years']), n=1000)
+    data = get_procceed_data(
+        items=sample.ItemNumber.tolist(),
+        start_date='2017-01-02',
+        compact=True
+    )
+    item_index = ItemIndex(data)
+    items = item_index.items
+
+
+# ---------- Models fitted in background jobs, the callbacks never wait for a fit
+# The forecasts of the jobs are written with the parameters of the run, and the
+# hash of the data: a forecast of a previous start on other data is not read
+job_store = './assets/cache/forecasts'
+job_run = None
+if data is not None:
+    job_run = {
+        'start_date': '2018-01-01',
+        'regressors': ['CommunicationChannelCode'],
+        'log': True,
+        'data': str(pd.util.hash_pandas_object(
+            data[['ItemNumber', 'DateKey', 'IsPromo', 'UnitSales']], index=False
+        ).sum()),
+    }
+
+
+def get_job_payload(ItemNumber: str, params: dict) -> dict:
+    """Build the payload of get_item_store_forecast for a job of the queue."""
+    itemNumberSample = item_index.get(ItemNumber)
+    return {
+        'ItemNumber': ItemNumber,
+        'data': itemNumberSample[itemNumberSample.DateKey > '2017-01-01'],
+        'path': job_store,
+        'start_date': job_run['start_date'],
+        'regressors': job_run['regressors'],
+        'log': job_run['log'],
+        'registry': registry,
+        'run': job_run,
+    }
+
+
+if data is not None:
+    # The jobs running when the app stopped are pending again
+    jobs = JobQueue(
+        get_item_store_forecast,
+        path='./assets/cache/jobs.sqlite',
+        n_workers=2,
+        get_payload=get_job_payload,
+    )
+    # The worker processes are forked now, before the threads of the server
+    jobs.start()
 
-ItemNumber_ = '10469'
-itemNumberSample = data[
-    data.ItemNumber == ItemNumber_
-].copy()
+
+# ---------- Json api of the forecasts for the other systems (replenishment, store ordering)
+def load_forecast(ItemNumber: str):
+    """Read the forecast of an ItemNumber for the api, from the store of the app."""
+    if data is None:
+        return read_forecast(forecast_store, ItemNumber)
+    return read_forecast(job_store, ItemNumber, run=job_run)
+
+
+def submit_forecast(ItemNumber: str):
+    """Start the job of an ItemNumber without forecast, None if it is unknown.
+    A failed job is returned as it is, it is run again when the ItemNumber
+    is selected in the app.
+    """
+    if data is None or ItemNumber not in item_index:
+        return None
+    job = jobs.get_status(ItemNumber)
+    if job is not None and job['status'] == 'failed':
+        return job
+    jobs.submit(ItemNumber)
+    return jobs.get_status(ItemNumber)
+
+
+api = ForecastAPI(load_forecast, submit_forecast)
+api.register(server)
 
 
 # ---------- Layer of the App
@@ -54,44 +157,86 @@ app.layout = html.Div([
     dcc.Dropdown(
         id="ItemNumber",
         options=[{"label": x, "value": x}
-                 for x in list(data.ItemNumber.unique())],
+                 for x in items],
         value='10469',
         clearable=False,
     ),
-    dcc.Graph(id="ForecastGraph")
+    dcc.Graph(id="ForecastGraph"),
+    # Check the job of the ItemNumber until its forecast is ready
+    dcc.Interval(id="JobInterval", interval=1000, disabled=True),
 ])
 
 
 # ---------- update Data when we choose a new product
 @app.callback(
     Output('ForecastGraph', 'figure'),
+    Output('JobInterval', 'disabled'),
     # Input("btn-nclicks-1", "n_clicks"),
-    Input("ItemNumber", "value")
+    Input("ItemNumber", "value"),
+    Input("JobInterval", "n_intervals"),
 )
-def get_figure(ItemNumber_: str):
+def get_figure(ItemNumber_: str, n_intervals: int):
     print(ItemNumber_)
-    itemNumberSample = data[
-        data.ItemNumber == ItemNumber_
-    ].copy()
+    if data is None:
+        with stage('load', item=ItemNumber_):
+            forecast = read_forecast(forecast_store, ItemNumber_)
+        if forecast is None:
+            return go.Figure(), True
+        with stage('figure', item=ItemNumber_):
+            fig = update_layout(get_forecast_vizualisation(forecast))
+        return fig, True
+
+    if ItemNumber_ not in item_index:
+        return go.Figure(), True
+
+    with stage('load', item=ItemNumber_):
+        forecast = read_forecast(job_store, ItemNumber_, run=job_run)
+    if forecast is not None:
+        with stage('figure', item=ItemNumber_):
+            fig = update_layout(get_forecast_vizualisation(forecast))
+        return fig, True
 
-    if len(itemNumberSample) < 1:
-        return go.Figure()
+    polling = dash.callback_context.triggered[0]['prop_id'] == 'JobInterval.n_intervals'
+    job = jobs.get_status(ItemNumber_)
+    if job is not None and job['status'] == 'failed' and polling:
+        # Polling of a failed job: no new job until the ItemNumber is selected again
+        return get_placeholder(ItemNumber_, job['error']), True
+
+    # The same job is returned while the ItemNumber is pending or running
+    jobs.submit(ItemNumber_)
+    if polling:
+        # Nothing new, the placeholder is already displayed
+        raise PreventUpdate
+    return get_placeholder(ItemNumber_), False
+
+
+def get_placeholder(ItemNumber_: str, error: str = None) -> go.Figure:
+    """Figure displayed while the forecast of the ItemNumber is computed.
+
+    Args:
+        ItemNumber_ (str): the ItemNumber selected.
+        error (str, optional): error of the job, if it failed. Defaults to None.
+
+    Returns:
+        go.Figure: an empty figure with the status of the forecast.
+    """
+    fig = update_layout(go.Figure())
+    if error is None:
+        fig.update_layout(title_text='Forecast of {} in progress...'.format(ItemNumber_))
     else:
-        itemNumberSample = itemNumberSample[
-            (itemNumberSample.DateKey > '2017-01-01')
-        ]
+        fig.update_layout(title_text='Forecast of {} failed: {}'.format(ItemNumber_, error))
+    return fig
+
 
-        # Get the model
-        fb_prophet_forecast = fbProphetMultivariate(
-            itemNumberSample,
-            start_date='2018-01-01',
-            regressors=['CommunicationChannelCode'],
-            log=True
-        )
+def update_layout(fig: go.Figure) -> go.Figure:
+    """Apply the design of the app to a forecast figure.
 
-        # Create the figue
-        fig = fb_prophet_forecast.get_vizualisation()
+    Args:
+        fig (go.Figure): figure of the forecast.
 
+    Returns:
+        go.Figure: the same figure with the layout of the app.
+    """
     # The Design x Colors of the Graph
     layout = dict(
         title_text='Forecast Times Series of Daily UniteSales',
@@ -128,4 +273,6 @@ def get_figure(ItemNumber_: str):
 
 # ------------------------------------------------------------------------------
 if __name__ == '__main__':
-    app.run_server(host='0.0.0.0', debug=True)
+    # Without the reloader: its second process would start a second JobQueue
+    # on the same file, each one resetting the running jobs of the other
+    app.run_server(host='0.0.0.0', debug=True, use_reloader=False)
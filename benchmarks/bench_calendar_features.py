@@ -0,0 +1,82 @@
+"""Benchmark of the calendar features of get_procceed_data:
+the previous implementation (strptime by row with pandarallel and two
+string slices by row) against get_calendar_features.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_calendar_features --rows 1000000
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.ah_forecast_sales.utils.exploratory_analysis import get_calendar_features
+
+
+def get_legacy_calendar_features(df: pd.DataFrame, parallel: bool) -> pd.DataFrame:
+    """Previous implementation of the calendar features."""
+    df['years'] = df['DateKey'].apply(lambda x: str(x)[0:4])
+    df['month'] = df['DateKey'].apply(lambda x: str(x)[4:6])
+
+    def func(x):
+        return datetime.strptime(str(x), '%Y%m%d')
+
+    if parallel:
+        from pandarallel import pandarallel
+        pandarallel.initialize()
+        df['DateKey'] = df.DateKey.parallel_apply(lambda x: func(x))
+    else:
+        df['DateKey'] = df.DateKey.apply(lambda x: func(x))
+    return df
+
+
+def get_date_keys(rows: int) -> pd.DataFrame:
+    """DateKey as yyyymmdd integers on two years of history."""
+    dates = pd.date_range('2016-01-01', '2017-12-31')
+    dates = dates[np.random.RandomState(1).randint(0, len(dates), rows)]
+    return pd.DataFrame({
+        'DateKey': dates.year * 10000 + dates.month * 100 + dates.day
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = get_date_keys(args.rows)
+    candidates = [
+        ('legacy (apply)', lambda x: get_legacy_calendar_features(x, parallel=False)),
+        ('vectorized', get_calendar_features),
+    ]
+    try:
+        import pandarallel  # noqa: F401
+        candidates.insert(1, (
+            'legacy (pandarallel)',
+            lambda x: get_legacy_calendar_features(x, parallel=True)
+        ))
+    except ImportError:
+        print('pandarallel not installed, legacy (pandarallel) skipped')
+
+    results = {}
+    for name, func in candidates:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            output = func(df.copy())
+            timings.append(time.perf_counter() - start)
+        results[name] = output
+        print('{:<22} rows={:<9} best={:.3f}s'.format(name, args.rows, min(timings)))
+
+    # The vectorized version must give the same values than the legacy one
+    legacy, vectorized = results['legacy (apply)'], results['vectorized']
+    assert (legacy.DateKey.values == vectorized.DateKey.values).all()
+    assert (legacy.years.values == vectorized.years.values).all()
+    assert (legacy.month.values == vectorized.month.values).all()
+
+
+if __name__ == '__main__':
+    main()
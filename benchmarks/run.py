@@ -0,0 +1,252 @@
+"""Benchmark suite of the pipeline on a synthetic dataset.
+
+Each stage is timed in a first pass over the stages (the fastest of --repeat
+passes, each one on a new copy of the dataset and a new cache), then memory
+profiled (peak of the python allocations with tracemalloc) in a second pass:
+the tracing does not slow down the timings. The timings are compared with
+the baseline saved for the scale in benchmarks/baselines.
+The cache updated with a batch and a new row group of the raw file is
+checked against a full proceed (check_cache).
+
+Run from the root of the repository:
+    python -m benchmarks.run --scale small
+    python -m benchmarks.run --scale medium --save-baseline
+    python -m benchmarks.run --rows 200000 --items 500 --stages proceed,index
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.ah_forecast_sales.utils.exploratory_analysis import append_proceed_data
+from src.ah_forecast_sales.utils.exploratory_analysis import check_proceed_cache
+from src.ah_forecast_sales.utils.exploratory_analysis import get_datetime
+from src.ah_forecast_sales.utils.exploratory_analysis import get_procceed_data
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.synthetic import write_synthetic_dataset
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines')
+
+# Scale -> number of rows and ItemNumber of the synthetic dataset
+SCALES = {
+    'small': {'n_rows': 1000, 'n_items': 10},
+    'medium': {'n_rows': 100000, 'n_items': 1000},
+    'large': {'n_rows': 1000000, 'n_items': 10000},
+}
+
+# Stages faster than this in the baseline (second) are only noise, not compared
+MIN_WALL_TIME = 0.01
+
+
+def get_wall_time(func):
+    """Run one stage without tracing, return its wall time in second."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def get_peak_memory(func):
+    """Run one stage with tracemalloc, return the peak of its allocations in MB."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def run_stages(path, folder, n_models, selected, measure):
+    """Run the stages selected in order on a copy of the dataset in folder,
+    return the measure of each one."""
+    os.makedirs(folder)
+    copy = os.path.join(folder, 'dataset.parquet')
+    shutil.copy(path, copy)
+    cache_path = os.path.join(folder, 'cache')
+    batch_path = os.path.join(folder, 'batches')
+    values = {}
+    for stage, func in get_stages(copy, cache_path, batch_path, n_models):
+        if selected is not None and stage not in selected:
+            continue
+        try:
+            values[stage] = measure(func)
+        except ImportError as e:
+            print('{:<20} skipped ({})'.format(stage, e))
+    return values
+
+
+def get_shifted_rows(df, days):
+    """The raw rows of the last 7 days of df, moved days later."""
+    dates = get_datetime(df.DateKey)
+    isLast = (dates > dates.max() - pd.Timedelta(days=7)).values
+    rows = df[isLast].copy()
+    dates = dates[isLast]
+    rows['DateKey'] = (dates + pd.Timedelta(days=days)).dt.strftime('%Y%m%d').values
+    rows['DateKey'] = rows.DateKey.astype(df.DateKey.dtype)
+    return rows
+
+
+def get_stages(path, cache_path, batch_path, n_models):
+    """Stages of the pipeline, each one use the output of the previous ones."""
+    state = {}
+
+    def proceed():
+        state['data'] = get_procceed_data(path, cache_path, batch_path=batch_path)
+
+    def cached_proceed():
+        get_procceed_data(path, cache_path, batch_path=batch_path)
+
+    def index():
+        state['index'] = ItemIndex(state['data'])
+
+    def item_slices():
+        for _, tmp in state['index']:
+            len(tmp)
+
+    def fit_predict():
+        from src.ah_forecast_sales.pipeline.fbProphetMultivariate import fbProphetMultivariate
+        state['models'] = [
+            fbProphetMultivariate(
+                tmp.copy(),
+                start_date='2018-01-01',
+                regressors=['CommunicationChannelCode'],
+                log=True,
+                prediction_mode='point'
+            )
+            for _, tmp in list(state['index'])[:n_models]
+        ]
+
+    def evaluation():
+        from src.ah_forecast_sales.pipeline.evaluation import get_batch_evaluation
+        get_batch_evaluation(
+            state['data'],
+            items=state['index'].items[:n_models],
+            item_index=state['index'],
+        )
+
+    def figure():
+        for model in state.get('models', []):
+            model.get_vizualisation().to_json()
+
+    def append_data():
+        # A new week in a batch, then the week after in a new row group
+        # at the end of the raw file
+        parquet_file = pq.ParquetFile(path)
+        table = parquet_file.read()
+        raw = table.to_pandas()
+        append_proceed_data(get_shifted_rows(raw, 7), cache_path, batch_path)
+        rows = pa.Table.from_pandas(
+            get_shifted_rows(raw, 14), schema=table.schema, preserve_index=False
+        )
+        with pq.ParquetWriter(path + '.tmp', table.schema) as writer:
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i))
+            writer.write_table(rows)
+        os.replace(path + '.tmp', path)
+
+    def incremental_proceed():
+        get_procceed_data(path, cache_path, batch_path=batch_path)
+
+    def check_cache():
+        check_proceed_cache(path, cache_path, batch_path)
+
+    return [
+        ('proceed', proceed),
+        ('cached_proceed', cached_proceed),
+        ('index', index),
+        ('item_slices', item_slices),
+        ('fit_predict', fit_predict),
+        ('evaluation', evaluation),
+        ('figure', figure),
+        ('append_data', append_data),
+        ('incremental_proceed', incremental_proceed),
+        ('check_cache', check_cache),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratio with the baseline, return the stages slower than the tolerance."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or baseline[name]['wall_time'] < MIN_WALL_TIME:
+            continue
+        ratio = result['wall_time'] / max(baseline[name]['wall_time'], 1e-9)
+        print('{:<20} x{:.2f} of the baseline'.format(name, ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--rows', type=int, help='overwrite the number of rows of the scale')
+    parser.add_argument('--items', type=int, help='overwrite the number of items of the scale')
+    parser.add_argument('--models', type=int, default=5, help='number of items to fit')
+    parser.add_argument('--stages', help='comma separated stages to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed passes, the fastest is kept')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown allowed compared with the baseline')
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    if args.rows:
+        scale['n_rows'] = args.rows
+    if args.items:
+        scale['n_items'] = args.items
+    name = '{}_{}rows_{}items'.format(args.scale, scale['n_rows'], scale['n_items'])
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'dataset.parquet')
+        write_synthetic_dataset(path, **scale)
+
+        selected = args.stages.split(',') if args.stages else None
+        wall_times = {}
+        for i in range(args.repeat):
+            for stage, wall_time in run_stages(
+                path, os.path.join(folder, 'time_{}'.format(i)), args.models,
+                selected, get_wall_time
+            ).items():
+                wall_times[stage] = min(wall_time, wall_times.get(stage, wall_time))
+        peak_memory = run_stages(
+            path, os.path.join(folder, 'memory'), args.models, selected, get_peak_memory
+        )
+
+    results = {}
+    for stage, wall_time in wall_times.items():
+        results[stage] = {'wall_time': wall_time, 'peak_memory_mb': peak_memory.get(stage)}
+        print('{:<20} {:>9.3f}s {:>10.1f}MB'.format(
+            stage, wall_time, peak_memory.get(stage, float('nan'))
+        ))
+
+    baseline_file = os.path.join(BASELINE_PATH, name + '.json')
+    if args.save_baseline:
+        os.makedirs(BASELINE_PATH, exist_ok=True)
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved in', baseline_file)
+    elif os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regression on', regressions)
+            sys.exit(1)
+    else:
+        print('No baseline {}, nothing compared (--save-baseline to create it)'.format(
+            baseline_file
+        ))
+
+
+if __name__ == '__main__':
+    main()
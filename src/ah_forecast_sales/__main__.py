@@ -0,0 +1,308 @@
+"""Headless batch entry point of the package, without the app:
+
+    python -m src.ah_forecast_sales forecast --items-file items.txt --output ./assets/forecasts
+    python -m src.ah_forecast_sales evaluate --variant univariate --workers 4
+    python -m src.ah_forecast_sales backtest --folds 4 --horizon 7
+
+The results are written as each ItemNumber is finished, one parquet partition
+by ItemNumber (<output>/ItemNumber=<item>/part-0.parquet) with the parameters
+of the run (run.json). A run stopped in the middle is resumed by running the
+same command again: the ItemNumber completed without failure by a run with the
+same parameters are skipped (--overwrite to run them again).
+"""
+from src.ah_forecast_sales.pipeline.backtesting import BACKTEST_COLUMNS
+from src.ah_forecast_sales.pipeline.backtesting import BACKTEST_WINDOWS
+from src.ah_forecast_sales.pipeline.backtesting import iter_backtest
+from src.ah_forecast_sales.pipeline.evaluation import MODEL_VARIANTS
+from src.ah_forecast_sales.pipeline.evaluation import RECORD_COLUMNS
+from src.ah_forecast_sales.pipeline.evaluation import iter_batch_evaluation
+from src.ah_forecast_sales.pipeline.fbProphetUnivariate import fbProphetUnivariate
+from src.ah_forecast_sales.pipeline.forecast_store import build_forecast_store
+from src.ah_forecast_sales.pipeline.forecast_store import get_forecast_items
+from src.ah_forecast_sales.pipeline.forecast_store import write_partition
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.exploratory_analysis import CACHE_PATH
+from src.ah_forecast_sales.utils.exploratory_analysis import DATA_PATH
+from src.ah_forecast_sales.utils.exploratory_analysis import get_procceed_data
+from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.shared_data import open_item_index
+import argparse
+import pandas as pd
+import sys
+from typing import Dict, List, Optional
+
+
+# Default output folder of each command
+OUTPUTS = {
+    'forecast': './assets/forecasts',
+    'evaluate': './assets/evaluation',
+    'backtest': './assets/backtest',
+}
+
+# Variants of the forecast command: the Prophet models fitted by ItemNumber
+FORECAST_VARIANTS = [
+    name for name, variant in MODEL_VARIANTS.items()
+    if variant['model'].__name__.startswith('fbProphet')
+]
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Parser of the command line, one sub command by batch."""
+    parser = argparse.ArgumentParser(prog='python -m src.ah_forecast_sales')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    forecast = commands.add_parser('forecast', help='fit and write the forecast store')
+    evaluate = commands.add_parser('evaluate', help='RMSE and NRMSE of the model variants')
+    backtest = commands.add_parser('backtest', help='rolling origin backtest')
+    for command in [forecast, evaluate, backtest]:
+        command.add_argument('--path', default=DATA_PATH, help='raw parquet file')
+        command.add_argument('--cache-path', default=CACHE_PATH, help='folder of the proceed data')
+        command.add_argument('--items', help='comma separated ItemNumber (default: get_sample)')
+        command.add_argument('--items-file', help='file with one ItemNumber by line')
+        command.add_argument('--all-items', action='store_true',
+                             help='all the ItemNumber, not only the ones selected by get_sample')
+        command.add_argument('--data-start', help='first date of data read, as %%Y-%%m-%%d')
+        command.add_argument('--data-end', help='last date of data read, as %%Y-%%m-%%d')
+        command.add_argument('--workers', type=int, help='number of worker processes')
+        command.add_argument('--timeout', type=float, help='maximum second by ItemNumber')
+        command.add_argument('--registry', help='folder of the model registry (default: none)')
+        command.add_argument('--output', help='folder of the partitions')
+        command.add_argument('--overwrite', action='store_true',
+                             help='run again the ItemNumber already written')
+
+    forecast.add_argument('--start-date', default='2018-01-01',
+                          help='start date of the forecast of the week')
+    forecast.add_argument('--variant', choices=FORECAST_VARIANTS,
+                          default='multivariate_isPromo_CommunicationChannel_log')
+    forecast.add_argument('--regressors',
+                          help='comma separated regressors, overwrite the ones of the variant')
+    forecast.add_argument('--log', dest='log', action='store_true', default=None,
+                          help='logarithm transformation, overwrite the one of the variant')
+    forecast.add_argument('--no-log', dest='log', action='store_false')
+    forecast.add_argument('--incremental', action='store_true',
+                          help='warm start from the last model of the registry')
+
+    evaluate.add_argument('--start-date', default='2018-01-01',
+                          help='start date of the forecast of the week')
+    for command in [evaluate, backtest]:
+        command.add_argument('--variant', action='append', choices=list(MODEL_VARIANTS),
+                             help='model variant, can be repeated (default: all)')
+
+    backtest.add_argument('--window', action='append', choices=list(BACKTEST_WINDOWS),
+                          help='training window, can be repeated (default: all)')
+    backtest.add_argument('--folds', type=int, default=4, help='number of cutoffs')
+    backtest.add_argument('--horizon', type=int, default=7, help='days forecast after a cutoff')
+    backtest.add_argument('--step', type=int, default=7, help='days between two cutoffs')
+    return parser
+
+
+def get_items(args: argparse.Namespace) -> Optional[List[str]]:
+    """ItemNumber given by --items and --items-file, None without filter."""
+    items = []
+    if args.items:
+        items += [x.strip() for x in args.items.split(',') if x.strip()]
+    if args.items_file:
+        with open(args.items_file) as f:
+            items += [x.strip() for x in f if x.strip()]
+    return items or None
+
+
+def get_forecast_kwargs(args: argparse.Namespace) -> Dict:
+    """Arguments of the model of the forecast command: the ones of the variant,
+    overwritten by --regressors and --log.
+    """
+    kwargs = dict(MODEL_VARIANTS[args.variant]['kwargs'])
+    if args.regressors is not None:
+        kwargs['regressors'] = [x for x in args.regressors.split(',') if x]
+    if args.log is not None:
+        kwargs['log'] = args.log
+    return kwargs
+
+
+def get_run(args: argparse.Namespace) -> Dict:
+    """Parameters of the run which change its results: a partition written
+    by a run with other parameters is run again.
+    """
+    run = {
+        'command': args.command,
+        'data_start': args.data_start,
+        'data_end': args.data_end,
+    }
+    if args.command == 'forecast':
+        kwargs = get_forecast_kwargs(args)
+        run.update({
+            'start_date': args.start_date,
+            'variant': args.variant,
+            'regressors': kwargs.get('regressors', []),
+            'log': kwargs.get('log', False),
+        })
+    elif args.command == 'evaluate':
+        run.update({
+            'start_date': args.start_date,
+            'variants': sorted(args.variant or MODEL_VARIANTS),
+        })
+    else:
+        run.update({
+            'variants': sorted(args.variant or MODEL_VARIANTS),
+            'windows': sorted(args.window or BACKTEST_WINDOWS),
+            'folds': args.folds,
+            'horizon': args.horizon,
+            'step': args.step,
+        })
+    return run
+
+
+def get_todo(
+    args: argparse.Namespace,
+    df: pd.DataFrame,
+    items: Optional[List[str]],
+    output: str,
+    run: Dict
+) -> List[str]:
+    """ItemNumber to run: the filter (or the selection of get_sample), without
+    the ones already completed in the output by a run with the same parameters.
+    """
+    if items is None:
+        if args.all_items:
+            items = df.ItemNumber.astype(str).unique().tolist()
+        else:
+            items = get_sample(df, sample_extract=False).ItemNumber.astype(str).tolist()
+    if not args.overwrite:
+        done = set(get_forecast_items(output, run))
+        if done:
+            print('Resume:', len(done), 'ItemNumber already completed in', output)
+        items = [x for x in items if x not in done]
+    return sorted(items)
+
+
+def write_records(
+    output: str,
+    results,
+    columns: List[str],
+    n_items: int,
+    run: Dict
+) -> pd.DataFrame:
+    """Write the records of each ItemNumber as soon as it is finished.
+    An ItemNumber with only failed records is not written, and one with some
+    failed records is written without its run: both are run again by the next run.
+
+    Args:
+        output (str): folder of the partitions.
+        results (Iterator): couple (ItemNumber, records) of iter_batch_evaluation
+            or iter_backtest.
+        columns (List[str]): columns of the records.
+        n_items (int): number of ItemNumber run, for the progress.
+        run (Dict): parameters of the run (see get_run).
+
+    Returns:
+        pd.DataFrame: ItemNumber, number of records and of failed records.
+    """
+    summary = []
+    for i, (ItemNumber, records) in enumerate(results, 1):
+        records = pd.DataFrame(records, columns=columns)
+        n_failed = int((records.status != 'success').sum())
+        if n_failed < len(records):
+            write_partition(output, ItemNumber, records, run if n_failed == 0 else None)
+        print('[{}/{}]'.format(i, n_items), ItemNumber, len(records), 'records,', n_failed, 'failed')
+        summary.append({'ItemNumber': ItemNumber, 'records': len(records), 'failed': n_failed})
+    return pd.DataFrame(summary, columns=['ItemNumber', 'records', 'failed'])
+
+
+def run_command(
+    args: argparse.Namespace,
+    df: pd.DataFrame,
+    todo: List[str],
+    output: str,
+    registry: Optional[ModelRegistry],
+    item_index: ItemIndex,
+    run: Dict
+) -> pd.DataFrame:
+    """Run the command on the ItemNumber to do, return the ItemNumber with a failure."""
+    if args.command == 'forecast':
+        variant = MODEL_VARIANTS[args.variant]
+        kwargs = get_forecast_kwargs(args)
+        # build_forecast_store writes each partition in the worker
+        results = build_forecast_store(
+            df,
+            path=output,
+            items=todo,
+            start_date=args.start_date,
+            regressors=kwargs.get('regressors', []),
+            log=kwargs.get('log', False),
+            registry=registry,
+            n_workers=args.workers,
+            timeout=args.timeout,
+            item_index=item_index,
+            univariate=variant['model'] is fbProphetUnivariate,
+            incremental=args.incremental,
+            run=run,
+        )
+        failed = results[results.status != 'success']
+        for _, row in failed.iterrows():
+            print(row.ItemNumber, row.status, row.error)
+    elif args.command == 'evaluate':
+        results = iter_batch_evaluation(
+            df,
+            items=todo,
+            variants=args.variant,
+            start_date=args.start_date,
+            n_workers=args.workers,
+            timeout=args.timeout,
+            item_index=item_index,
+        )
+        failed = write_records(output, results, RECORD_COLUMNS + ['elapsed'], len(todo), run)
+        failed = failed[failed.failed > 0]
+    else:
+        results = iter_backtest(
+            df,
+            items=todo,
+            variants=args.variant,
+            windows=args.window,
+            n_folds=args.folds,
+            horizon=args.horizon,
+            step=args.step,
+            registry=registry,
+            n_workers=args.workers,
+            timeout=args.timeout,
+            item_index=item_index,
+        )
+        failed = write_records(output, results, BACKTEST_COLUMNS, len(todo), run)
+        failed = failed[failed.failed > 0]
+
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run a command, return the exit code: 1 when an ItemNumber failed."""
+    args = get_parser().parse_args(argv)
+    output = args.output or OUTPUTS[args.command]
+    registry = ModelRegistry(args.registry) if args.registry else None
+
+    items = get_items(args)
+    df = get_procceed_data(
+        args.path,
+        args.cache_path,
+        items=items,
+        start_date=args.data_start,
+        end_date=args.data_end,
+        compact=True
+    )
+    run = get_run(args)
+    todo = get_todo(args, df, items, output, run)
+    print(args.command, len(todo), 'ItemNumber to', output)
+    if not todo:
+        return 0
+
+    # With workers, the data is published once in a file mapped by the workers,
+    # in place of the rows of each ItemNumber pickled in its payload
+    with open_item_index(df, args.workers) as item_index:
+        failed = run_command(args, df, todo, output, registry, item_index, run)
+
+    print(args.command, 'done:', len(todo), 'ItemNumber,', len(failed), 'with a failure')
+    return 1 if len(failed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+from src.ah_forecast_sales.pipeline.evaluation import MODEL_VARIANTS
+from src.ah_forecast_sales.pipeline.metrics import get_metrics_table
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.parallel import run_items
+from src.ah_forecast_sales.utils.shared_data import open_item_index
+import datetime as dt
+import inspect
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Window name -> number of days of training data before the cutoff (None: expanding).
+# Not the WINDOWS of the evaluation, which are calendar years of the data
+BACKTEST_WINDOWS = {
+    'expanding': None,
+    'rolling365': 365,
+}
+
+# Columns of the backtest: one record by ItemNumber, model, window and cutoff
+BACKTEST_COLUMNS = [
+    'ItemNumber', 'model_name', 'window', 'cutoff', 'n_train', 'n_test',
+    'RMSE', 'NRMSE', 'RMSE_promo', 'RMSE_no_promo', 'fit_time', 'warm_started', 'status', 'error'
+]
+
+
+def get_cutoffs(
+    last_date: dt.datetime,
+    n_folds: int = 4,
+    horizon: int = 7,
+    step: int = 7
+) -> List[dt.datetime]:
+    """Get the cutoffs of the folds, the last fold ends at the last date.
+
+    Args:
+        last_date (dt.datetime): last date of the data.
+        n_folds (int, optional): number of folds. Defaults to 4.
+        horizon (int, optional): number of days forecast after each cutoff. Defaults to 7.
+        step (int, optional): number of days between two cutoffs. Defaults to 7.
+
+    Returns:
+        List[dt.datetime]: the cutoffs, the oldest first.
+    """
+    last_cutoff = pd.Timestamp(last_date).normalize() - pd.Timedelta(days=horizon)
+    return [
+        last_cutoff - pd.Timedelta(days=step * i)
+        for i in reversed(range(n_folds))
+    ]
+
+
+def _accepts(model, name: str) -> bool:
+    return name in inspect.signature(model).parameters
+
+
+def get_backtest_records(
+    data: pd.DataFrame,
+    ItemNumber: str,
+    model_name: str,
+    window: str,
+    cutoffs: List[dt.datetime],
+    horizon: int = 7,
+    registry: Optional[ModelRegistry] = None
+) -> List[Dict]:
+    """Fit a model at each cutoff and measure its error on the horizon after it.
+    The folds are run from the oldest cutoff: each fit is warm started from
+    the model of the previous fold, a week of data more barely moves the fit.
+    The out of sample values of the folds are stacked and the metrics of all
+    the folds are computed by one get_metrics_table.
+
+    Args:
+        data (pd.DataFrame): the data of the ItemNumber
+        ItemNumber (str): the ItemNumber of the data.
+        model_name (str): name of the model in MODEL_VARIANTS.
+        window (str): name of the window in BACKTEST_WINDOWS.
+        cutoffs (List[dt.datetime]): last dates of the training data, the oldest first.
+        horizon (int, optional): number of days forecast after each cutoff. Defaults to 7.
+        registry (ModelRegistry, optional): registry of the fitted models, a fold
+            already fitted is loaded from its backtest scope. Defaults to None.
+
+    Returns:
+        List[Dict]: one record by cutoff with the BACKTEST_COLUMNS
+    """
+    model = MODEL_VARIANTS[model_name]['model']
+    kwargs = dict(MODEL_VARIANTS[model_name]['kwargs'])
+    if registry is not None and _accepts(model, 'registry'):
+        # The models of the folds are kept apart from the production models
+        kwargs['registry'] = registry.get_scope('backtest')
+    window_days = BACKTEST_WINDOWS[window]
+
+    records = []
+    metrics = []
+    previous = None
+    for cutoff in cutoffs:
+        record = dict.fromkeys(BACKTEST_COLUMNS)
+        record.update({
+            'ItemNumber': ItemNumber,
+            'model_name': model_name,
+            'window': window,
+            'cutoff': cutoff,
+            'status': 'success',
+        })
+        train = data[data.DateKey <= cutoff]
+        if window_days is not None:
+            train = train[train.DateKey > cutoff - pd.Timedelta(days=window_days)]
+        test = data[
+            (data.DateKey > cutoff)
+            & (data.DateKey <= cutoff + pd.Timedelta(days=horizon))
+        ]
+        record.update({'n_train': len(train), 'n_test': len(test)})
+        try:
+            if len(test) == 0:
+                raise ValueError('No observation after the cutoff')
+            if previous is not None and _accepts(model, 'warm_start'):
+                kwargs['warm_start'] = previous
+            fb_prophet_forecast = model(
+                train.copy(),
+                start_date=cutoff.strftime('%Y-%m-%d'),
+                prediction_mode='point',
+                **kwargs
+            )
+            previous = fb_prophet_forecast
+
+            # Out of sample error: the observations after the cutoff only
+            prediction = fb_prophet_forecast.predict(test)
+            test = test.sort_values('DateKey')
+            metrics.append(pd.DataFrame({
+                'cutoff': cutoff,
+                'y': test.UnitSales.values,
+                'yhat': prediction.sort_values('ds').yhat.values,
+                'IsPromo': test.IsPromo.values,
+            }))
+            record.update({
+                'fit_time': fb_prophet_forecast.timings['fit'],
+                'warm_started': getattr(fb_prophet_forecast, 'warm_started', False),
+            })
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = '{}: {}'.format(type(e).__name__, e)
+        records.append(record)
+
+    if metrics:
+        metrics = pd.concat(metrics, ignore_index=True)
+        table = get_metrics_table(
+            metrics.y,
+            metrics.yhat,
+            groups=metrics.cutoff,
+            isPromo=metrics.IsPromo,
+            name='cutoff'
+        )
+        for record in records:
+            if record['status'] == 'success':
+                for metric in ['RMSE', 'NRMSE', 'RMSE_promo', 'RMSE_no_promo']:
+                    record[metric] = float(table.loc[record['cutoff'], metric])
+
+    return records
+
+
+def _get_item_backtest(payload: Dict) -> List[Dict]:
+    """Run the folds of one ItemNumber, model and window.
+    Executed in a worker process by get_backtest.
+
+    Args:
+        payload (Dict): ItemNumber, data of the item, model, window and cutoffs.
+
+    Returns:
+        List[Dict]: one record by cutoff.
+    """
+    return get_backtest_records(
+        payload['data'],
+        payload['ItemNumber'],
+        payload['model_name'],
+        payload['window'],
+        payload['cutoffs'],
+        payload['horizon'],
+        payload['registry'],
+    )
+
+
+def iter_backtest(
+    df: pd.DataFrame,
+    items: Optional[List[str]] = None,
+    variants: Optional[List[str]] = None,
+    windows: Optional[List[str]] = None,
+    n_folds: int = 4,
+    horizon: int = 7,
+    step: int = 7,
+    registry: Optional[ModelRegistry] = None,
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+) -> Iterator[Tuple[str, List[Dict]]]:
+    """Run the rolling origin backtest (see get_backtest) and yield the records
+    of each ItemNumber as soon as all its models and windows are finished.
+
+    Args:
+        df (pd.DataFrame): The full dataset using to create the models
+        items (List[str], optional): ItemNumber to evaluate.
+            Defaults to all the ItemNumber selected by get_sample.
+        variants (List[str], optional): names of MODEL_VARIANTS to run.
+            Defaults to all of them.
+        windows (List[str], optional): names of BACKTEST_WINDOWS to run.
+            Defaults to all of them.
+        n_folds (int, optional): number of cutoffs by ItemNumber. Defaults to 4.
+        horizon (int, optional): number of days forecast after each cutoff. Defaults to 7.
+        step (int, optional): number of days between two cutoffs. Defaults to 7.
+        registry (ModelRegistry, optional): registry of the fitted models, a backtest
+            run again only fits the folds with new data. Defaults to None.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for the folds of one
+            ItemNumber, model and window. Defaults to None (no limit).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (created, see open_item_index).
+
+    Yields:
+        Iterator[Tuple[str, List[Dict]]]: the ItemNumber and its records, one by
+        model_name, window and cutoff with the BACKTEST_COLUMNS.
+    """
+    if items is None:
+        items = get_sample(df, sample_extract=False).ItemNumber.tolist()
+    variants = variants or list(MODEL_VARIANTS)
+    windows = windows or list(BACKTEST_WINDOWS)
+    # With workers, the data is published once in a file mapped by the workers
+    with open_item_index(df, n_workers, item_index) as item_index:
+        payloads = []
+        for ItemNumber in items:
+            if ItemNumber not in item_index:
+                continue
+            last_date = item_index.get(ItemNumber).DateKey.max()
+            cutoffs = get_cutoffs(last_date, n_folds, horizon, step)
+            data = item_index.get_payload(ItemNumber)
+            for model_name in variants:
+                for window in windows:
+                    payloads.append(((ItemNumber, model_name, window), {
+                        'ItemNumber': ItemNumber,
+                        'data': data,
+                        'model_name': model_name,
+                        'window': window,
+                        'cutoffs': cutoffs,
+                        'horizon': horizon,
+                        'registry': registry,
+                    }))
+
+        cutoffs_by_key = {key: payload['cutoffs'] for key, payload in payloads}
+        # Number of models and windows not finished, and records, of each ItemNumber
+        pending = {}
+        for key, _ in payloads:
+            pending[key[0]] = pending.get(key[0], 0) + 1
+        records = {ItemNumber: [] for ItemNumber in pending}
+        for output in run_items(_get_item_backtest, payloads, n_workers, timeout):
+            ItemNumber, model_name, window = output['key']
+            if output['status'] == 'success':
+                records[ItemNumber] += output['result']
+            else:
+                for cutoff in cutoffs_by_key[output['key']]:
+                    record = dict.fromkeys(BACKTEST_COLUMNS)
+                    record.update({
+                        'ItemNumber': ItemNumber,
+                        'model_name': model_name,
+                        'window': window,
+                        'cutoff': cutoff,
+                        'status': output['status'],
+                        'error': output['error'],
+                    })
+                    records[ItemNumber].append(record)
+
+            pending[ItemNumber] -= 1
+            if pending[ItemNumber] == 0:
+                yield ItemNumber, records.pop(ItemNumber)
+
+
+def get_backtest(
+    df: pd.DataFrame,
+    items: Optional[List[str]] = None,
+    variants: Optional[List[str]] = None,
+    windows: Optional[List[str]] = None,
+    n_folds: int = 4,
+    horizon: int = 7,
+    step: int = 7,
+    registry: Optional[ModelRegistry] = None,
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+) -> pd.DataFrame:
+    """Rolling origin backtest: every model variant and window is fitted at
+    n_folds cutoffs of each ItemNumber and evaluated on the horizon after
+    the cutoff, on observations not seen by the fit.
+    The folds of an ItemNumber, model and window are a chain of warm started
+    fits, the chains run in parallel across a process pool.
+
+    Args:
+        df (pd.DataFrame): The full dataset using to create the models
+        items (List[str], optional): ItemNumber to evaluate.
+            Defaults to all the ItemNumber selected by get_sample.
+        variants (List[str], optional): names of MODEL_VARIANTS to run.
+            Defaults to all of them.
+        windows (List[str], optional): names of BACKTEST_WINDOWS to run.
+            Defaults to all of them.
+        n_folds (int, optional): number of cutoffs by ItemNumber. Defaults to 4.
+        horizon (int, optional): number of days forecast after each cutoff. Defaults to 7.
+        step (int, optional): number of days between two cutoffs. Defaults to 7.
+        registry (ModelRegistry, optional): registry of the fitted models, a backtest
+            run again only fits the folds with new data. Defaults to None.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for the folds of one
+            ItemNumber, model and window. Defaults to None (no limit).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (created, see open_item_index).
+
+    Returns:
+        pd.DataFrame: one row by ItemNumber, model_name, window and cutoff with
+        the BACKTEST_COLUMNS.
+    """
+    records = []
+    for _, item_records in iter_backtest(
+        df, items, variants, windows, n_folds, horizon, step,
+        registry, n_workers, timeout, item_index
+    ):
+        records += item_records
+
+    return pd.DataFrame(records, columns=BACKTEST_COLUMNS)
+
+
+def get_backtest_summary(results: pd.DataFrame) -> pd.DataFrame:
+    """Mean out of sample RMSE and NRMSE of each model and window, over the
+    successful folds, with and without promotion, with the number of folds
+    and of failures.
+
+    Args:
+        results (pd.DataFrame): results of get_backtest
+
+    Returns:
+        pd.DataFrame: one row by model_name and window, sorted by NRMSE.
+    """
+    results = results.assign(failed=results.status != 'success')
+    summary = results.groupby(['model_name', 'window']).agg(
+        RMSE=('RMSE', 'mean'),
+        NRMSE=('NRMSE', 'mean'),
+        RMSE_promo=('RMSE_promo', 'mean'),
+        RMSE_no_promo=('RMSE_no_promo', 'mean'),
+        fit_time=('fit_time', 'sum'),
+        n_folds=('status', 'size'),
+        n_failed=('failed', 'sum'),
+    )
+    return summary.sort_values('NRMSE').reset_index()
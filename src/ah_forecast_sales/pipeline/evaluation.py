@@ -1,63 +1,215 @@
 from src.ah_forecast_sales.pipeline.fbProphetMultivariate import fbProphetMultivariate
 from src.ah_forecast_sales.pipeline.fbProphetUnivariate import fbProphetUnivariate
+from src.ah_forecast_sales.pipeline.globalBaseline import globalBaseline
+from src.ah_forecast_sales.pipeline.metrics import get_metrics_table
+from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.parallel import run_items
+from src.ah_forecast_sales.utils.shared_data import open_item_index
 import pandas as pd
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+
+
+# The 4 models of the README and a baseline, each one is evaluated on 2 windows of training data
+MODEL_VARIANTS = {
+    'univariate': {
+        'model': fbProphetUnivariate,
+        'kwargs': {},
+    },
+    'multivariate_isPromo': {
+        'model': fbProphetMultivariate,
+        'kwargs': {'regressors': [], 'log': False},
+    },
+    'multivariate_isPromo_CommunicationChannel': {
+        'model': fbProphetMultivariate,
+        'kwargs': {'regressors': ['CommunicationChannelCode'], 'log': False},
+    },
+    'multivariate_isPromo_CommunicationChannel_log': {
+        'model': fbProphetMultivariate,
+        'kwargs': {'regressors': ['CommunicationChannelCode'], 'log': True},
+    },
+    # Linear model without Stan, the reference of the 4 models
+    'global_baseline': {
+        'model': globalBaseline,
+        'kwargs': {'regressors': ['CommunicationChannelCode'], 'log': False},
+    },
+}
+
+
+def get_variant_name(model: Type, regressors: List[str] = [], log: bool = False) -> str:
+    """Name of a model and its arguments in MODEL_VARIANTS, to tag the stages
+    and the records with the same name whatever the caller.
+
+    Args:
+        model (Type): fbProphetUnivariate, fbProphetMultivariate or globalBaseline
+        regressors (List[str], optional): regressors of the model. Defaults to [].
+        log (bool, optional): logarithm transformation of the model. Defaults to False.
+
+    Returns:
+        str: the name in MODEL_VARIANTS, or the name of the model followed by
+        the regressors and _log for a variant not in MODEL_VARIANTS.
+    """
+    for name, variant in MODEL_VARIANTS.items():
+        if (
+            variant['model'] is model
+            and list(variant['kwargs'].get('regressors', [])) == list(regressors)
+            and variant['kwargs'].get('log', False) == log
+        ):
+            return name
+    return model.__name__ + ''.join(
+        '_' + regressor for regressor in regressors
+    ) + ('_log' if log else '')
+
+
+# Window name -> years kept to train the model (None for all the history)
+WINDOWS = {
+    '2year': None,
+    '1year': '2017',
+}
+
+# Columns of the long format evaluation: one record by ItemNumber, model and window
+RECORD_COLUMNS = [
+    'ItemNumber', 'model_name', 'window', 'RMSE', 'NRMSE',
+    'RMSE_promo', 'RMSE_no_promo', 'fit_time', 'predict_time', 'status', 'error'
+]
+
+
+def _get_item_data(
+    df: pd.DataFrame,
+    ItemNumber: str,
+    item_index: Optional[ItemIndex]
+) -> pd.DataFrame:
+    """Get the data of an ItemNumber, from the index when there is one."""
+    if item_index is not None:
+        return item_index.get(ItemNumber)
+    return df[df.ItemNumber == ItemNumber]
+
+
+def get_evaluation_records(
+    data: pd.DataFrame,
+    ItemNumber: str,
+    model_name: str,
+    model: Type,
+    kwargs: Dict,
+    start_date: str = '2018-01-01',
+    raise_errors: bool = False
+) -> List[Dict]:
+    """Run a model on each window of the data of an ItemNumber
+    and collect the RMSE, NRMSE and the timings of the model.
+    The actual and forecast values of the windows are stacked and the
+    metrics of all the windows are computed by one get_metrics_table.
+    A failure on a window is kept in the record of this window, or raised
+    with raise_errors.
+
+    Args:
+        data (pd.DataFrame): the data of the ItemNumber
+        ItemNumber (str): the ItemNumber wanted to create the model.
+        model_name (str): The name to track the model used (uniqueIdentifier)
+        model (Type): fbProphetUnivariate, fbProphetMultivariate or globalBaseline
+        kwargs (Dict): arguments of the model (regressors, log)
+        start_date (str, optional): start date to start the forecast of the week.
+            Defaults to '2018-01-01'.
+        raise_errors (bool, optional): True to raise the exception of a failed
+            window as it is (type and traceback), instead of a failed record.
+            Defaults to False.
+
+    Returns:
+        List[Dict]: one record by window with the RECORD_COLUMNS
+    """
+    records = []
+    metrics = []
+    for window, years in WINDOWS.items():
+        record = dict.fromkeys(RECORD_COLUMNS)
+        record.update({
+            'ItemNumber': ItemNumber,
+            'model_name': model_name,
+            'window': window,
+            'status': 'success',
+        })
+        tmp = data if years is None else data[data.years == years]
+        try:
+            # Only yhat is used by the metrics, the intervals are not computed
+            fb_prophet_forecast = model(
+                tmp.copy(),
+                start_date=start_date,
+                prediction_mode='point',
+                **kwargs
+            )
+            record.update({
+                'fit_time': fb_prophet_forecast.timings['fit'],
+                'predict_time': fb_prophet_forecast.timings['predict'],
+            })
+            metrics.append(
+                fb_prophet_forecast.metrics[['y', 'yhat', 'IsPromo']].assign(window=window)
+            )
+        except Exception as e:
+            if raise_errors:
+                raise
+            record['status'] = 'failed'
+            record['error'] = '{}: {}'.format(type(e).__name__, e)
+        records.append(record)
+
+    if metrics:
+        metrics = pd.concat(metrics, ignore_index=True)
+        table = get_metrics_table(
+            metrics.y,
+            metrics.yhat,
+            groups=metrics.window,
+            isPromo=metrics.IsPromo,
+            name='window'
+        )
+        for record in records:
+            if record['window'] in table.index:
+                for metric in ['RMSE', 'NRMSE', 'RMSE_promo', 'RMSE_no_promo']:
+                    record[metric] = float(table.loc[record['window'], metric])
+
+    return records
+
+
+def _add_records(sample: pd.DataFrame, records: List[Dict]) -> pd.DataFrame:
+    """Add the RMSE and NRMSE of the records to the sample, one column
+    by model, metric and window (model_name_RMSE_2year, ...).
+    """
+    for record in records:
+        for metric in ['RMSE', 'NRMSE']:
+            sample.loc[
+                sample.ItemNumber == record['ItemNumber'],
+                '{}_{}_{}'.format(record['model_name'], metric, record['window'])
+            ] = record[metric]
+    return sample
 
 
 def get_evaluation_fbProphetUnivariate(
     sample: pd.DataFrame,
     df: pd.DataFrame,
     ItemNumber: str,
-    model_name: str
+    model_name: str,
+    item_index: Optional[ItemIndex] = None
 ) -> pd.DataFrame:
     """Add the RMSE and NRMSE for a ItemNumber.
     Run the univariate model and then compile the evaluation of this one.
+    To evaluate many ItemNumber, use get_batch_evaluation.
 
     Args:
         sample (pd.DataFrame): DataFrame to fill by the RMSE and NRMSE
         df (pd.DataFrame): The full dataset using to create the model
         ItemNumber (str): the ItemNumber wanted to create the model.
         model_name (str): The name to track the model used (uniqueIdentifier)
+        item_index (ItemIndex, optional): index of df by ItemNumber, to get the data
+            of the ItemNumber without a scan of df. Defaults to None.
 
     Returns:
         pd.DataFrame: the same dataframe with value for the RMSE and NRMSE
     """
-    # Step 1 - fb Prophet Univariate 2016 / 2017
-    tmp = df[
-        (df.ItemNumber == ItemNumber)
-    ].copy()
-    fb_prophet_forecast = fbProphetUnivariate(tmp, start_date='2018-01-01')
-
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_RMSE_12ear'
-    ] = fb_prophet_forecast.rmse
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_NRMSE_2year'
-    ] = fb_prophet_forecast.nrmse
-
-    # Step 2 - fb Prophet Univariate  2016
-    tmp = df[
-        (df.ItemNumber == ItemNumber) &
-        (df.years == '2017')
-    ].copy()
-    fb_prophet_forecast = fbProphetUnivariate(tmp, start_date='2018-01-01')
-
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_RMSE_1year'
-    ] = fb_prophet_forecast.rmse
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_NRMSE_1year'
-    ] = fb_prophet_forecast.nrmse
-
-    return sample
+    records = get_evaluation_records(
+        _get_item_data(df, ItemNumber, item_index),
+        ItemNumber,
+        model_name,
+        fbProphetUnivariate,
+        {},
+        raise_errors=True
+    )
+    return _add_records(sample, records)
 
 
 def get_evaluation_fbProphetMultivariate(
@@ -66,10 +218,12 @@ def get_evaluation_fbProphetMultivariate(
     ItemNumber: str,
     model_name: str,
     regressors: List[str],
-    log: bool
+    log: bool,
+    item_index: Optional[ItemIndex] = None
 ) -> pd.DataFrame:
     """Add the RMSE and NRMSE for a ItemNumber.
     Run the multivariate model and then compile the evaluation of this one.
+    To evaluate many ItemNumber, use get_batch_evaluation.
 
     Args:
         sample (pd.DataFrame): DataFrame to fill by the RMSE and NRMSE
@@ -78,53 +232,174 @@ def get_evaluation_fbProphetMultivariate(
         model_name (str): The name to track the model used (uniqueIdentifier)
         regressors (List(str)): List of regressors we want to use for the model
         log (bool): True or False if we want to use a logarithm transformation
+        item_index (ItemIndex, optional): index of df by ItemNumber, to get the data
+            of the ItemNumber without a scan of df. Defaults to None.
 
     Returns:
         pd.DataFrame: the same dataframe with value for the RMSE and NRMSE
     """
-    # Step 1 - fb Prophet Univariate 2016 / 2017
-    tmp = df[
-        (df.ItemNumber == ItemNumber)
-    ].copy()
-    fb_prophet_forecast = fbProphetMultivariate(
-        tmp,
-        start_date='2018-01-01',
-        regressors=regressors,
-        log=log
+    records = get_evaluation_records(
+        _get_item_data(df, ItemNumber, item_index),
+        ItemNumber,
+        model_name,
+        fbProphetMultivariate,
+        {'regressors': regressors, 'log': log},
+        raise_errors=True
     )
+    return _add_records(sample, records)
 
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_RMSE_12ear'
-    ] = fb_prophet_forecast.rmse
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_NRMSE_2year'
-    ] = fb_prophet_forecast.nrmse
-
-    # Step 2 - fb Prophet Univariate  2016
-    tmp = df[
-        (df.ItemNumber == ItemNumber) &
-        (df.years == '2017')
-    ].copy()
-    fb_prophet_forecast = fbProphetMultivariate(
-        tmp,
-        start_date='2018-01-01',
-        regressors=regressors,
-        log=log
 
-    )
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_RMSE_1year'
-    ] = fb_prophet_forecast.rmse
-    # NRMSE
-    sample.loc[
-        sample.ItemNumber == ItemNumber,
-        model_name + '_NRMSE_1year'
-    ] = fb_prophet_forecast.nrmse
+def _get_item_evaluation(payload: Dict) -> List[Dict]:
+    """Run all the model variants and windows for one ItemNumber.
+    Executed in a worker process by get_batch_evaluation.
 
-    return sample
+    Args:
+        payload (Dict): ItemNumber, data of the item, variants and start_date.
+
+    Returns:
+        List[Dict]: one record by model variant and window.
+    """
+    records = []
+    for model_name in payload['variants']:
+        records += get_evaluation_records(
+            payload['data'],
+            payload['ItemNumber'],
+            model_name,
+            MODEL_VARIANTS[model_name]['model'],
+            MODEL_VARIANTS[model_name]['kwargs'],
+            payload['start_date']
+        )
+    return records
+
+
+def iter_batch_evaluation(
+    df: pd.DataFrame,
+    items: Optional[List[str]] = None,
+    variants: Optional[List[str]] = None,
+    start_date: str = '2018-01-01',
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+) -> Iterator[Tuple[str, List[Dict]]]:
+    """Evaluate many ItemNumber in parallel across a process pool and yield
+    the records of each ItemNumber as soon as it is finished.
+    A failure or a timeout on one ItemNumber is reported in its records
+    and does not stop the run.
+
+    Args:
+        df (pd.DataFrame): The full dataset using to create the models
+        items (List[str], optional): ItemNumber to evaluate.
+            Defaults to all the ItemNumber selected by get_sample.
+        variants (List[str], optional): names of MODEL_VARIANTS to run.
+            Defaults to all of them.
+        start_date (str, optional): start date to start the forecast of the week.
+            Defaults to '2018-01-01'.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for one ItemNumber.
+            Defaults to None (no limit).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (created, see open_item_index).
+
+    Yields:
+        Iterator[Tuple[str, List[Dict]]]: the ItemNumber and its records, one by
+        model variant and window with the RECORD_COLUMNS and the elapsed time.
+    """
+    if items is None:
+        items = get_sample(df, sample_extract=False).ItemNumber.tolist()
+    variants = variants or list(MODEL_VARIANTS)
+    # With workers, the data is published once in a file mapped by the workers
+    with open_item_index(df, n_workers, item_index) as item_index:
+        payloads = (
+            (ItemNumber, {
+                'ItemNumber': ItemNumber,
+                'data': item_index.get_payload(ItemNumber),
+                'variants': variants,
+                'start_date': start_date,
+            })
+            for ItemNumber in items
+            if ItemNumber in item_index
+        )
+
+        for output in run_items(_get_item_evaluation, payloads, n_workers, timeout):
+            if output['status'] == 'success':
+                item_records = output['result']
+            else:
+                item_records = []
+                for model_name in variants:
+                    for window in WINDOWS:
+                        record = dict.fromkeys(RECORD_COLUMNS)
+                        record.update({
+                            'ItemNumber': output['key'],
+                            'model_name': model_name,
+                            'window': window,
+                            'status': output['status'],
+                            'error': output['error'],
+                        })
+                        item_records.append(record)
+            for record in item_records:
+                record['elapsed'] = output['elapsed']
+            yield output['key'], item_records
+
+
+def get_batch_evaluation(
+    df: pd.DataFrame,
+    items: Optional[List[str]] = None,
+    variants: Optional[List[str]] = None,
+    start_date: str = '2018-01-01',
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+) -> pd.DataFrame:
+    """Evaluate many ItemNumber in parallel across a process pool.
+    The records of every ItemNumber, model variant and window are collected
+    and the long format DataFrame is created once at the end.
+    A failure or a timeout on one ItemNumber is reported in the results
+    and does not stop the run.
+
+    Args:
+        df (pd.DataFrame): The full dataset using to create the models
+        items (List[str], optional): ItemNumber to evaluate.
+            Defaults to all the ItemNumber selected by get_sample.
+        variants (List[str], optional): names of MODEL_VARIANTS to run.
+            Defaults to all of them.
+        start_date (str, optional): start date to start the forecast of the week.
+            Defaults to '2018-01-01'.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for one ItemNumber.
+            Defaults to None (no limit).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (created, see open_item_index).
+
+    Returns:
+        pd.DataFrame: one row by ItemNumber, model_name and window with the
+        RECORD_COLUMNS and the elapsed time of the ItemNumber.
+    """
+    records = []
+    for _, item_records in iter_batch_evaluation(
+        df, items, variants, start_date, n_workers, timeout, item_index
+    ):
+        records += item_records
+
+    return pd.DataFrame(records, columns=RECORD_COLUMNS + ['elapsed'])
+
+
+def get_evaluation_table(results: pd.DataFrame) -> pd.DataFrame:
+    """Pivot the long format results of get_batch_evaluation to one row by
+    ItemNumber and one column by model, metric and window (model_name_NRMSE_1year, ...).
+
+    Args:
+        results (pd.DataFrame): results of get_batch_evaluation
+
+    Returns:
+        pd.DataFrame: wide DataFrame of the RMSE and NRMSE
+    """
+    table = results[results.status == 'success'].pivot_table(
+        index='ItemNumber',
+        columns=['model_name', 'window'],
+        values=['RMSE', 'NRMSE']
+    )
+    table.columns = [
+        '{}_{}_{}'.format(model_name, metric, window)
+        for metric, model_name, window in table.columns
+    ]
+    return table.reset_index()
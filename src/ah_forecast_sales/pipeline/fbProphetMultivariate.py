@@ -2,12 +2,20 @@ from numpy import integer
 from pandas.core.arrays import boolean
 from fbprophet import Prophet
 import datetime as dt
+import time
 import pandas as pd
-import plotly.graph_objects as go
-from typing import List
-from sklearn.metrics import mean_squared_error
-from math import sqrt
+from typing import Dict, List
 import numpy as np
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.pipeline.registry import get_item_name
+from src.ah_forecast_sales.pipeline.registry import get_training_window
+from src.ah_forecast_sales.pipeline.warm_start import fit_prophet
+from src.ah_forecast_sales.pipeline.metrics import get_nrmse
+from src.ah_forecast_sales.pipeline.metrics import get_rmse
+from src.ah_forecast_sales.pipeline.prediction import get_prediction
+from src.ah_forecast_sales.utils.figures import get_forecast_figure
+from src.ah_forecast_sales.utils.figures import get_metrics_figure
+from src.ah_forecast_sales.utils.instrumentation import stage
 
 
 class fbProphetMultivariate():
@@ -25,7 +33,11 @@ class fbProphetMultivariate():
         data: pd.DataFrame,
         start_date: str,
         regressors=[],
-        log=False
+        log=False,
+        registry: ModelRegistry = None,
+        warm_start=None,
+        incremental=False,
+        prediction_mode='full'
     ) -> None:
         """Init the  fbProphetMultivariate Model Class.
 
@@ -36,6 +48,15 @@ class fbProphetMultivariate():
                 . Defaults to [].
             log (bool): True or False if we want to use a logarithm transformation
             Defaults to False.
+            registry (ModelRegistry, optional): registry to load the fitted model from
+                and to save it after a fit. Defaults to None (always fit).
+            warm_start (fbProphetMultivariate, optional): model already fitted on the
+                same times series with less data, its parameters are the starting point
+                of the fit. Defaults to None.
+            incremental (bool, optional): True to warm start from the last model of the
+                ItemNumber saved in the registry with the same config. Defaults to False.
+            prediction_mode (str, optional): full, fast or point, see get_prediction.
+                Use point when only yhat is needed. Defaults to 'full'.
         """
         # rename the column to follow the rules of the library
         self.data = data.rename(
@@ -47,14 +68,38 @@ class fbProphetMultivariate():
 
         self.data
         self.regressors = regressors
-        self.model = self._get_model(log)
-        self.forecast = self.get_forecast(
-            start_date,
-            log
-        )
-        self.metrics = self._get_metrics()
-        self.rmse = self._get_rmse()
-        self.nrmse = self._get_nrmse()
+        self.start_date = start_date
+        self.log = log
+        self.registry = registry
+        self.warm_start = warm_start
+        self.incremental = incremental
+        self.prediction_mode = prediction_mode
+        # Name of the model variant and ItemNumber, to tag the stages
+        # (imported here, evaluation imports the model classes)
+        from src.ah_forecast_sales.pipeline.evaluation import get_variant_name
+        self.variant = get_variant_name(type(self), regressors, log)
+        tags = {'item': get_item_name(self.data), 'variant': self.variant}
+
+        # Time in second to fit (or load) the model and to predict
+        self.timings = {}
+        with stage('fit', **tags) as record:
+            self.model = self._get_model(log)
+            record['warm_started'] = self.warm_started
+        self.timings['fit'] = record['wall_time']
+        # Time saved by the warm start compared with the fit from scratch
+        self.timings['fit_saved'] = None
+        if self.warm_started and self.cold_fit_time is not None:
+            self.timings['fit_saved'] = self.cold_fit_time - self.timings['fit']
+        with stage('predict', **tags) as record:
+            self.forecast = self.get_forecast(
+                start_date,
+                log
+            )
+        self.timings['predict'] = record['wall_time']
+        with stage('merge_metrics', **tags):
+            self.metrics = self._get_metrics()
+            self.rmse = self._get_rmse()
+            self.nrmse = self._get_nrmse()
 
     def _get_model(self, log: bool) -> Prophet:
         """Get the model used for the class.
@@ -62,6 +107,53 @@ class fbProphetMultivariate():
         Args:
             log (bool): True or False if we want to use a logarithm transformation
             Defaults to False.
+        Returns:
+            Prophet: Prophet class of the fb prophet library.
+        """
+        if self.registry is not None:
+            key = self.registry.get_key(
+                self.data,
+                ['ds', 'y', 'IsPromo'] + self.regressors,
+                self._get_config(log)
+            )
+            models = self.registry.load(get_item_name(self.data), key)
+            if models is not None:
+                self.warm_started, self.cold_fit_time = False, None
+                return models['model']
+
+        init_model, cold_fit_time = self._get_init_model(log)
+        if log:
+            tmp = self.data.copy()
+            tmp.y = np.log(tmp.y)
+        else:
+            tmp = self.data
+
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        model, self.warm_started = fit_prophet(self._get_prophet, tmp, init_model)
+        fit_cpu_time = time.thread_time() - cpu_start
+        # Time of a fit from scratch: measured, or the one of the previous model
+        if self.warm_started:
+            self.cold_fit_time = cold_fit_time
+        else:
+            self.cold_fit_time = time.perf_counter() - start
+
+        if self.registry is not None:
+            self.registry.save(
+                get_item_name(self.data),
+                key,
+                {'model': model},
+                self._get_config(log),
+                self.cold_fit_time,
+                self.warm_started,
+                fit_cpu_time
+            )
+
+        return model
+
+    def _get_prophet(self) -> Prophet:
+        """Get the Prophet model not fitted, with the regressors.
+
         Returns:
             Prophet: Prophet class of the fb prophet library.
         """
@@ -75,15 +167,48 @@ class fbProphetMultivariate():
 
         for regressor in self.regressors:
             model.add_regressor(regressor)
-        if log:
-            tmp = self.data.copy()
-            tmp.y = np.log(tmp.y)
-            model.fit(tmp)
-        else:
-            model.fit(self.data)
-
         return model
 
+    def _get_init_model(self, log: bool):
+        """Get the model to warm start the fit, from warm_start or from
+        the registry in incremental mode.
+
+        Args:
+            log (bool): True or False if we want to use a logarithm transformation
+
+        Returns:
+            Tuple[Prophet, float]: the model (None for a fit from scratch)
+            and the time of its fit from scratch.
+        """
+        if self.warm_start is not None:
+            return self.warm_start.model, self.warm_start.cold_fit_time
+        if self.incremental and self.registry is not None:
+            latest = self.registry.load_latest(
+                get_item_name(self.data),
+                self._get_config(log)
+            )
+            if latest is not None:
+                models, cold_fit_time = latest
+                return models['model'], cold_fit_time
+        return None, None
+
+    def _get_config(self, log: bool) -> dict:
+        """Get the config of the model saved in the registry.
+
+        Args:
+            log (bool): True or False if we want to use a logarithm transformation
+
+        Returns:
+            dict: config of the model
+        """
+        return {
+            'model': type(self).__name__,
+            'regressors': self.regressors,
+            'log': log,
+            'start_date': self.start_date,
+            'training_window': get_training_window(self.data),
+        }
+
     def get_forecast(
         self,
         start_date: str,
@@ -98,7 +223,8 @@ class fbProphetMultivariate():
             Defaults to False.
         Returns:
             pd.DataFrame: Data including all the forecast on the old data and future
-            week after the start date
+            week after the start date, with the column scenario: history,
+            forecast_promo or forecast_no_promo
         """
         start_datetime = dt.datetime.strptime(start_date, '%Y-%m-%d')
         future_datesIsPromo = pd.DataFrame({
@@ -115,17 +241,121 @@ class fbProphetMultivariate():
             future_datesIsPromo[regressor] = 1
             future_datesIsNotPromo[regressor] = 0
 
-        future_dates = pd.concat([
-            self.data[['ds', 'IsPromo'] + self.regressors],
-            future_datesIsPromo,
-            future_datesIsNotPromo,
-        ])
-        forecast = self.model.predict(future_dates)
+        # One prediction by scenario: Prophet sorts the rows by ds, the two
+        # scenarios of the week have the same dates. The column IsPromo of the
+        # forecast is the effect of the regressor, not the scenario.
+        forecast = pd.concat([
+            get_prediction(
+                self.model,
+                future_dates,
+                self.prediction_mode,
+                ['IsPromo'] + self.regressors
+            ).assign(scenario=scenario)
+            for scenario, future_dates in [
+                ('history', self.data[['ds', 'IsPromo'] + self.regressors]),
+                ('forecast_promo', future_datesIsPromo),
+                ('forecast_no_promo', future_datesIsNotPromo),
+            ]
+        ], ignore_index=True)
         if log:
             forecast.yhat = np.exp(forecast.yhat)
 
         return forecast
 
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Predict the UnitSales of new observations with their own IsPromo
+        and regressors, used for the out of sample evaluation.
+
+        Args:
+            df (pd.DataFrame): data with the columns DateKey (or ds), IsPromo
+                and the regressors.
+
+        Returns:
+            pd.DataFrame: the columns ds and yhat, one row by observation sorted by ds.
+        """
+        future_dates = df.rename(columns={'DateKey': 'ds'})[
+            ['ds', 'IsPromo'] + self.regressors
+        ]
+        forecast = get_prediction(self.model, future_dates, 'point', [])
+        if self.log:
+            forecast.yhat = np.exp(forecast.yhat)
+        return forecast[['ds', 'yhat']]
+
+    def get_scenarios(
+        self,
+        scenarios: Dict[str, Dict],
+        start_date: str = None,
+        horizon: int = 7
+    ) -> pd.DataFrame:
+        """Get the forecast of many scenarios of IsPromo and regressors values
+        after the start date, without predicting the history again.
+
+        The trend and the weekly seasonality do not depend on the scenario:
+        they are predicted once for the dates, then the effect of the
+        regressors of all the scenarios is added in one matrix product
+        (the regressors are additive in the Prophet model).
+
+        Example, the two forecasts of get_forecast and a promotion only the weekend:
+            {
+                'promo': {'IsPromo': 1, 'CommunicationChannelCode': 1},
+                'no_promo': {'IsPromo': 0, 'CommunicationChannelCode': 0},
+                'weekend_promo': {'IsPromo': [0, 0, 0, 0, 1, 1, 0]},
+            }
+
+        Args:
+            scenarios (Dict[str, Dict]): name of the scenario -> values of IsPromo and the
+                regressors, one value for all the days or one value by day.
+                A variable missing in a scenario is 0.
+            start_date (str, optional): start date to start the forecast.
+                Defaults to the start_date of the model.
+            horizon (int, optional): number of days to forecast. Defaults to 7.
+
+        Returns:
+            pd.DataFrame: forecast of the UnitSales, one row by scenario and one column by day.
+        """
+        names = ['IsPromo'] + self.regressors
+        for name, scenario in scenarios.items():
+            unknown = set(scenario) - set(names)
+            if unknown:
+                raise ValueError('Unknown regressors {} in the scenario {}'.format(unknown, name))
+
+        start_datetime = dt.datetime.strptime(start_date or self.start_date, '%Y-%m-%d')
+        future_dates = pd.DataFrame({
+            'ds': [start_datetime + dt.timedelta(days=i) for i in range(1, horizon + 1)]
+        })
+        for name in names:
+            future_dates[name] = 0
+
+        # Forecast of the days with all the regressors at 0
+        base = get_prediction(self.model, future_dates, 'point', []).yhat.values
+
+        # Effect of a regressor equal to 1: beta * y_scale / std (standardized regressor)
+        beta = np.mean(self.model.params['beta'], axis=0)
+        coefficients = np.array([
+            np.sum(beta * self.model.train_component_cols[name].values)
+            * self.model.y_scale / self.model.extra_regressors[name]['std']
+            for name in names
+        ])
+
+        # Values of the regressors: scenario x day x regressor
+        values = np.zeros((len(scenarios), horizon, len(names)))
+        for i, scenario in enumerate(scenarios.values()):
+            for j, name in enumerate(names):
+                values[i, :, j] = np.broadcast_to(
+                    np.asarray(scenario.get(name, 0), dtype=float),
+                    horizon
+                )
+
+        yhat = base[np.newaxis, :] + values @ coefficients
+        if self.log:
+            yhat = np.exp(yhat)
+
+        return pd.DataFrame(
+            yhat,
+            index=pd.Index(list(scenarios), name='scenario'),
+            columns=future_dates.ds
+        )
+
     def _get_plot_component(self) -> None:
         """Display the plot of the component of the model
         """
@@ -143,11 +373,7 @@ class fbProphetMultivariate():
         Returns:
             float: rmse of the model
         """
-        rmse = sqrt(mean_squared_error(
-            self.metrics.y,
-            self.metrics.yhat
-        ))
-        return rmse
+        return get_rmse(self.metrics.y, self.metrics.yhat)
 
     def _get_nrmse(self) -> float:
         """Get the nrmse of the model.
@@ -155,8 +381,7 @@ class fbProphetMultivariate():
         Returns:
             float: nrmse of the model
         """
-        nrmse = self.rmse / self.metrics.y.mean()
-        return nrmse
+        return get_nrmse(self.metrics.y, self.metrics.yhat)
 
     def _get_metrics(self) -> pd.DataFrame:
         """Final metrics dataframe including the actual and forecast values
@@ -164,60 +389,58 @@ class fbProphetMultivariate():
         Returns:
             pd.DataFrame: metrics dataframe
         """
-        metrics = self.forecast.merge(
+        # The effects of the regressors in the forecast are suffixed by
+        # _component, IsPromo and the regressors are the observed values
+        metrics = self.forecast[self.forecast.scenario == 'history'].merge(
             self.data[['ds', 'y', 'IsPromo'] + self.regressors],
             how='inner',
-            on='ds'
+            on='ds',
+            suffixes=('_component', '')
         ).sort_values('ds', ascending=False)
 
         return metrics
 
-    def get_vizualisation_metrics(self):
+    def get_vizualisation_metrics(
+        self,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
         """Return the vizualisation on the actual vs forecast data
+
+        Args:
+            resolution (str, optional): day, week, month or lttb, see get_resampled.
+                Defaults to 'lttb'.
+            max_points (int, optional): number of points of each series with lttb.
+                Defaults to 1000.
         """
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            name="Actual",
-            x=self.metrics.ds,
-            y=self.metrics.y,
-        ))
-        fig.add_trace(go.Bar(
-            name="Forecast",
-            x=self.metrics.ds,
-            y=self.metrics.yhat,
-        ))
-        fig.update_layout(title_text='Final Times Series of Daily UniteSales')
-
-        return fig
-
-    def get_vizualisation(self):
+        return get_metrics_figure(
+            self.metrics,
+            resolution=resolution,
+            max_points=max_points,
+            title='Final Times Series of Daily UniteSales'
+        )
+
+    def get_vizualisation(
+        self,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
         """Return the vizualisation on the actual vs forecast data
             split by Pomotion or not and the forecast for the next week
+
+        Args:
+            resolution (str, optional): resolution of the history: day, week, month
+                or lttb, see get_resampled. Defaults to 'lttb'.
+            max_points (int, optional): number of points of each history series
+                with lttb. Defaults to 1000.
         """
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            name="No Promotion",
-            x=self.data[~self.data.IsPromo].ds,
-            y=self.data[~self.data.IsPromo].y,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Promotion",
-            x=self.data[self.data.IsPromo].ds,
-            y=self.data[self.data.IsPromo].y,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Forecast No Promotion",
-            x=self.forecast[self.forecast.IsPromo < 0.1].ds,
-            y=self.forecast[self.forecast.IsPromo < 0.1].yhat,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Forecast Promotion",
-            x=self.forecast[self.forecast.IsPromo > 0.1].ds,
-            y=self.forecast[self.forecast.IsPromo > 0.1].yhat,
-        ))
-
-        fig.update_layout(title_text='Times Series of Daily UniteSales')
-        return fig
+        start_datetime = dt.datetime.strptime(self.start_date, '%Y-%m-%d')
+        future = self.forecast[self.forecast.ds > start_datetime]
+        return get_forecast_figure(
+            self.data,
+            future[future.scenario == 'forecast_no_promo'],
+            future[future.scenario == 'forecast_promo'],
+            resolution=resolution,
+            max_points=max_points,
+            title='Times Series of Daily UniteSales'
+        )
@@ -1,9 +1,17 @@
 from fbprophet import Prophet
 import datetime as dt
+import time
 import pandas as pd
-import plotly.graph_objects as go
-from sklearn.metrics import mean_squared_error
-from math import sqrt
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.pipeline.registry import get_item_name
+from src.ah_forecast_sales.pipeline.registry import get_training_window
+from src.ah_forecast_sales.pipeline.warm_start import fit_prophet
+from src.ah_forecast_sales.pipeline.metrics import get_nrmse
+from src.ah_forecast_sales.pipeline.metrics import get_rmse
+from src.ah_forecast_sales.pipeline.prediction import get_prediction
+from src.ah_forecast_sales.utils.figures import get_forecast_figure
+from src.ah_forecast_sales.utils.figures import get_metrics_figure
+from src.ah_forecast_sales.utils.instrumentation import stage
 
 
 class fbProphetUnivariate():
@@ -18,12 +26,29 @@ class fbProphetUnivariate():
 
     """
 
-    def __init__(self, data: pd.DataFrame, start_date: str) -> None:
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        start_date: str,
+        registry: ModelRegistry = None,
+        warm_start=None,
+        incremental=False,
+        prediction_mode='full'
+    ) -> None:
         """Init the  fbProphetUnivariate Model Class.
 
         Args:
             data (pd.DataFrame): data including the times series to train the model.
             start_date (str): start date to start the forecast of the week.
+            registry (ModelRegistry, optional): registry to load the fitted models from
+                and to save them after a fit. Defaults to None (always fit).
+            warm_start (fbProphetUnivariate, optional): model already fitted on the
+                same times series with less data, its parameters are the starting point
+                of the fits. Defaults to None.
+            incremental (bool, optional): True to warm start from the last models of the
+                ItemNumber saved in the registry. Defaults to False.
+            prediction_mode (str, optional): full, fast or point, see get_prediction.
+                Use point when only yhat is needed. Defaults to 'full'.
         """
         # rename the column to follow the rules of the library
         self.data = data.rename(
@@ -34,51 +59,168 @@ class fbProphetUnivariate():
         )
         data['floor'] = 0
         self.data
-        self.modelIsPromo = self._get_modelIsPromo()
-        self.modelIsNotPromo = self._get_modelIsNotPromo()
-        self.forecastIsPromo = self.get_forecast(
-            start_date,
-            self.modelIsPromo
+        self.start_date = start_date
+        self.registry = registry
+        self.warm_start = warm_start
+        self.incremental = incremental
+        self.prediction_mode = prediction_mode
+        # Name of the model variant and ItemNumber, to tag the stages
+        self.variant = 'univariate'
+        tags = {'item': get_item_name(self.data), 'variant': self.variant}
+
+        # Time in second to fit (or load) the models and to predict
+        self.timings = {}
+        with stage('fit', **tags) as record:
+            self._get_models()
+            record['warm_started'] = self.warm_started
+        self.timings['fit'] = record['wall_time']
+        # Time saved by the warm start compared with the fit from scratch
+        self.timings['fit_saved'] = None
+        if self.warm_started and self.cold_fit_time is not None:
+            self.timings['fit_saved'] = self.cold_fit_time - self.timings['fit']
+        with stage('predict', **tags) as record:
+            self.forecastIsPromo = self.get_forecast(
+                start_date,
+                self.modelIsPromo
+            )
+            self.forecastIsNotPromo = self.get_forecast(
+                start_date,
+                self.modelIsNotPromo
+            )
+        self.timings['predict'] = record['wall_time']
+        with stage('merge_metrics', **tags):
+            self.metrics = self._get_metrics()
+            self.rmse = self._get_rmse()
+            self.nrmse = self._get_nrmse()
+
+    def _get_models(self) -> None:
+        """Load the two models from the registry when the training data
+        and the config are the same, otherwise fit and save them.
+        """
+        if self.registry is not None:
+            key = self.registry.get_key(
+                self.data,
+                ['ds', 'y', 'IsPromo'],
+                self._get_config()
+            )
+            models = self.registry.load(get_item_name(self.data), key)
+            if models is not None:
+                self.modelIsPromo = models['modelIsPromo']
+                self.modelIsNotPromo = models['modelIsNotPromo']
+                self.warm_started, self.cold_fit_time = False, None
+                return
+
+        init_models, cold_fit_time = self._get_init_models()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        self.modelIsPromo, isPromoWarmStarted = self._get_modelIsPromo(
+            init_models.get('modelIsPromo')
         )
-        self.forecastIsNotPromo = self.get_forecast(
-            start_date,
-            self.modelIsNotPromo
+        self.modelIsNotPromo, isNotPromoWarmStarted = self._get_modelIsNotPromo(
+            init_models.get('modelIsNotPromo')
         )
-        self.metrics = self._get_metrics()
-        self.rmse = self._get_rmse()
-        self.nrmse = self._get_nrmse()
+        fit_cpu_time = time.thread_time() - cpu_start
+        # Time of a fit from scratch: measured, or the one of the previous models
+        self.warm_started = isPromoWarmStarted and isNotPromoWarmStarted
+        if self.warm_started:
+            self.cold_fit_time = cold_fit_time
+        elif isPromoWarmStarted or isNotPromoWarmStarted:
+            self.cold_fit_time = None
+        else:
+            self.cold_fit_time = time.perf_counter() - start
 
-    def _get_modelIsPromo(self) -> Prophet:
-        """Get the model for promotion used for the class.
+        if self.registry is not None:
+            self.registry.save(
+                get_item_name(self.data),
+                key,
+                {
+                    'modelIsPromo': self.modelIsPromo,
+                    'modelIsNotPromo': self.modelIsNotPromo,
+                },
+                self._get_config(),
+                self.cold_fit_time,
+                self.warm_started,
+                fit_cpu_time
+            )
+
+    def _get_init_models(self):
+        """Get the models to warm start the fits, from warm_start or from
+        the registry in incremental mode.
+
+        Returns:
+            Tuple[dict, float]: the models by name (empty for a fit from scratch)
+            and the time of their fit from scratch.
+        """
+        if self.warm_start is not None:
+            return {
+                'modelIsPromo': self.warm_start.modelIsPromo,
+                'modelIsNotPromo': self.warm_start.modelIsNotPromo,
+            }, self.warm_start.cold_fit_time
+        if self.incremental and self.registry is not None:
+            latest = self.registry.load_latest(
+                get_item_name(self.data),
+                self._get_config()
+            )
+            if latest is not None:
+                return latest
+        return {}, None
+
+    def _get_config(self) -> dict:
+        """Get the config of the models saved in the registry.
+
+        Returns:
+            dict: config of the models
+        """
+        return {
+            'model': type(self).__name__,
+            'start_date': self.start_date,
+            'training_window': get_training_window(self.data),
+        }
+
+    def _get_prophet(self) -> Prophet:
+        """Get the Prophet model not fitted.
 
         Returns:
             Prophet: Prophet class of the fb prophet library.
-            model where the data isPromo = True
         """
-        model = Prophet(
+        return Prophet(
             interval_width=0.95,
             yearly_seasonality=False,
             weekly_seasonality=True,
             daily_seasonality=False,
         )
-        model.fit(self.data[self.data.IsPromo])
-        return model
 
-    def _get_modelIsNotPromo(self) -> Prophet:
+    def _get_modelIsPromo(self, init_model: Prophet = None):
+        """Get the model for promotion used for the class.
+
+        Args:
+            init_model (Prophet, optional): model to warm start the fit. Defaults to None.
+
+        Returns:
+            Tuple[Prophet, bool]: Prophet class of the fb prophet library,
+            model where the data isPromo = True, and True if it has been warm started.
+        """
+        return fit_prophet(
+            self._get_prophet,
+            self.data[self.data.IsPromo],
+            init_model
+        )
+
+    def _get_modelIsNotPromo(self, init_model: Prophet = None):
         """Get the model for not-promotion used for the class.
 
+        Args:
+            init_model (Prophet, optional): model to warm start the fit. Defaults to None.
+
         Returns:
-            Prophet: Prophet class of the fb prophet library.
-            model where the data isPromo = False
+            Tuple[Prophet, bool]: Prophet class of the fb prophet library,
+            model where the data isPromo = False, and True if it has been warm started.
         """
-        model = Prophet(
-            interval_width=0.95,
-            yearly_seasonality=False,
-            weekly_seasonality=True,
-            daily_seasonality=False
+        return fit_prophet(
+            self._get_prophet,
+            self.data[~self.data.IsPromo],
+            init_model
         )
-        model.fit(self.data[~self.data.IsPromo])
-        return model
 
     def get_forecast(self, start_date: str, model: Prophet) -> pd.DataFrame:
         """Get the DataFrame with the forecast done by the model, on old 
@@ -95,36 +237,52 @@ class fbProphetUnivariate():
         future_dates = pd.DataFrame({
             'ds': [start_datetime + dt.timedelta(days=i) for i in range(1, 8)]
         })
+        # One row by day, the data of a group has a row by day and promotion
         future_dates = pd.concat([
-            self.data[['ds']],
+            self.data[['ds']].drop_duplicates(),
             future_dates
         ])
 
-        forecast = model.predict(future_dates)
+        forecast = get_prediction(model, future_dates, self.prediction_mode, [])
         return forecast
 
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Predict the UnitSales of new observations, with the model of the
+        promotion or not of each observation: used for the out of sample evaluation.
+
+        Args:
+            df (pd.DataFrame): data with the columns DateKey (or ds) and IsPromo.
+
+        Returns:
+            pd.DataFrame: the columns ds and yhat, one row by observation sorted by ds.
+        """
+        future_dates = df.rename(columns={'DateKey': 'ds'})[['ds', 'IsPromo']]
+        isPromo = future_dates.IsPromo.astype(bool)
+        forecast = pd.concat([
+            get_prediction(model, future_dates[rows][['ds']], 'point', [])
+            for model, rows in [
+                (self.modelIsPromo, isPromo),
+                (self.modelIsNotPromo, ~isPromo),
+            ]
+            if rows.any()
+        ])
+        return forecast.sort_values('ds')[['ds', 'yhat']].reset_index(drop=True)
+
     def _get_metrics(self) -> pd.DataFrame:
         """Final metrics dataframe including the actual and forecast values
 
         Returns:
             pd.DataFrame: metrics dataframe
         """
+        # Each observation with the forecast of the model of its promotion, in one merge
         metrics = pd.concat([
-            self.forecastIsPromo.merge(
-                self.data[
-                    self.data.IsPromo
-                ][['ds', 'y', 'IsPromo']],
-                how='inner',
-                on='ds'
-            ),
-            self.forecastIsNotPromo.merge(
-                self.data[
-                    ~self.data.IsPromo
-                ][['ds', 'y', 'IsPromo']],
-                how='inner',
-                on='ds'
-            ),
-        ]).sort_values('ds', ascending=False)
+            self.forecastIsPromo.assign(IsPromo=True),
+            self.forecastIsNotPromo.assign(IsPromo=False),
+        ]).merge(
+            self.data[['ds', 'y', 'IsPromo']],
+            how='inner',
+            on=['ds', 'IsPromo']
+        ).sort_values('ds', ascending=False)
 
         return metrics
 
@@ -148,11 +306,7 @@ class fbProphetUnivariate():
         Returns:
             float: rmse of the model
         """
-        rmse = sqrt(mean_squared_error(
-            self.metrics.y,
-            self.metrics.yhat
-        ))
-        return rmse
+        return get_rmse(self.metrics.y, self.metrics.yhat)
 
     def _get_nrmse(self):
         """Get the nrmse of the model.
@@ -160,56 +314,48 @@ class fbProphetUnivariate():
         Returns:
             float: nrmse of the model
         """
-        nrmse = self.rmse / self.metrics.y.mean()
-        return nrmse
+        return get_nrmse(self.metrics.y, self.metrics.yhat)
 
-    def get_vizualisation_metrics(self) -> pd.DataFrame:
+    def get_vizualisation_metrics(
+        self,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
         """Return the vizualisation on the actual vs forecast data
+
+        Args:
+            resolution (str, optional): day, week, month or lttb, see get_resampled.
+                Defaults to 'lttb'.
+            max_points (int, optional): number of points of each series with lttb.
+                Defaults to 1000.
         """
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            name="Actual",
-            x=self.metrics.ds,
-            y=self.metrics.y,
-        ))
-        fig.add_trace(go.Bar(
-            name="Forecast",
-            x=self.metrics.ds,
-            y=self.metrics.yhat,
-        ))
-        fig.update_layout(title_text='FInale Times Series of Daily UniteSales')
-
-        return fig
-
-    def get_vizualisation(self):
+        return get_metrics_figure(
+            self.metrics,
+            resolution=resolution,
+            max_points=max_points,
+            title='FInale Times Series of Daily UniteSales'
+        )
+
+    def get_vizualisation(
+        self,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
         """Return the vizualisation on the actual vs forecast data
             split by Pomotion or not and the forecast for the next week
+
+        Args:
+            resolution (str, optional): resolution of the history: day, week, month
+                or lttb, see get_resampled. Defaults to 'lttb'.
+            max_points (int, optional): number of points of each history series
+                with lttb. Defaults to 1000.
         """
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            name="No Promotion",
-            x=self.data[~self.data.IsPromo].ds,
-            y=self.data[~self.data.IsPromo].y,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Promotion",
-            x=self.data[self.data.IsPromo].ds,
-            y=self.data[self.data.IsPromo].y,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Forecast No pomotion",
-            x=self.forecastIsNotPromo.ds,
-            y=self.forecastIsNotPromo.yhat,
-        ))
-
-        fig.add_trace(go.Bar(
-            name="Forecast Promotion",
-            x=self.forecastIsPromo.ds,
-            y=self.forecastIsPromo.yhat,
-        ))
-
-        fig.update_layout(
-            title_text='Times Series based Promotion for daily UnitSales')
-        return fig
+        start_datetime = dt.datetime.strptime(self.start_date, '%Y-%m-%d')
+        return get_forecast_figure(
+            self.data,
+            self.forecastIsNotPromo[self.forecastIsNotPromo.ds > start_datetime],
+            self.forecastIsPromo[self.forecastIsPromo.ds > start_datetime],
+            resolution=resolution,
+            max_points=max_points,
+            title='Times Series based Promotion for daily UnitSales'
+        )
@@ -0,0 +1,188 @@
+from src.ah_forecast_sales.utils.instrumentation import stage
+from src.ah_forecast_sales.utils.ttl_cache import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+import flask
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+
+
+# HTTP code of the response of one ItemNumber by status
+STATUS_CODES = {
+    'success': 200,
+    'pending': 202,
+    'not_found': 404,
+    'failed': 500,
+}
+
+
+def get_forecast_json(ItemNumber: str, forecast: pd.DataFrame) -> Dict:
+    """Convert the partition of an ItemNumber to the json of the api:
+    the forecast of the next week with and without promotion, one entry by day.
+    A day with more than one forecast of the same type raises a ValueError,
+    the ItemNumber is failed in the api.
+
+    Args:
+        ItemNumber (str): the ItemNumber of the forecast.
+        forecast (pd.DataFrame): the rows given by read_forecast.
+
+    Returns:
+        Dict: ItemNumber, status, start_date and forecast (ds, yhat_promo
+        and yhat_no_promo of each day).
+    """
+    future = forecast[forecast.type != 'history']
+    duplicated = future.duplicated(['ds', 'type'], keep=False)
+    if duplicated.any():
+        raise ValueError('{} rows with the same ds and type in the forecast of {}'.format(
+            int(duplicated.sum()), ItemNumber
+        ))
+    future = future.set_index(['ds', 'type']).yhat.unstack('type').reindex(
+        columns=['forecast_promo', 'forecast_no_promo']
+    ).sort_index()
+    # NaN is not valid json
+    future = future.astype(object).where(future.notna(), None)
+    return {
+        'ItemNumber': ItemNumber,
+        'status': 'success',
+        'start_date': future.index[0].strftime('%Y-%m-%d') if len(future) else None,
+        'forecast': [
+            {'ds': ds.strftime('%Y-%m-%d'), 'yhat_promo': promo, 'yhat_no_promo': no_promo}
+            for ds, promo, no_promo in zip(
+                future.index, future.forecast_promo, future.forecast_no_promo
+            )
+        ],
+    }
+
+
+class ForecastAPI():
+    """
+        Json api of the forecasts of the next week, on the Flask server of the app:
+        - GET /api/forecast/<ItemNumber>: one ItemNumber
+        - GET /api/forecast?items=a,b or POST /api/forecast {"items": [...]}:
+          many ItemNumber in one request
+        The forecasts are read from the store through a TTLCache, the concurrent
+        requests of the same ItemNumber read its partition once.
+        Without a forecast, submit can start its computation (the ItemNumber is
+        then pending, and not cached).
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Optional[pd.DataFrame]],
+        submit: Optional[Callable[[str], Optional[Dict]]] = None,
+        maxsize: int = 10000,
+        ttl: float = 300,
+        max_items: int = 1000,
+        n_threads: int = 8,
+    ) -> None:
+        """Init the ForecastAPI Class.
+
+        Args:
+            load (Callable[[str], Optional[pd.DataFrame]]): read the forecast of an
+                ItemNumber (see read_forecast), None when there is no forecast.
+            submit (Callable[[str], Optional[Dict]], optional): start the forecast of
+                an ItemNumber without forecast and return its job (see JobQueue.get_status),
+                None if the ItemNumber is unknown. Defaults to None (not_found).
+            maxsize (int, optional): maximum number of ItemNumber in the cache.
+                Defaults to 10000.
+            ttl (float, optional): number of second a forecast stays in the cache,
+                the store rewritten by a retrain is served after at most ttl.
+                Defaults to 300.
+            max_items (int, optional): maximum number of ItemNumber by request.
+                Defaults to 1000.
+            n_threads (int, optional): number of partitions read at the same time
+                for a request of many ItemNumber. Defaults to 8.
+        """
+        self.load = load
+        self.submit = submit
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.max_items = max_items
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+
+    def _get_json(self, ItemNumber: str) -> Optional[Dict]:
+        """Read and convert the forecast of an ItemNumber, called on a miss of the cache."""
+        with stage('api_load', item=ItemNumber):
+            forecast = self.load(ItemNumber)
+        if forecast is None:
+            return None
+        return get_forecast_json(ItemNumber, forecast)
+
+    def get_item(self, ItemNumber: str) -> Dict:
+        """Get the json of an ItemNumber.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            Dict: the json of get_forecast_json, or the ItemNumber with its status
+            (pending, not_found or failed) and error without forecast.
+        """
+        ItemNumber = str(ItemNumber)
+        try:
+            result = self.cache.get(ItemNumber, self._get_json)
+        except Exception as e:
+            return {
+                'ItemNumber': ItemNumber,
+                'status': 'failed',
+                'error': '{}: {}'.format(type(e).__name__, e),
+            }
+        if result is not None:
+            return result
+
+        job = self.submit(ItemNumber) if self.submit is not None else None
+        if job is None:
+            return {'ItemNumber': ItemNumber, 'status': 'not_found'}
+        if job['status'] == 'failed':
+            return {'ItemNumber': ItemNumber, 'status': 'failed', 'error': job['error']}
+        return {'ItemNumber': ItemNumber, 'status': 'pending'}
+
+    def get_items(self, items: List[str]) -> List[Dict]:
+        """Get the json of many ItemNumber, the partitions not in the cache
+        are read in parallel.
+
+        Args:
+            items (List[str]): the ItemNumber wanted.
+
+        Returns:
+            List[Dict]: the json of each ItemNumber (see get_item), in the same order.
+        """
+        return list(self.executor.map(self.get_item, items))
+
+    def register(self, server: flask.Flask, prefix: str = '/api') -> None:
+        """Add the routes of the api to a Flask server.
+
+        Args:
+            server (flask.Flask): the server (app.server of dash).
+            prefix (str, optional): prefix of the routes. Defaults to '/api'.
+        """
+        def get_forecast(ItemNumber):
+            result = self.get_item(ItemNumber)
+            return flask.jsonify(result), STATUS_CODES[result['status']]
+
+        def get_forecasts():
+            if flask.request.method == 'POST':
+                body = flask.request.get_json(silent=True)
+                items = body.get('items') if isinstance(body, dict) else body
+            else:
+                items = [x for x in flask.request.args.get('items', '').split(',') if x]
+            if not isinstance(items, list) or len(items) == 0:
+                return flask.jsonify({'error': 'No ItemNumber in the request'}), 400
+            if len(items) > self.max_items:
+                return flask.jsonify({
+                    'error': 'Maximum {} ItemNumber by request'.format(self.max_items)
+                }), 400
+            with stage('api_batch'):
+                results = self.get_items([str(x) for x in items])
+            return flask.jsonify({'items': results})
+
+        server.add_url_rule(
+            prefix + '/forecast/<ItemNumber>',
+            'api_forecast',
+            get_forecast,
+            methods=['GET']
+        )
+        server.add_url_rule(
+            prefix + '/forecast',
+            'api_forecasts',
+            get_forecasts,
+            methods=['GET', 'POST']
+        )
@@ -0,0 +1,343 @@
+from src.ah_forecast_sales.pipeline.fbProphetMultivariate import fbProphetMultivariate
+from src.ah_forecast_sales.pipeline.fbProphetUnivariate import fbProphetUnivariate
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.figures import get_store_figure
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.parallel import run_items
+from src.ah_forecast_sales.utils.shared_data import open_item_index
+import datetime as dt
+import json
+import os
+import pandas as pd
+from typing import Dict, List, Optional
+
+
+FORECAST_COLUMNS = ['ds', 'type', 'IsPromo', 'y', 'yhat']
+
+
+def _get_partition(path: str, ItemNumber: str) -> str:
+    return os.path.join(path, 'ItemNumber={}'.format(ItemNumber), 'part-0.parquet')
+
+
+def _get_partition_run(path: str, ItemNumber: str) -> str:
+    return os.path.join(path, 'ItemNumber={}'.format(ItemNumber), 'run.json')
+
+
+def get_store_forecast(
+    fb_prophet_forecast: fbProphetMultivariate,
+    start_date: str
+) -> pd.DataFrame:
+    """Get the rows saved in the store for a fitted model:
+    the fitted history and the forecast of the week with and without promotion.
+
+    Args:
+        fb_prophet_forecast (fbProphetMultivariate): the fitted model
+            (or fbProphetUnivariate).
+        start_date (str): start date to start the forecast of the week.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns ds, type, IsPromo, y and yhat.
+        type is history, forecast_promo or forecast_no_promo.
+    """
+    start_datetime = dt.datetime.strptime(start_date, '%Y-%m-%d')
+
+    if isinstance(fb_prophet_forecast, fbProphetUnivariate):
+        # One model by promotion: each day of the history takes the yhat
+        # of the model of its promotion
+        forecast = pd.concat([
+            fb_prophet_forecast.forecastIsPromo.assign(IsPromo=True, scenario='forecast_promo'),
+            fb_prophet_forecast.forecastIsNotPromo.assign(IsPromo=False, scenario='forecast_no_promo'),
+        ], ignore_index=True)
+        history = fb_prophet_forecast.data[['ds', 'IsPromo', 'y']].merge(
+            forecast[forecast.ds <= start_datetime][['ds', 'IsPromo', 'yhat']],
+            how='left',
+            on=['ds', 'IsPromo']
+        )
+    else:
+        forecast = fb_prophet_forecast.forecast
+        history = forecast[(forecast.scenario == 'history') & (forecast.ds <= start_datetime)]
+        history = fb_prophet_forecast.data[['ds', 'IsPromo', 'y']].merge(
+            history[['ds', 'yhat']],
+            how='left',
+            on='ds'
+        )
+    history['type'] = 'history'
+
+    # The scenario is tagged when the future is built, the column IsPromo of
+    # a multivariate forecast is the effect of the regressor
+    future = forecast[(forecast.scenario != 'history') & (forecast.ds > start_datetime)]
+    future = future[['ds', 'yhat', 'scenario']].rename(columns={'scenario': 'type'})
+    future = future.assign(
+        IsPromo=future.type == 'forecast_promo',
+        y=float('nan'),
+    )
+
+    store_forecast = pd.concat([history, future], ignore_index=True)
+    store_forecast['IsPromo'] = store_forecast.IsPromo.astype(bool)
+    return store_forecast[FORECAST_COLUMNS]
+
+
+def get_item_store_forecast(payload: Dict) -> str:
+    """Fit the model of one ItemNumber and write its partition.
+    Executed in a worker process by build_forecast_store.
+
+    Args:
+        payload (Dict): ItemNumber, data of the item and parameters of the model
+            (incremental, univariate and run are optional).
+
+    Returns:
+        str: path of the partition written.
+    """
+    if payload.get('univariate', False):
+        fb_prophet_forecast = fbProphetUnivariate(
+            payload['data'].copy(),
+            start_date=payload['start_date'],
+            registry=payload['registry'],
+            incremental=payload.get('incremental', False),
+            prediction_mode='point',
+        )
+    else:
+        fb_prophet_forecast = fbProphetMultivariate(
+            payload['data'].copy(),
+            start_date=payload['start_date'],
+            regressors=payload['regressors'],
+            log=payload['log'],
+            registry=payload['registry'],
+            incremental=payload.get('incremental', False),
+            prediction_mode='point',
+        )
+    return write_forecast(
+        payload['path'],
+        payload['ItemNumber'],
+        get_store_forecast(fb_prophet_forecast, payload['start_date']),
+        run=payload.get('run')
+    )
+
+
+def build_forecast_store(
+    df: pd.DataFrame,
+    path: str = './assets/forecasts',
+    items: Optional[List[str]] = None,
+    start_date: str = '2018-01-01',
+    regressors: List[str] = ['CommunicationChannelCode'],
+    log: bool = True,
+    registry: Optional[ModelRegistry] = None,
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+    univariate: bool = False,
+    incremental: bool = False,
+    skip_existing: bool = False,
+    run: Optional[Dict] = None,
+) -> pd.DataFrame:
+    """Batch stage: forecast every eligible ItemNumber and write the results
+    in the store, one Parquet partition by ItemNumber.
+    Each partition is written by the worker as soon as its ItemNumber is finished,
+    a run stopped in the middle can be resumed with skip_existing.
+
+    Args:
+        df (pd.DataFrame): The full dataset using to create the models
+        path (str, optional): folder of the store. Defaults to './assets/forecasts'.
+        items (List[str], optional): ItemNumber to forecast.
+            Defaults to all the ItemNumber selected by get_sample.
+        start_date (str, optional): start date to start the forecast of the week.
+            Defaults to '2018-01-01'.
+        regressors (List[str], optional): regressors of the fbProphetMultivariate model.
+            Defaults to ['CommunicationChannelCode'].
+        log (bool, optional): True or False if we want to use a logarithm transformation.
+            Defaults to True.
+        registry (ModelRegistry, optional): registry of the fitted models. Defaults to None.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for one ItemNumber.
+            Defaults to None (no limit).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (created, see open_item_index).
+        univariate (bool, optional): True to use fbProphetUnivariate in place of
+            fbProphetMultivariate (regressors and log are not used). Defaults to False.
+        incremental (bool, optional): True to warm start from the last model of the
+            ItemNumber saved in the registry. Defaults to False.
+        skip_existing (bool, optional): True to skip the ItemNumber which already
+            have a partition in the store (completed by the same run when run
+            is given). Defaults to False.
+        run (Dict, optional): parameters of the run, written with each partition
+            (see write_partition). Defaults to None.
+
+    Returns:
+        pd.DataFrame: status, error and elapsed time for each ItemNumber
+    """
+    if items is None:
+        items = get_sample(df, sample_extract=False).ItemNumber.tolist()
+    if skip_existing:
+        existing = set(get_forecast_items(path, run))
+        items = [x for x in items if str(x) not in existing]
+
+    # With workers, the data is published once in a file mapped by the workers
+    with open_item_index(df, n_workers, item_index) as item_index:
+        payloads = (
+            (ItemNumber, {
+                'ItemNumber': ItemNumber,
+                'data': item_index.get_payload(ItemNumber),
+                'path': path,
+                'start_date': start_date,
+                'regressors': regressors,
+                'log': log,
+                'registry': registry,
+                'univariate': univariate,
+                'incremental': incremental,
+                'run': run,
+            })
+            for ItemNumber in items
+            if ItemNumber in item_index
+        )
+
+        return pd.DataFrame([
+            {
+                'ItemNumber': output['key'],
+                'status': output['status'],
+                'error': output['error'],
+                'elapsed': output['elapsed'],
+            }
+            for output in run_items(get_item_store_forecast, payloads, n_workers, timeout)
+        ], columns=['ItemNumber', 'status', 'error', 'elapsed'])
+
+
+def write_partition(
+    path: str,
+    ItemNumber: str,
+    df: pd.DataFrame,
+    run: Optional[Dict] = None
+) -> str:
+    """Write the partition of an ItemNumber in a folder partitioned by ItemNumber
+    (ItemNumber=<item>/part-0.parquet), with the parameters of the run which
+    completed it (ItemNumber=<item>/run.json).
+
+    Args:
+        path (str): folder of the partitions.
+        ItemNumber (str): the ItemNumber of the rows.
+        df (pd.DataFrame): the rows of the ItemNumber.
+        run (Dict, optional): parameters of the run, the partition is complete
+            for these parameters (see get_forecast_items). Defaults to None
+            (not complete for any run).
+
+    Returns:
+        str: path of the partition written.
+    """
+    file = _get_partition(path, ItemNumber)
+    run_file = _get_partition_run(path, ItemNumber)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    # The run of the old partition is removed first, a partition is never
+    # taken for complete by the run of another one
+    if os.path.exists(run_file):
+        os.remove(run_file)
+    # Write in a temporary file first, the app never read a partial partition
+    df.to_parquet(file + '.tmp', index=False)
+    os.replace(file + '.tmp', file)
+    if run is not None:
+        with open(run_file + '.tmp', 'w') as f:
+            json.dump(run, f, sort_keys=True)
+        os.replace(run_file + '.tmp', run_file)
+    return file
+
+
+def write_forecast(
+    path: str,
+    ItemNumber: str,
+    forecast: pd.DataFrame,
+    run: Optional[Dict] = None
+) -> str:
+    """Write the partition of an ItemNumber in the store.
+
+    Args:
+        path (str): folder of the store.
+        ItemNumber (str): the ItemNumber of the forecast.
+        forecast (pd.DataFrame): the rows given by get_store_forecast.
+        run (Dict, optional): parameters of the run (see write_partition).
+            Defaults to None.
+
+    Returns:
+        str: path of the partition written.
+    """
+    return write_partition(path, ItemNumber, forecast, run)
+
+
+def _is_same_run(path: str, ItemNumber: str, run: Dict) -> bool:
+    """True if the partition of an ItemNumber was completed by the run,
+    compared after the same json round trip than the written run (tuples become lists, ...).
+    """
+    return _get_run(path, ItemNumber) == json.loads(json.dumps(run, sort_keys=True))
+
+
+def _get_run(path: str, ItemNumber: str) -> Optional[Dict]:
+    """Parameters of the run which completed the partition of an ItemNumber."""
+    run_file = _get_partition_run(path, ItemNumber)
+    if not os.path.exists(run_file):
+        return None
+    with open(run_file) as f:
+        return json.load(f)
+
+
+def read_forecast(
+    path: str,
+    ItemNumber: str,
+    run: Optional[Dict] = None
+) -> Optional[pd.DataFrame]:
+    """Read the partition of one ItemNumber.
+
+    Args:
+        path (str): folder of the store.
+        ItemNumber (str): the ItemNumber wanted.
+        run (Dict, optional): parameters of a run, to read only a partition
+            written by a run with the same parameters. Defaults to None (any run).
+
+    Returns:
+        pd.DataFrame: the rows given by get_store_forecast, None if the ItemNumber is not in the store.
+    """
+    file = _get_partition(path, ItemNumber)
+    if not os.path.exists(file):
+        return None
+    if run is not None and not _is_same_run(path, ItemNumber, run):
+        return None
+    return pd.read_parquet(file)
+
+
+def get_forecast_items(path: str, run: Optional[Dict] = None) -> List[str]:
+    """Get the list of ItemNumber available in the store.
+
+    Args:
+        path (str): folder of the store.
+        run (Dict, optional): parameters of a run, to keep only the ItemNumber
+            completed with the same parameters. Defaults to None (all the ItemNumber).
+
+    Returns:
+        List[str]: the ItemNumber with a partition, empty if the store does not exist.
+    """
+    if not os.path.isdir(path):
+        return []
+    items = sorted(
+        folder.split('=', 1)[1]
+        for folder in os.listdir(path)
+        if folder.startswith('ItemNumber=')
+        and os.path.exists(os.path.join(path, folder, 'part-0.parquet'))
+    )
+    if run is None:
+        return items
+    return [x for x in items if _is_same_run(path, x, run)]
+
+
+def get_forecast_vizualisation(
+    forecast: pd.DataFrame,
+    resolution: str = 'lttb',
+    max_points: int = 1000
+):
+    """Return the vizualisation of a partition of the store, same figure
+    than fbProphetMultivariate.get_vizualisation without the model.
+
+    Args:
+        forecast (pd.DataFrame): the rows given by read_forecast.
+        resolution (str, optional): resolution of the history: day, week, month
+            or lttb, see get_resampled. Defaults to 'lttb'.
+        max_points (int, optional): number of points of each history series
+            with lttb. Defaults to 1000.
+    """
+    return get_store_figure(forecast, resolution=resolution, max_points=max_points)
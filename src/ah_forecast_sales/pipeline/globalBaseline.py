@@ -0,0 +1,326 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+from src.ah_forecast_sales.pipeline.metrics import get_metrics_table
+from src.ah_forecast_sales.pipeline.metrics import get_nrmse
+from src.ah_forecast_sales.pipeline.metrics import get_rmse
+from src.ah_forecast_sales.utils.figures import get_forecast_figure
+from src.ah_forecast_sales.utils.figures import get_metrics_figure
+from src.ah_forecast_sales.utils.instrumentation import stage
+
+
+class globalBaseline():
+    """
+        Model Class to forecast the Unit Sales of all the ItemNumber at once:
+        - one linear model by ItemNumber with a trend, the weekly seasonality,
+          IsPromo and the regressors
+        - the least squares of all the ItemNumber are solved together with numpy
+        There is no Stan fit: the whole catalogue is forecast in about a second,
+        a fallback for the low volume ItemNumber and a reference for the evaluation.
+        Same interface than fbProphetMultivariate, with the column ItemNumber
+        in forecast and metrics.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        start_date: str,
+        regressors=[],
+        log=False,
+        prediction_mode='point',
+        ridge=1e-3
+    ) -> None:
+        """Init the globalBaseline Model Class.
+
+        Args:
+            data (pd.DataFrame): data including the times series of one or many ItemNumber.
+            start_date (str): start date to start the forecast of the week.
+            regressors (list, optional): list of variable we want to use as regressors
+                . Defaults to [].
+            log (bool): True or False if we want to use a logarithm transformation
+            Defaults to False.
+            prediction_mode (str, optional): only point, the model has no uncertainty
+                interval. Defaults to 'point'.
+            ridge (float, optional): regularisation of the least squares, the
+                coefficient of a variable always 0 for an ItemNumber is 0. Defaults to 1e-3.
+        """
+        # rename the column to follow the rules of the library
+        self.data = data.rename(
+            columns={
+                'DateKey': 'ds',
+                'UnitSales': 'y'
+            }
+        )
+        if 'ItemNumber' not in self.data:
+            self.data = self.data.assign(ItemNumber='unknown')
+
+        self.regressors = regressors
+        self.start_date = start_date
+        self.log = log
+        self.prediction_mode = prediction_mode
+        self.ridge = ridge
+        self.features = (
+            ['intercept', 'trend']
+            + ['weekday_{}'.format(i) for i in range(1, 7)]
+            + ['IsPromo']
+            + regressors
+        )
+        codes, items = pd.factorize(self.data.ItemNumber.astype(str), sort=True)
+        self.codes = codes
+        self.items = np.asarray(items)
+        self.origin = self.data.ds.min()
+
+        # Name in MODEL_VARIANTS (imported here, evaluation imports the model classes)
+        from src.ah_forecast_sales.pipeline.evaluation import get_variant_name
+        self.variant = get_variant_name(type(self), regressors, log)
+        tags = {
+            'item': self.items[0] if len(self.items) == 1 else 'all',
+            'variant': self.variant
+        }
+
+        # Time in second to fit the model and to predict
+        self.timings = {'fit_saved': None}
+        with stage('fit', **tags) as record:
+            self.coefficients = self._get_coefficients()
+        self.timings['fit'] = record['wall_time']
+        with stage('predict', **tags) as record:
+            self.forecast = self.get_forecast(start_date)
+        self.timings['predict'] = record['wall_time']
+        with stage('merge_metrics', **tags):
+            self.metrics = self._get_metrics()
+            self.rmse = self._get_rmse()
+            self.nrmse = self._get_nrmse()
+            self.item_metrics = self._get_item_metrics()
+
+    def _get_features(self, df: pd.DataFrame) -> np.ndarray:
+        """Get the matrix of the variables of the linear model.
+
+        Args:
+            df (pd.DataFrame): data with the columns ds, IsPromo and the regressors.
+
+        Returns:
+            np.ndarray: one row by observation and one column by feature.
+        """
+        trend = (df.ds - self.origin).dt.days.values / 365
+        weekday = df.ds.dt.weekday.values
+        return np.column_stack(
+            [np.ones(len(df)), trend]
+            + [(weekday == i).astype(float) for i in range(1, 7)]
+            + [df[x].values.astype(float) for x in ['IsPromo'] + self.regressors]
+        )
+
+    def _get_coefficients(self) -> pd.DataFrame:
+        """Solve the least squares of every ItemNumber.
+        X'X and X'y of all the ItemNumber are summed with one bincount by
+        couple of features, then the small systems are solved in one call.
+
+        Returns:
+            pd.DataFrame: coefficients, one row by ItemNumber and one column by feature.
+        """
+        X = self._get_features(self.data)
+        y = self.data.y.values.astype(float)
+        if self.log:
+            y = np.log(y)
+
+        n_items, p = len(self.items), X.shape[1]
+        xtx = np.empty((n_items, p, p))
+        xty = np.empty((n_items, p))
+        for j in range(p):
+            xty[:, j] = np.bincount(self.codes, weights=X[:, j] * y, minlength=n_items)
+            for k in range(j, p):
+                xtx[:, j, k] = np.bincount(
+                    self.codes,
+                    weights=X[:, j] * X[:, k],
+                    minlength=n_items
+                )
+                xtx[:, k, j] = xtx[:, j, k]
+        xtx += self.ridge * np.eye(p)
+
+        coefficients = np.linalg.solve(xtx, xty[..., np.newaxis])[..., 0]
+        return pd.DataFrame(
+            coefficients,
+            index=pd.Index(self.items, name='ItemNumber'),
+            columns=self.features
+        )
+
+    def get_forecast(self, start_date: str) -> pd.DataFrame:
+        """Get the DataFrame with the forecast done by the model, on old
+        and future week after the start date, for every ItemNumber.
+
+        Args:
+            start_date (str): start date to start the forecast of the week.
+        Returns:
+            pd.DataFrame: Data including all the forecast on the old data and future
+            week after the start date, with the columns ItemNumber and scenario
+            (history, forecast_promo or forecast_no_promo).
+        """
+        start_datetime = dt.datetime.strptime(start_date, '%Y-%m-%d')
+        n_items = len(self.items)
+        future_dates = pd.DataFrame({
+            'ds': pd.to_datetime(np.tile(
+                [start_datetime + dt.timedelta(days=i) for i in range(1, 8)],
+                n_items
+            ))
+        })
+        future_codes = np.repeat(np.arange(n_items), 7)
+
+        future_datesIsPromo = future_dates.assign(IsPromo=True)
+        future_datesIsNotPromo = future_dates.assign(IsPromo=False)
+        for regressor in self.regressors:
+            future_datesIsPromo[regressor] = 1
+            future_datesIsNotPromo[regressor] = 0
+
+        forecast = pd.concat([
+            self.data[['ds', 'IsPromo'] + self.regressors],
+            future_datesIsPromo,
+            future_datesIsNotPromo,
+        ], ignore_index=True)
+        codes = np.concatenate([self.codes, future_codes, future_codes])
+
+        yhat = np.sum(
+            self._get_features(forecast) * self.coefficients.values[codes],
+            axis=1
+        )
+        if self.log:
+            yhat = np.exp(yhat)
+
+        forecast['IsPromo'] = forecast.IsPromo.astype(float)
+        forecast.insert(0, 'ItemNumber', self.items[codes])
+        forecast['yhat'] = yhat
+        forecast['scenario'] = np.repeat(
+            ['history', 'forecast_promo', 'forecast_no_promo'],
+            [len(self.data), len(future_codes), len(future_codes)]
+        )
+        return forecast
+
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Predict the UnitSales of new observations with their own IsPromo
+        and regressors, used for the out of sample evaluation.
+
+        Args:
+            df (pd.DataFrame): data with the columns ItemNumber (when the model
+                has many ItemNumber), DateKey (or ds), IsPromo and the regressors.
+
+        Returns:
+            pd.DataFrame: the columns ItemNumber, ds and yhat, one row by
+            observation in the same order.
+        """
+        df = df.rename(columns={'DateKey': 'ds'})
+        if 'ItemNumber' in df:
+            items = df.ItemNumber.astype(str).values
+        else:
+            items = self.items[[0] * len(df)]
+        codes = np.minimum(np.searchsorted(self.items, items), len(self.items) - 1)
+        unknown = self.items[codes] != items
+        if unknown.any():
+            raise ValueError('Unknown ItemNumber {}'.format(sorted(set(items[unknown]))))
+
+        yhat = np.sum(self._get_features(df) * self.coefficients.values[codes], axis=1)
+        if self.log:
+            yhat = np.exp(yhat)
+        return pd.DataFrame({'ItemNumber': items, 'ds': df.ds.values, 'yhat': yhat})
+
+    def _get_metrics(self) -> pd.DataFrame:
+        """Final metrics dataframe including the actual and forecast values
+
+        Returns:
+            pd.DataFrame: metrics dataframe
+        """
+        # The first rows of the forecast are the history, in the same order
+        metrics = self.forecast.iloc[:len(self.data)].assign(
+            y=self.data.y.values,
+            IsPromo=self.data.IsPromo.values
+        )
+        return metrics.sort_values('ds', ascending=False)
+
+    def _get_rmse(self) -> float:
+        """Get the rmse of the model, on all the ItemNumber.
+
+        Returns:
+            float: rmse of the model
+        """
+        return get_rmse(self.metrics.y, self.metrics.yhat)
+
+    def _get_nrmse(self) -> float:
+        """Get the nrmse of the model, on all the ItemNumber.
+
+        Returns:
+            float: nrmse of the model
+        """
+        return get_nrmse(self.metrics.y, self.metrics.yhat)
+
+    def _get_item_metrics(self) -> pd.DataFrame:
+        """Get the metrics of each ItemNumber, in one pass on all the ItemNumber.
+
+        Returns:
+            pd.DataFrame: one row by ItemNumber with the metrics of get_metrics_table.
+        """
+        return get_metrics_table(
+            self.data.y.values,
+            self.forecast.yhat.values[:len(self.data)],
+            groups=self.items[self.codes],
+            isPromo=self.data.IsPromo.values
+        )
+
+    def get_item_forecast(self, ItemNumber: str) -> pd.DataFrame:
+        """Get the forecast of one ItemNumber.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            pd.DataFrame: the rows of forecast for the ItemNumber.
+        """
+        return self.forecast[self.forecast.ItemNumber == str(ItemNumber)]
+
+    def get_vizualisation_metrics(
+        self,
+        ItemNumber: str = None,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
+        """Return the vizualisation on the actual vs forecast data of an ItemNumber
+
+        Args:
+            ItemNumber (str, optional): the ItemNumber. Defaults to the first one.
+            resolution (str, optional): day, week, month or lttb, see get_resampled.
+                Defaults to 'lttb'.
+            max_points (int, optional): number of points of each series with lttb.
+                Defaults to 1000.
+        """
+        ItemNumber = self.items[0] if ItemNumber is None else str(ItemNumber)
+        return get_metrics_figure(
+            self.metrics[self.metrics.ItemNumber == ItemNumber],
+            resolution=resolution,
+            max_points=max_points,
+            title='Final Times Series of Daily UniteSales'
+        )
+
+    def get_vizualisation(
+        self,
+        ItemNumber: str = None,
+        resolution: str = 'lttb',
+        max_points: int = 1000
+    ):
+        """Return the vizualisation on the actual vs forecast data of an ItemNumber
+            split by Pomotion or not and the forecast for the next week
+
+        Args:
+            ItemNumber (str, optional): the ItemNumber. Defaults to the first one.
+            resolution (str, optional): resolution of the history: day, week, month
+                or lttb, see get_resampled. Defaults to 'lttb'.
+            max_points (int, optional): number of points of each history series
+                with lttb. Defaults to 1000.
+        """
+        ItemNumber = self.items[0] if ItemNumber is None else str(ItemNumber)
+        start_datetime = dt.datetime.strptime(self.start_date, '%Y-%m-%d')
+        forecast = self.get_item_forecast(ItemNumber)
+        future = forecast[forecast.ds > start_datetime]
+        return get_forecast_figure(
+            self.data[self.items[self.codes] == ItemNumber],
+            future[future.scenario == 'forecast_no_promo'],
+            future[future.scenario == 'forecast_promo'],
+            resolution=resolution,
+            max_points=max_points,
+            title='Times Series of Daily UniteSales'
+        )
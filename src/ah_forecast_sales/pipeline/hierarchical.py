@@ -0,0 +1,302 @@
+from src.ah_forecast_sales.pipeline.fbProphetUnivariate import fbProphetUnivariate
+from src.ah_forecast_sales.pipeline.forecast_store import FORECAST_COLUMNS
+from src.ah_forecast_sales.pipeline.forecast_store import get_store_forecast
+from src.ah_forecast_sales.pipeline.forecast_store import write_forecast
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.exploratory_analysis import get_sample
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.parallel import run_items
+from src.ah_forecast_sales.utils.shared_data import open_item_index
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+
+# Levels of the hierarchy of the ItemNumber
+LEVELS = ['CategoryCode', 'GroupCode']
+
+# Columns of the status of the groups given by get_hierarchical_forecast
+GROUP_COLUMNS = ['group', 'n_items', 'status', 'error', 'elapsed']
+
+# Columns of the reconciled totals given by get_hierarchical_forecast
+TOTAL_COLUMNS = ['group', 'ds', 'type', 'yhat', 'yhat_items']
+
+
+def get_group_name(level: str, group: str) -> str:
+    """Name of the times series of a group, used as its ItemNumber ('CategoryCode=x')."""
+    return '{}={}'.format(level, group)
+
+
+def _get_group_names(serie: pd.Series, level: str) -> pd.Series:
+    """Name of the group of each row, get_group_name is called once by category."""
+    serie = serie.astype('category')
+    return serie.cat.rename_categories([
+        get_group_name(level, x) for x in serie.cat.categories
+    ])
+
+
+def get_group_data(df: pd.DataFrame, level: str = 'CategoryCode') -> pd.DataFrame:
+    """Aggregate the daily UnitSales of the ItemNumber of each group, apart
+    for the ItemNumber in promotion and the ones not in promotion: IsPromo
+    stays binary, each scenario is a times series of the group.
+
+    Args:
+        df (pd.DataFrame): proceed data with the column level.
+        level (str, optional): CategoryCode or GroupCode. Defaults to 'CategoryCode'.
+
+    Returns:
+        pd.DataFrame: one row by group, DateKey and IsPromo with the columns
+        ItemNumber (name of the group), DateKey, IsPromo and UnitSales (mean
+        UnitSales of the ItemNumber of the group in this promotion).
+    """
+    if level not in LEVELS:
+        raise ValueError('Unknown level {}, expected one of {}'.format(level, LEVELS))
+    group = df.assign(IsPromo=df.IsPromo.astype(bool)).groupby(
+        [level, 'DateKey', 'IsPromo'], observed=True
+    ).agg(
+        UnitSales=('UnitSales', 'mean'),
+    ).reset_index()
+    group['ItemNumber'] = _get_group_names(group[level], level)
+    return group[['ItemNumber', 'DateKey', 'UnitSales', 'IsPromo']]
+
+
+def get_item_factors(df: pd.DataFrame, level: str = 'CategoryCode') -> pd.DataFrame:
+    """Get the historical level of each ItemNumber relative to the mean
+    ItemNumber of its group, on the days with and without promotion of the
+    ItemNumber (UnitSales of the ItemNumber / mean UnitSales of the ItemNumber
+    of the group in the same promotion, see get_group_data).
+    The factors are normalized to a mean of 1 within each group for each
+    scenario: when no ItemNumber is in promotion, the forecasts of the
+    ItemNumber sum to the UnitSales of the group.
+
+    Args:
+        df (pd.DataFrame): proceed data with the column level.
+        level (str, optional): CategoryCode or GroupCode. Defaults to 'CategoryCode'.
+
+    Returns:
+        pd.DataFrame: one row by ItemNumber with the columns group,
+        factor_promo and factor_no_promo.
+    """
+    tmp = df[[level, 'DateKey', 'ItemNumber', 'IsPromo', 'UnitSales']].copy()
+    tmp['ItemNumber'] = tmp.ItemNumber.astype(str)
+    tmp['IsPromo'] = tmp.IsPromo.astype(bool)
+    tmp['group'] = _get_group_names(tmp[level], level)
+    group_sales = tmp.groupby(
+        ['group', 'DateKey', 'IsPromo'], observed=True
+    ).UnitSales.transform('mean')
+    # A day without sales in the group says nothing on the level of the ItemNumber
+    tmp['factor'] = tmp.UnitSales / group_sales.where(group_sales != 0)
+
+    factors = tmp.groupby(['ItemNumber', 'IsPromo']).factor.mean().unstack('IsPromo')
+    factors = factors.reindex(columns=[True, False])
+    factors.columns = ['factor_promo', 'factor_no_promo']
+    # An ItemNumber never (or always) in promotion keeps its other factor,
+    # without any sale in its group it is the mean ItemNumber
+    factors['factor_promo'] = factors.factor_promo.fillna(factors.factor_no_promo)
+    factors['factor_no_promo'] = factors.factor_no_promo.fillna(factors.factor_promo)
+    factors = factors.fillna(1.0)
+    factors['group'] = tmp.groupby('ItemNumber').group.first().astype(str)
+
+    for column in ['factor_promo', 'factor_no_promo']:
+        mean = factors.groupby('group')[column].transform('mean')
+        factors[column] = (factors[column] / mean).fillna(1.0)
+    return factors
+
+
+def _get_group_forecast(payload: Dict) -> pd.DataFrame:
+    """Fit the models of one group and get its forecast: one model by
+    promotion (fbProphetUnivariate), each one on the mean UnitSales of the
+    ItemNumber of the group in this promotion.
+    Executed in a worker process by get_hierarchical_forecast.
+
+    Args:
+        payload (Dict): name of the group, its data and the parameters of the model.
+
+    Returns:
+        pd.DataFrame: the rows given by get_store_forecast for the group.
+    """
+    fb_prophet_forecast = fbProphetUnivariate(
+        payload['data'].copy(),
+        start_date=payload['start_date'],
+        registry=payload['registry'],
+        prediction_mode='point',
+    )
+    return get_store_forecast(fb_prophet_forecast, payload['start_date'])
+
+
+def _get_item_forecast(
+    group_forecast: pd.DataFrame,
+    item_data: pd.DataFrame,
+    factor: pd.Series
+) -> pd.DataFrame:
+    """Disaggregate the forecast of a group to one of its ItemNumber: the
+    forecast of the mean ItemNumber of the group in a promotion, times the
+    factor of the ItemNumber in this promotion. The forecast_promo of the
+    ItemNumber is the one of this ItemNumber in promotion, whatever the
+    promotion of the other ItemNumber of the group.
+
+    Args:
+        group_forecast (pd.DataFrame): the rows given by get_store_forecast for the group.
+        item_data (pd.DataFrame): proceed data of the ItemNumber.
+        factor (pd.Series): factors of the ItemNumber given by get_item_factors.
+
+    Returns:
+        pd.DataFrame: the FORECAST_COLUMNS for the ItemNumber.
+    """
+    # History: each day takes the forecast of the promotion of the ItemNumber
+    history = item_data[['DateKey', 'IsPromo', 'UnitSales']].rename(
+        columns={'DateKey': 'ds', 'UnitSales': 'y'}
+    )
+    history['IsPromo'] = history.IsPromo.astype(bool)
+    history = history.merge(
+        group_forecast[group_forecast.type == 'history'][['ds', 'IsPromo', 'yhat']],
+        how='left',
+        on=['ds', 'IsPromo']
+    )
+    history['yhat'] *= history.IsPromo.map({
+        True: factor.factor_promo,
+        False: factor.factor_no_promo,
+    }).astype(float)
+    history['type'] = 'history'
+
+    future = group_forecast[group_forecast.type != 'history'].copy()
+    future['yhat'] *= future.type.map({
+        'forecast_promo': factor.factor_promo,
+        'forecast_no_promo': factor.factor_no_promo,
+    }).astype(float)
+
+    item_forecast = pd.concat([history, future], ignore_index=True)
+    item_forecast['IsPromo'] = item_forecast.IsPromo.astype(bool)
+    return item_forecast[FORECAST_COLUMNS]
+
+
+def _get_group_total(
+    group: str,
+    group_forecast: pd.DataFrame,
+    item_forecasts: List[pd.DataFrame],
+    n_items: int,
+) -> pd.DataFrame:
+    """Reconcile the forecast of a group with the forecasts of its ItemNumber:
+    the total of the group (n_items times the mean ItemNumber) and the sum of
+    the forecasts of its ItemNumber for each forecasted day and scenario.
+    A ValueError is raised when they do not match (factors not normalized).
+    """
+    future = group_forecast[group_forecast.type != 'history']
+    total = future.groupby(['ds', 'type']).yhat.sum().mul(n_items).rename('yhat')
+    items = pd.concat(item_forecasts, ignore_index=True)
+    items = items[items.type != 'history'].groupby(['ds', 'type']).yhat.sum()
+    total = total.to_frame().join(items.rename('yhat_items'), how='left').reset_index()
+    total['group'] = group
+    if not np.allclose(total.yhat, total.yhat_items, rtol=1e-6, equal_nan=True):
+        raise ValueError(
+            'The forecasts of the ItemNumber of {} do not sum to its forecast'.format(group)
+        )
+    return total[TOTAL_COLUMNS]
+
+
+def get_hierarchical_forecast(
+    df: pd.DataFrame,
+    level: str = 'CategoryCode',
+    items: Optional[List[str]] = None,
+    start_date: str = '2018-01-01',
+    registry: Optional[ModelRegistry] = None,
+    path: Optional[str] = None,
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Forecast the ItemNumber without enough observations for their own model:
+    one fbProphetUnivariate model by group (CategoryCode or GroupCode) on the
+    daily mean UnitSales of the ItemNumber of the group, with and without
+    promotion, disaggregated to its ItemNumber with their historical factors
+    (see get_item_factors). One fit by group instead of one by ItemNumber.
+    The groups and the factors are computed on the ItemNumber forecasted only,
+    so the forecasts of the ItemNumber of a group sum to n_items times the
+    forecast of the group, checked in the reconciled totals.
+
+    Args:
+        df (pd.DataFrame): The full dataset, with the column level.
+        level (str, optional): CategoryCode or GroupCode. Defaults to 'CategoryCode'.
+        items (List[str], optional): ItemNumber to forecast. Defaults to all the
+            ItemNumber not selected by get_sample (the long tail).
+        start_date (str, optional): start date to start the forecast of the week.
+            Defaults to '2018-01-01'.
+        registry (ModelRegistry, optional): registry of the fitted models of the groups.
+            Defaults to None.
+        path (str, optional): folder of the forecast store, to write the partition
+            of each ItemNumber. Defaults to None (not written).
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        timeout (float, optional): maximum number of second for one group.
+            Defaults to None (no limit).
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: the FORECAST_COLUMNS with
+        the columns ItemNumber and group, for the ItemNumber of the groups fitted,
+        the GROUP_COLUMNS of each group (status, error of a failed group, ...) and
+        the TOTAL_COLUMNS of each group fitted by forecasted day and scenario
+        (yhat the total of the group, yhat_items the sum of its ItemNumber).
+    """
+    all_items = df.ItemNumber.astype(str)
+    if items is None:
+        selected = get_sample(df, sample_extract=False).ItemNumber.astype(str)
+        items = sorted(set(all_items) - set(selected))
+    items = [str(x) for x in items]
+
+    df_items = df[all_items.isin(items).values]
+    factors = get_item_factors(df_items, level)
+    groups = factors.group.unique().tolist()
+
+    item_index = ItemIndex(df_items)
+    forecasts = []
+    status = []
+    totals = []
+    # With workers, the data of the groups is published once in a mapped file
+    with open_item_index(get_group_data(df_items, level), n_workers) as group_index:
+        payloads = (
+            (group, {
+                'data': group_index.get_payload(group),
+                'start_date': start_date,
+                'registry': registry,
+            })
+            for group in groups
+            if group in group_index
+        )
+
+        for output in run_items(_get_group_forecast, payloads, n_workers, timeout):
+            group_factors = factors[factors.group == output['key']]
+            status.append({
+                'group': output['key'],
+                'n_items': len(group_factors),
+                'status': output['status'],
+                'error': output['error'],
+                'elapsed': output['elapsed'],
+            })
+            if output['status'] != 'success':
+                continue
+            group_forecasts = []
+            for ItemNumber, factor in group_factors.iterrows():
+                item_forecast = _get_item_forecast(
+                    output['result'],
+                    item_index.get(ItemNumber),
+                    factor
+                )
+                if path is not None:
+                    write_forecast(path, ItemNumber, item_forecast)
+                group_forecasts.append(item_forecast.assign(
+                    ItemNumber=ItemNumber,
+                    group=output['key']
+                ))
+            forecasts.extend(group_forecasts)
+            totals.append(_get_group_total(
+                output['key'], output['result'], group_forecasts, len(group_factors)
+            ))
+
+    status = pd.DataFrame(status, columns=GROUP_COLUMNS)
+    if not forecasts:
+        return (
+            pd.DataFrame(columns=['ItemNumber', 'group'] + FORECAST_COLUMNS),
+            status,
+            pd.DataFrame(columns=TOTAL_COLUMNS)
+        )
+    forecasts = pd.concat(forecasts, ignore_index=True)
+    totals = pd.concat(totals, ignore_index=True)
+    return forecasts[['ItemNumber', 'group'] + FORECAST_COLUMNS], status, totals
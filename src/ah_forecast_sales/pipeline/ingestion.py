@@ -0,0 +1,193 @@
+from src.ah_forecast_sales.pipeline.forecast_store import get_item_store_forecast
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.exploratory_analysis import BATCH_PATH
+from src.ah_forecast_sales.utils.exploratory_analysis import CACHE_PATH
+from src.ah_forecast_sales.utils.exploratory_analysis import DATA_PATH
+from src.ah_forecast_sales.utils.exploratory_analysis import _get_raw_fingerprint
+from src.ah_forecast_sales.utils.exploratory_analysis import append_proceed_data
+from src.ah_forecast_sales.utils.exploratory_analysis import get_procceed_data
+from src.ah_forecast_sales.utils.job_queue import JobQueue
+import os
+import pandas as pd
+import shutil
+import time
+from typing import Dict, List, Optional
+
+
+class Ingestion():
+    """
+        Ingestion of the new batches of data dropped in a folder
+        (in place of the events of the S3 bucket):
+        - each new parquet file is saved in the batches, cleaned and appended
+          to the proceed data
+        - the file is moved to processed/ (or failed/) in the drop folder
+        - only the ItemNumber of the batch are retrained and their forecast
+          written in the store, through a JobQueue
+        A day with 5% of the ItemNumber changed costs about 5% of a full retrain.
+    """
+
+    def __init__(
+        self,
+        drop_path: str = './assets/drop',
+        path: str = DATA_PATH,
+        cache_path: str = CACHE_PATH,
+        batch_path: str = BATCH_PATH,
+        store_path: str = './assets/forecasts',
+        registry: Optional[ModelRegistry] = None,
+        history_days: int = 365,
+        regressors: List[str] = ['CommunicationChannelCode'],
+        log: bool = True,
+        n_workers: int = 2,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Init the Ingestion Class.
+
+        Args:
+            drop_path (str, optional): folder watched for new parquet files.
+                Defaults to './assets/drop'.
+            path (str, optional): path of the raw parquet file, to build the proceed
+                data when there is no cache. Defaults to DATA_PATH.
+            cache_path (str, optional): folder of the proceed data. Defaults to CACHE_PATH.
+            batch_path (str, optional): folder where the batches are saved, read again
+                when the proceed data is rebuilt. Defaults to BATCH_PATH.
+            store_path (str, optional): folder of the forecast store.
+                Defaults to './assets/forecasts'.
+            registry (ModelRegistry, optional): registry of the fitted models, the
+                retrains are warm started from the last model of the ItemNumber.
+                Defaults to a registry in './assets/models'.
+            history_days (int, optional): number of days of data before the last
+                date used to fit the model. Defaults to 365.
+            regressors (List[str], optional): regressors of the fbProphetMultivariate model.
+                Defaults to ['CommunicationChannelCode'].
+            log (bool, optional): True or False if we want to use a logarithm transformation.
+                Defaults to True.
+            n_workers (int, optional): number of retrains at the same time. Defaults to 2.
+            timeout (float, optional): maximum number of second for a retrain.
+                Defaults to None (no limit).
+        """
+        self.drop_path = drop_path
+        self.path = path
+        self.cache_path = cache_path
+        self.batch_path = batch_path
+        self.store_path = store_path
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.history_days = history_days
+        self.regressors = regressors
+        self.log = log
+        # Fingerprint of the raw file, computed once by poll for all the payloads
+        self.fingerprint = None
+        for folder in ['processed', 'failed']:
+            os.makedirs(os.path.join(drop_path, folder), exist_ok=True)
+        self.jobs = JobQueue(
+            get_item_store_forecast,
+            path=os.path.join(drop_path, 'jobs.sqlite'),
+            n_workers=n_workers,
+            get_payload=self.get_payload,
+            timeout=timeout,
+        )
+
+    def get_new_files(self) -> List[str]:
+        """Get the parquet files dropped and not ingested yet, the oldest first.
+        A file is written under another name (.tmp) then renamed, the
+        ingestion never read a partial file.
+
+        Returns:
+            List[str]: paths of the new files.
+        """
+        files = [
+            os.path.join(self.drop_path, x)
+            for x in os.listdir(self.drop_path)
+            if x.endswith('.parquet')
+        ]
+        return sorted(files, key=os.path.getmtime)
+
+    def ingest(self, file: str) -> List[str]:
+        """Append the data of a file to the proceed data.
+
+        Args:
+            file (str): path of the parquet file.
+
+        Returns:
+            List[str]: the ItemNumber with new data.
+        """
+        if not os.path.exists(os.path.join(self.cache_path, 'manifest.json')):
+            get_procceed_data(self.path, self.cache_path, batch_path=self.batch_path)
+        df = append_proceed_data(pd.read_parquet(file), self.cache_path, self.batch_path)
+        return sorted(df.ItemNumber.astype(str).unique())
+
+    def poll(self) -> Dict[str, List[str]]:
+        """Ingest the new files and add a retrain job for each ItemNumber with
+        new data (one job in flight by ItemNumber).
+
+        Returns:
+            Dict[str, List[str]]: name of each file ingested -> its ItemNumber.
+        """
+        ingested = {}
+        self.fingerprint = _get_raw_fingerprint(self.path)
+        for file in self.get_new_files():
+            name = os.path.basename(file)
+            try:
+                items = self.ingest(file)
+            except Exception as e:
+                print('Ingestion failed for', name, '{}: {}'.format(type(e).__name__, e))
+                shutil.move(file, os.path.join(self.drop_path, 'failed', name))
+                continue
+            shutil.move(file, os.path.join(self.drop_path, 'processed', name))
+            for ItemNumber in items:
+                self.jobs.submit(ItemNumber)
+            print('Ingestion of', name, ':', len(items), 'ItemNumber to retrain')
+            ingested[name] = items
+        return ingested
+
+    def get_payload(self, ItemNumber: str, params: Dict) -> Dict:
+        """Build the payload of get_item_store_forecast for a retrain job:
+        only the rows of the ItemNumber are read from the proceed data, with
+        the fingerprint of the raw file of the last poll. Called by the threads
+        of the JobQueue while poll appends to the cache: get_procceed_data
+        locks the cache.
+
+        Args:
+            ItemNumber (str): the ItemNumber to retrain.
+            params (Dict): json parameters of the job (not used).
+
+        Returns:
+            Dict: the payload of get_item_store_forecast.
+        """
+        data = get_procceed_data(
+            self.path,
+            self.cache_path,
+            items=[ItemNumber],
+            columns=self.regressors,
+            batch_path=self.batch_path,
+            fingerprint=self.fingerprint
+        )
+        last_date = data.DateKey.max()
+        data = data[data.DateKey > last_date - pd.Timedelta(days=self.history_days)]
+        return {
+            'ItemNumber': ItemNumber,
+            'data': data.sort_values('DateKey'),
+            'path': self.store_path,
+            'start_date': last_date.strftime('%Y-%m-%d'),
+            'regressors': self.regressors,
+            'log': self.log,
+            'registry': self.registry,
+            'incremental': True,
+        }
+
+    def run(self, interval: float = 60) -> None:
+        """Watch the drop folder until the process is stopped.
+
+        Args:
+            interval (float, optional): number of second between two polls. Defaults to 60.
+        """
+        print('Watch', self.drop_path)
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        finally:
+            self.jobs.stop()
+
+
+if __name__ == '__main__':
+    Ingestion().run()
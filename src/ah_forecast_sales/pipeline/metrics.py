@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+
+# Metrics of get_metrics_table, for all the observations and by promotion or not
+METRICS = ['n', 'RMSE', 'NRMSE', 'bias', 'MAPE']
+
+
+def get_rmse(y, yhat) -> float:
+    """Root mean squared error of the forecast.
+
+    Args:
+        y (array-like): actual values.
+        yhat (array-like): forecast values.
+
+    Returns:
+        float: the RMSE
+    """
+    error = np.asarray(yhat, dtype=float) - np.asarray(y, dtype=float)
+    return float(np.sqrt(np.mean(error ** 2)))
+
+
+def get_nrmse(y, yhat) -> float:
+    """RMSE divided by the mean of the actual values, to compare
+    ItemNumber with different volumes.
+
+    Args:
+        y (array-like): actual values.
+        yhat (array-like): forecast values.
+
+    Returns:
+        float: the NRMSE, inf when all the actual values are 0
+        (NaN with a perfect forecast)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.divide(get_rmse(y, yhat), np.mean(np.asarray(y, dtype=float))))
+
+
+def _get_metrics(
+    y: np.ndarray,
+    yhat: np.ndarray,
+    codes: np.ndarray,
+    n_groups: int
+) -> Dict[str, np.ndarray]:
+    """Sums of each group with one bincount by metric."""
+    error = yhat - y
+    nonzero = y != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count = np.bincount(codes, minlength=n_groups)
+        rmse = np.sqrt(np.bincount(codes, error ** 2, n_groups) / count)
+        mean = np.bincount(codes, y, n_groups) / count
+        return {
+            'n': count,
+            'RMSE': rmse,
+            'NRMSE': rmse / mean,
+            'bias': np.bincount(codes, error, n_groups) / count,
+            'MAPE': np.bincount(
+                codes[nonzero], np.abs(error[nonzero] / y[nonzero]), n_groups
+            ) / np.bincount(codes[nonzero], minlength=n_groups),
+        }
+
+
+def get_metrics_table(
+    y,
+    yhat,
+    groups=None,
+    isPromo=None,
+    name: str = 'ItemNumber'
+) -> pd.DataFrame:
+    """Compute the metrics of many forecasts stacked together in one pass:
+    n, RMSE, NRMSE, bias (mean of yhat - y) and MAPE (on the actual values
+    not 0) of each group, and the same metrics on the observations with
+    and without promotion (RMSE_promo, RMSE_no_promo, ...).
+
+    Args:
+        y (array-like): actual values.
+        yhat (array-like): forecast values.
+        groups (array-like, optional): group of each observation (ItemNumber).
+            Defaults to None (one group 'all').
+        isPromo (array-like, optional): promotion of each observation.
+            Defaults to None (no breakdown by promotion).
+        name (str, optional): name of the index. Defaults to 'ItemNumber'.
+
+    Returns:
+        pd.DataFrame: one row by group, one column by metric.
+        A metric without observation is NaN.
+    """
+    y = np.asarray(y, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)
+    if groups is None:
+        codes, names = np.zeros(len(y), dtype=int), pd.Index(['all'])
+    else:
+        codes, names = pd.factorize(np.asarray(groups), sort=True)
+
+    table = _get_metrics(y, yhat, codes, len(names))
+    if isPromo is not None:
+        isPromo = np.asarray(isPromo).astype(bool)
+        for suffix, rows in [('promo', isPromo), ('no_promo', ~isPromo)]:
+            metrics = _get_metrics(y[rows], yhat[rows], codes[rows], len(names))
+            table.update({
+                '{}_{}'.format(metric, suffix): values
+                for metric, values in metrics.items()
+            })
+
+    return pd.DataFrame(table, index=pd.Index(names, name=name))
+
@@ -0,0 +1,49 @@
+from fbprophet import Prophet
+import pandas as pd
+from typing import List
+
+
+# Prediction mode -> number of Monte-Carlo simulations for the uncertainty intervals
+PREDICTION_MODES = {
+    'full': 1000,
+    'fast': 100,
+    'point': 0,
+}
+
+
+def get_prediction(
+    model: Prophet,
+    future_dates: pd.DataFrame,
+    prediction_mode: str,
+    columns: List[str]
+) -> pd.DataFrame:
+    """Predict with the number of uncertainty simulations of the prediction mode:
+    - full: the 1000 simulations of Prophet and all the columns of the forecast
+    - fast: 100 simulations, yhat_lower and yhat_upper are less precise
+    - point: no simulation, only yhat (the intervals are not computed)
+    Except in full mode, the forecast is trimmed to the columns used.
+
+    Args:
+        model (Prophet): the fitted model.
+        future_dates (pd.DataFrame): dates (and regressors) to predict.
+        prediction_mode (str): full, fast or point.
+        columns (List[str]): columns kept in the forecast in addition to ds and yhat.
+
+    Returns:
+        pd.DataFrame: the forecast
+    """
+    if prediction_mode not in PREDICTION_MODES:
+        raise ValueError('prediction_mode must be one of {}'.format(list(PREDICTION_MODES)))
+
+    # The model keeps its number of simulations (saved in the registry, reused)
+    uncertainty_samples = model.uncertainty_samples
+    model.uncertainty_samples = PREDICTION_MODES[prediction_mode]
+    try:
+        forecast = model.predict(future_dates)
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+    if prediction_mode == 'full':
+        return forecast
+
+    intervals = ['yhat_lower', 'yhat_upper'] if PREDICTION_MODES[prediction_mode] else []
+    return forecast[['ds', 'yhat'] + intervals + columns]
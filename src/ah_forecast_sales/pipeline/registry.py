@@ -0,0 +1,246 @@
+from fbprophet import Prophet
+from fbprophet.serialize import model_to_json, model_from_json
+import datetime as dt
+import hashlib
+import json
+import os
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+
+class ModelRegistry():
+    """
+        Registry of the fitted fb Prophet models saved on disk:
+        - one folder by ItemNumber (and a sub folder by scope, like backtest)
+        - one json file by key (hash of the training data and of the config)
+        - one small <key>.meta.json by key, the entry without the models
+        The model classes load the models from the registry when the key
+        matches, and only refit when the data or the config has changed.
+    """
+
+    def __init__(self, path: str = './assets/models', scope: Optional[str] = None) -> None:
+        """Init the ModelRegistry Class.
+
+        Args:
+            path (str, optional): folder where the models are saved.
+                Defaults to './assets/models'.
+            scope (str, optional): sub folder of the models of an ItemNumber, to keep
+                the models of the backtests apart from the production ones.
+                Defaults to None (the production models).
+        """
+        self.path = path
+        self.scope = scope
+
+    def get_scope(self, scope: str) -> 'ModelRegistry':
+        """Get the registry of the same folder for another scope.
+
+        Args:
+            scope (str): name of the scope (backtest, ...).
+
+        Returns:
+            ModelRegistry: registry saving its models in the scope.
+        """
+        return ModelRegistry(self.path, scope)
+
+    def get_key(self, data: pd.DataFrame, columns: List[str], config: Dict) -> str:
+        """Get the key of a model from its training data and config.
+
+        Args:
+            data (pd.DataFrame): training data of the model.
+            columns (List[str]): columns of the data used by the model.
+            config (Dict): config of the model (regressors, log, start_date, ...).
+
+        Returns:
+            str: sha256 of the training data and the config.
+        """
+        key = hashlib.sha256()
+        key.update(
+            pd.util.hash_pandas_object(data[columns], index=False).values.tobytes()
+        )
+        key.update(json.dumps(config, sort_keys=True, default=str).encode())
+        return key.hexdigest()
+
+    def _get_folder(self, ItemNumber: str) -> str:
+        if self.scope is None:
+            return os.path.join(self.path, str(ItemNumber))
+        return os.path.join(self.path, str(ItemNumber), self.scope)
+
+    def _get_file(self, ItemNumber: str, key: str) -> str:
+        return os.path.join(self._get_folder(ItemNumber), key + '.json')
+
+    def _get_meta_file(self, ItemNumber: str, key: str) -> str:
+        return os.path.join(self._get_folder(ItemNumber), key + '.meta.json')
+
+    def load(self, ItemNumber: str, key: str) -> Optional[Dict[str, Prophet]]:
+        """Load the fitted models saved for an ItemNumber and a key.
+
+        Args:
+            ItemNumber (str): the ItemNumber of the model.
+            key (str): key of the model given by get_key.
+
+        Returns:
+            Dict[str, Prophet]: the fitted models by name, None if the key is unknown.
+        """
+        file = self._get_file(ItemNumber, key)
+        if not os.path.exists(file):
+            return None
+        with open(file) as f:
+            entry = json.load(f)
+        return {
+            name: model_from_json(model)
+            for name, model in entry['models'].items()
+        }
+
+    def save(
+        self,
+        ItemNumber: str,
+        key: str,
+        models: Dict[str, Prophet],
+        config: Dict,
+        cold_fit_time: Optional[float] = None,
+        warm_started: bool = False,
+        fit_cpu_time: Optional[float] = None
+    ) -> None:
+        """Save the fitted models of an ItemNumber with their config.
+
+        Args:
+            ItemNumber (str): the ItemNumber of the model.
+            key (str): key of the model given by get_key.
+            models (Dict[str, Prophet]): the fitted models by name.
+            config (Dict): config of the model (regressors, log, start_date, ...).
+            cold_fit_time (float, optional): time in second of a fit from scratch
+                of the models. Defaults to None.
+            warm_started (bool, optional): True if the models have been warm started
+                from a previous model, False for a fit from scratch (or a warm
+                start not possible). Defaults to False.
+            fit_cpu_time (float, optional): CPU time in second of the thread during
+                the fit of the models (warm started or not), the cost of a retrain
+                for the scheduler. Defaults to None.
+        """
+        file = self._get_file(ItemNumber, key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        meta = {
+            'ItemNumber': str(ItemNumber),
+            'key': key,
+            'config': config,
+            'created_at': dt.datetime.now().isoformat(),
+            'cold_fit_time': cold_fit_time,
+            'warm_started': warm_started,
+            'fit_cpu_time': fit_cpu_time,
+        }
+        entry = dict(meta, models={
+            name: model_to_json(model)
+            for name, model in models.items()
+        })
+        # Write in a temporary file first, a reader never see a partial model.
+        # The meta file is written last: its model file always exists.
+        meta_file = self._get_meta_file(ItemNumber, key)
+        for path, content in [(file, entry), (meta_file, meta)]:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(content, f, default=str)
+            os.replace(path + '.tmp', path)
+
+    def _get_meta(self, ItemNumber: str, key: str) -> Dict:
+        """Get the entry of a key without its models, from the meta file
+        (written from the model file for a model saved without one).
+        """
+        meta_file = self._get_meta_file(ItemNumber, key)
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                return json.load(f)
+        with open(self._get_file(ItemNumber, key)) as f:
+            entry = json.load(f)
+        meta = {x: value for x, value in entry.items() if x != 'models'}
+        meta['key'] = key
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(meta, f, default=str)
+        os.replace(meta_file + '.tmp', meta_file)
+        return meta
+
+    def get_latest_entry(
+        self,
+        ItemNumber: str,
+        config: Optional[Dict] = None
+    ) -> Optional[Dict]:
+        """Get the entry of the last models saved for an ItemNumber, the models
+        are not loaded. Only the meta files are read to find the last one.
+
+        Args:
+            ItemNumber (str): the ItemNumber of the model.
+            config (Dict, optional): config of the model, start_date and training_window
+                are ignored. Defaults to None (whatever the config).
+
+        Returns:
+            Dict: ItemNumber, key, config, created_at, cold_fit_time and
+            fit_cpu_time of the last models, None if there is no model.
+        """
+        folder = self._get_folder(ItemNumber)
+        if not os.path.isdir(folder):
+            return None
+
+        def get_model_config(config: Dict) -> Dict:
+            return {
+                x: value for x, value in config.items()
+                if x not in ['start_date', 'training_window']
+            }
+
+        latest = None
+        for file in os.listdir(folder):
+            if not file.endswith('.json') or file.endswith('.meta.json'):
+                continue
+            meta = self._get_meta(ItemNumber, file[:-len('.json')])
+            if config is not None and get_model_config(meta['config']) != get_model_config(config):
+                continue
+            if latest is None or meta['created_at'] > latest['created_at']:
+                latest = meta
+        return latest
+
+    def load_latest(
+        self,
+        ItemNumber: str,
+        config: Dict
+    ) -> Optional[Tuple[Dict[str, Prophet], Optional[float]]]:
+        """Load the last models saved for an ItemNumber with the same config,
+        whatever the training data: used to warm start an incremental retrain.
+
+        Args:
+            ItemNumber (str): the ItemNumber of the model.
+            config (Dict): config of the model, start_date and training_window are ignored.
+
+        Returns:
+            Tuple[Dict[str, Prophet], float]: the fitted models by name and the time
+            of a fit from scratch, None if there is no model with this config.
+        """
+        latest = self.get_latest_entry(ItemNumber, config)
+        if latest is None:
+            return None
+        models = self.load(ItemNumber, latest['key'])
+        if models is None:
+            return None
+        return models, latest.get('cold_fit_time')
+
+
+def get_item_name(data: pd.DataFrame) -> str:
+    """Get the ItemNumber used to save the model of a times series.
+
+    Args:
+        data (pd.DataFrame): data of the times series.
+
+    Returns:
+        str: the ItemNumber of the data, 'unknown' if the column is missing.
+    """
+    if 'ItemNumber' in data and len(data) > 0:
+        return str(data.ItemNumber.iloc[0])
+    return 'unknown'
+
+
+def get_training_window(data: pd.DataFrame) -> List[str]:
+    """Get the first and last date of the training data.
+
+    Args:
+        data (pd.DataFrame): training data with the column ds.
+
+    Returns:
+        List[str]: first and last date of the training data.
+    """
+    return [str(data.ds.min()), str(data.ds.max())]
@@ -0,0 +1,298 @@
+from src.ah_forecast_sales.pipeline.forecast_store import _get_partition
+from src.ah_forecast_sales.pipeline.forecast_store import read_forecast
+from src.ah_forecast_sales.pipeline.registry import ModelRegistry
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from src.ah_forecast_sales.utils.job_queue import JobQueue
+import json
+import numpy as np
+import os
+import pandas as pd
+from typing import Dict, List, Optional
+
+
+# Config of the models of the forecast store (see build_forecast_store): the
+# models of the other variants and of the backtests are not the production ones
+PRODUCTION_CONFIG = {
+    'model': 'fbProphetMultivariate',
+    'regressors': ['CommunicationChannelCode'],
+    'log': True,
+}
+
+# Number of the last forecasts of the store accumulated in the rolling error
+ERROR_RUNS = 4
+
+# Columns of the retrain queue: one row by ItemNumber, the first to retrain first
+RETRAIN_COLUMNS = [
+    'ItemNumber', 'last_fit', 'fit_cost', 'rows_added', 'n_actuals',
+    'RMSE', 'NRMSE', 'mean_sales', 'reason', 'score', 'selected'
+]
+
+
+def _get_error_sums(forecast: pd.DataFrame, data: pd.DataFrame) -> Dict:
+    """Number of actuals, sum of the squared errors and sum of the actuals of
+    a forecast of the store against the actuals arrived since: each actual is
+    compared with the forecast of its scenario (promotion or not).
+    """
+    actuals = data[['DateKey', 'IsPromo', 'UnitSales']].rename(
+        columns={'DateKey': 'ds', 'UnitSales': 'y'}
+    )
+    actuals['type'] = np.where(actuals.IsPromo, 'forecast_promo', 'forecast_no_promo')
+    metrics = actuals.merge(
+        forecast[forecast.type != 'history'][['ds', 'type', 'yhat']],
+        how='inner',
+        on=['ds', 'type']
+    )
+    error = metrics.yhat.astype(float) - metrics.y.astype(float)
+    return {
+        'n_actuals': len(metrics),
+        'sse': float((error ** 2).sum()),
+        'sum_y': float(metrics.y.astype(float).sum()),
+    }
+
+
+def _get_error_metrics(sums: Dict) -> Dict:
+    """RMSE and NRMSE of the sums of _get_error_sums, the same than get_rmse and
+    get_nrmse on all the actuals of the sums (NaN without actual)."""
+    n_actuals = sums['n_actuals']
+    if n_actuals == 0:
+        return {'n_actuals': 0, 'RMSE': np.nan, 'NRMSE': np.nan}
+    rmse = float(np.sqrt(sums['sse'] / n_actuals))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nrmse = float(np.divide(rmse, sums['sum_y'] / n_actuals))
+    return {'n_actuals': n_actuals, 'RMSE': rmse, 'NRMSE': nrmse}
+
+
+def get_forecast_error(forecast: pd.DataFrame, data: pd.DataFrame) -> Dict:
+    """Out of sample error of a forecast of the store against the actuals
+    arrived since: each actual is compared with the forecast of its scenario
+    (promotion or not). Same RMSE and NRMSE than the model classes.
+
+    Args:
+        forecast (pd.DataFrame): the rows given by read_forecast.
+        data (pd.DataFrame): proceed data of the ItemNumber.
+
+    Returns:
+        Dict: n_actuals (number of actuals forecast), RMSE and NRMSE
+        (NaN without actual).
+    """
+    return _get_error_metrics(_get_error_sums(forecast, data))
+
+
+def get_rolling_forecast_error(
+    store_path: str,
+    ItemNumber: str,
+    forecast: pd.DataFrame,
+    data: pd.DataFrame,
+    n_runs: int = ERROR_RUNS
+) -> Dict:
+    """Out of sample error of the last n_runs forecasts of an ItemNumber in the
+    store: the store only keeps the last forecast, the sums of the errors of
+    each forecast (see get_forecast_error) are saved by its first forecasted
+    day in ItemNumber=<item>/errors.json, and updated while new actuals arrive.
+    The RMSE and NRMSE are the ones of all the actuals of these forecasts.
+
+    Args:
+        store_path (str): folder of the forecast store.
+        ItemNumber (str): the ItemNumber.
+        forecast (pd.DataFrame): the rows given by read_forecast.
+        data (pd.DataFrame): proceed data of the ItemNumber.
+        n_runs (int, optional): number of forecasts accumulated. Defaults to ERROR_RUNS.
+
+    Returns:
+        Dict: n_actuals (number of actuals forecast), RMSE and NRMSE
+        (NaN without actual).
+    """
+    file = os.path.join(os.path.dirname(_get_partition(store_path, ItemNumber)), 'errors.json')
+    errors = {}
+    if os.path.exists(file):
+        with open(file) as f:
+            errors = json.load(f)
+
+    future = forecast[forecast.type != 'history']
+    if len(future) > 0:
+        errors[pd.Timestamp(future.ds.min()).strftime('%Y-%m-%d')] = _get_error_sums(
+            forecast, data
+        )
+        errors = {x: errors[x] for x in sorted(errors)[-n_runs:]}
+        with open(file + '.tmp', 'w') as f:
+            json.dump(errors, f)
+        os.replace(file + '.tmp', file)
+
+    return _get_error_metrics({
+        x: sum(sums[x] for sums in errors.values())
+        for x in ['n_actuals', 'sse', 'sum_y']
+    })
+
+
+def get_item_state(
+    ItemNumber: str,
+    data: pd.DataFrame,
+    registry: ModelRegistry,
+    store_path: str = './assets/forecasts',
+    recent_days: int = 28,
+    config: Optional[Dict] = None,
+    error_runs: int = ERROR_RUNS
+) -> Dict:
+    """Get the state of an ItemNumber for the scheduler: the last fit of its
+    model, the rows added since, the rolling error of its stored forecasts
+    (see get_rolling_forecast_error) and its volume.
+
+    Args:
+        ItemNumber (str): the ItemNumber.
+        data (pd.DataFrame): proceed data of the ItemNumber.
+        registry (ModelRegistry): registry of the fitted models.
+        store_path (str, optional): folder of the forecast store.
+            Defaults to './assets/forecasts'.
+        recent_days (int, optional): number of days of the mean UnitSales.
+            Defaults to 28.
+        config (Dict, optional): config of the production model in the registry.
+            Defaults to None (PRODUCTION_CONFIG).
+        error_runs (int, optional): number of the last stored forecasts in the
+            rolling error. Defaults to ERROR_RUNS.
+
+    Returns:
+        Dict: last_fit, fit_cost (CPU second of the last fit), rows_added,
+        n_actuals, RMSE, NRMSE and mean_sales.
+    """
+    state = {'ItemNumber': ItemNumber, 'last_fit': None, 'fit_cost': None}
+    entry = registry.get_latest_entry(ItemNumber, config or PRODUCTION_CONFIG)
+    if entry is None:
+        state['rows_added'] = len(data)
+    else:
+        state['last_fit'] = entry['created_at']
+        # CPU time, the wall time depends on the load of the machine
+        state['fit_cost'] = entry.get('fit_cpu_time')
+        training_end = pd.Timestamp(entry['config']['training_window'][1])
+        state['rows_added'] = int((data.DateKey > training_end).sum())
+
+    forecast = read_forecast(store_path, ItemNumber)
+    if forecast is None:
+        state.update({'n_actuals': 0, 'RMSE': np.nan, 'NRMSE': np.nan})
+    else:
+        state.update(get_rolling_forecast_error(
+            store_path, ItemNumber, forecast, data, error_runs
+        ))
+
+    last_date = data.DateKey.max()
+    state['mean_sales'] = data[
+        data.DateKey > last_date - pd.Timedelta(days=recent_days)
+    ].UnitSales.mean()
+    return state
+
+
+def get_retrain_queue(
+    df: pd.DataFrame,
+    registry: ModelRegistry,
+    budget: float,
+    store_path: str = './assets/forecasts',
+    items: Optional[List[str]] = None,
+    stable_nrmse: float = 0.3,
+    max_age_days: int = 28,
+    default_cost: Optional[float] = None,
+    item_index: Optional[ItemIndex] = None,
+    config: Optional[Dict] = None,
+) -> pd.DataFrame:
+    """Prioritize the retrains of the ItemNumber within a CPU time budget.
+    Each ItemNumber gets a reason and a score:
+    - never_fitted: no model in the registry, always first
+    - up_to_date: no row since the last fit, not retrained
+    - drift: the last stored forecasts have a NRMSE above stable_nrmse on the
+      actuals arrived since (see get_rolling_forecast_error)
+    - no_forecast: new rows but no stored forecast to measure the error
+    - stale: stable, but more than max_age_days rows since the last fit
+    - stable: not retrained
+    The score is the error accumulated since the last fit (RMSE x rows added,
+    mean UnitSales x rows added without forecast): the drifting and high volume
+    ItemNumber are first. The ItemNumber are then selected by score, while the
+    sum of their cost of fit stays in the budget.
+
+    Args:
+        df (pd.DataFrame): The full proceed dataset.
+        registry (ModelRegistry): registry of the fitted models.
+        budget (float): CPU time in second for the retrains.
+        store_path (str, optional): folder of the forecast store.
+            Defaults to './assets/forecasts'.
+        items (List[str], optional): ItemNumber to schedule. Defaults to all of df.
+        stable_nrmse (float, optional): NRMSE under which a forecast is stable.
+            Defaults to 0.3.
+        max_age_days (int, optional): number of new rows after which a stable
+            ItemNumber is retrained. Defaults to 28.
+        default_cost (float, optional): CPU cost of the ItemNumber without a measured
+            fit (or a fit saved before fit_cpu_time). Defaults to the median of the
+            measured ones (1 second without any).
+        item_index (ItemIndex, optional): index of df by ItemNumber.
+            Defaults to None (the index is created).
+        config (Dict, optional): config of the production model in the registry.
+            Defaults to None (PRODUCTION_CONFIG).
+
+    Returns:
+        pd.DataFrame: one row by ItemNumber with the RETRAIN_COLUMNS, sorted by score.
+    """
+    if item_index is None:
+        item_index = ItemIndex(df)
+    items = item_index.items if items is None else [x for x in items if x in item_index]
+
+    queue = pd.DataFrame([
+        get_item_state(
+            ItemNumber, item_index.get(ItemNumber), registry, store_path, config=config
+        )
+        for ItemNumber in items
+    ], columns=RETRAIN_COLUMNS[:-3])
+
+    drift = queue.NRMSE > stable_nrmse
+    stable = queue.NRMSE <= stable_nrmse
+    queue['reason'] = np.select(
+        [
+            queue.last_fit.isna(),
+            queue.rows_added == 0,
+            drift,
+            queue.NRMSE.isna(),
+            stable & (queue.rows_added >= max_age_days),
+        ],
+        ['never_fitted', 'up_to_date', 'drift', 'no_forecast', 'stale'],
+        'stable'
+    )
+    queue['score'] = np.select(
+        [
+            queue.reason == 'never_fitted',
+            queue.reason.isin(['drift', 'stale']),
+            queue.reason == 'no_forecast',
+        ],
+        [
+            np.inf,
+            queue.RMSE * queue.rows_added,
+            queue.mean_sales * queue.rows_added,
+        ],
+        0
+    )
+    queue = queue.sort_values('score', ascending=False).reset_index(drop=True)
+
+    # Greedy selection by score within the budget
+    if default_cost is None:
+        default_cost = queue.fit_cost.dropna().median() if queue.fit_cost.notna().any() else 1.0
+    costs = queue.fit_cost.fillna(default_cost).values
+    selected = np.zeros(len(queue), dtype=bool)
+    spent = 0.0
+    for i in np.flatnonzero(queue.score.values > 0):
+        if spent + costs[i] <= budget:
+            selected[i] = True
+            spent += costs[i]
+    queue['selected'] = selected
+    return queue[RETRAIN_COLUMNS]
+
+
+def submit_retrains(queue: pd.DataFrame, jobs: JobQueue) -> List[str]:
+    """Add a job for each ItemNumber selected in the retrain queue,
+    in the order of the queue.
+
+    Args:
+        queue (pd.DataFrame): the retrain queue given by get_retrain_queue.
+        jobs (JobQueue): queue of the retrain jobs (see Ingestion.jobs).
+
+    Returns:
+        List[str]: the ItemNumber submitted.
+    """
+    items = queue[queue.selected].ItemNumber.tolist()
+    for ItemNumber in items:
+        jobs.submit(ItemNumber)
+    return items
@@ -0,0 +1,65 @@
+from fbprophet import Prophet
+import pandas as pd
+from typing import Callable, Dict, Optional, Tuple
+
+
+# Error of Stan when the initial values do not have the dimensions of the new
+# model: less changepoints on a short history, other regressors
+INIT_ERRORS = (RuntimeError, ValueError)
+INIT_ERROR_MESSAGE = 'mismatch in dimension'
+
+def get_stan_init(model: Prophet) -> Dict:
+    """Get the parameters of a fitted model (k, m, delta, beta, sigma_obs)
+    in the format of the initialisation of the Stan optimizer.
+
+    Args:
+        model (Prophet): a fitted model.
+
+    Returns:
+        Dict: initial values of the Stan parameters.
+    """
+    stan_init = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        stan_init[name] = model.params[name][0][0]
+    for name in ['delta', 'beta']:
+        stan_init[name] = model.params[name][0]
+    return stan_init
+
+
+def fit_prophet(
+    get_prophet: Callable[[], Prophet],
+    data: pd.DataFrame,
+    init_model: Optional[Prophet] = None
+) -> Tuple[Prophet, bool]:
+    """Fit a new Prophet model, warm started from the parameters of
+    init_model when there is one: a new week of data barely moves the fit,
+    so the optimizer starts close to the solution and converges faster.
+    When the parameters of init_model do not have the dimensions of the new
+    model, the fallback to a fit from scratch is printed and the model is
+    returned as not warm started. Any other error of the fit is raised.
+
+    Args:
+        get_prophet (Callable[[], Prophet]): function creating the model not fitted.
+        data (pd.DataFrame): training data of the model.
+        init_model (Prophet, optional): model previously fitted with the same config.
+            Defaults to None (cold fit).
+
+    Returns:
+        Tuple[Prophet, bool]: the fitted model, True if it has been warm started.
+    """
+    if init_model is not None:
+        stan_init = get_stan_init(init_model)
+        model = get_prophet()
+        try:
+            model.fit(data, init=lambda: stan_init)
+            return model, True
+        except INIT_ERRORS as e:
+            if INIT_ERROR_MESSAGE not in str(e):
+                raise
+            print('Warm start not possible ({}), fit from scratch'.format(
+                str(e).splitlines()[0]
+            ))
+
+    model = get_prophet()
+    model.fit(data)
+    return model, False
@@ -1,51 +1,172 @@
+from contextlib import contextmanager, nullcontext
+import fcntl
+import hashlib
+import json
+import os
+import shutil
 import pandas as pd
-from datetime import datetime
-from pandarallel import pandarallel
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Dict, Iterator, List, Optional
+from src.ah_forecast_sales.utils.instrumentation import timed
 
 
-def get_data(path: str) -> pd.DataFrame:
-    """Read the data from a path
+# Path to the data parquet file, and to the cache of the proceed data
+DATA_PATH = "./assets/dataset.parquet"
+CACHE_PATH = "./assets/cache/processed"
+# Raw batches ingested after the raw file, kept to proceed all the data again
+BATCH_PATH = "./assets/batches"
+
+# Version of the transformations of get_procceed_data,
+# to increase when they change so the cache is proceed again
+PIPELINE_VERSION = 4
+
+# Columns always read, needed to clean the data and to select the times series
+KEY_COLUMNS = ['DateKey', 'ItemNumber', 'IsPromo', 'ShelfCapacity', 'UnitSales']
+
+# Target and regressors of the models, kept at their type by get_compact_data:
+# the models and the keys of the registry see the same values than without it
+MODEL_COLUMNS = ['UnitSales', 'IsPromo', 'CommunicationChannelCode']
+
+
+def _get_filters(
+    path: str,
+    items: Optional[List[str]],
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> Optional[List]:
+    """Get the pyarrow filters for the ItemNumber and the date range,
+    with the values in the type of the columns of the parquet file.
+
+    Args:
+        path (str): path of the parquet file
+        items (List[str], optional): ItemNumber to keep
+        start_date (str, optional): first date to keep (included) as '%Y-%m-%d'
+        end_date (str, optional): last date to keep (included) as '%Y-%m-%d'
+
+    Returns:
+        List: filters for pd.read_parquet, None without filter
+    """
+    schema = pq.read_schema(path)
+    filters = []
+    if items is not None:
+        if pa.types.is_integer(schema.field('ItemNumber').type):
+            filters.append(('ItemNumber', 'in', [int(x) for x in items]))
+        else:
+            filters.append(('ItemNumber', 'in', [str(x) for x in items]))
+
+    for operator, date in [('>=', start_date), ('<=', end_date)]:
+        if date is None:
+            continue
+        date = pd.Timestamp(date)
+        DateKeyType = schema.field('DateKey').type
+        if pa.types.is_timestamp(DateKeyType):
+            filters.append(('DateKey', operator, date))
+        elif pa.types.is_integer(DateKeyType):
+            filters.append(('DateKey', operator, int(date.strftime('%Y%m%d'))))
+        else:
+            filters.append(('DateKey', operator, date.strftime('%Y%m%d')))
+
+    return filters or None
+
+
+@timed('load')
+def get_data(
+    path: str,
+    items: Optional[List[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """Read the data from a path.
+    The selection is pushed down to the parquet reader: only the columns
+    wanted are read, and the row groups without the ItemNumber or the dates are skipped.
 
     Args:
         path (str): path to get the date
+        items (List[str], optional): ItemNumber to read. Defaults to None (all).
+        start_date (str, optional): first date to read (included) as '%Y-%m-%d'.
+            Defaults to None.
+        end_date (str, optional): last date to read (included) as '%Y-%m-%d'.
+            Defaults to None.
+        columns (List[str], optional): columns to read. Defaults to None (all).
 
     Returns:
         pd.DataFrame: dataframe of the data
     """
-    return pd.read_parquet(path)
+    return pd.read_parquet(
+        path,
+        columns=columns,
+        filters=_get_filters(path, items, start_date, end_date)
+    )
 
 
-def get_procceed_data() -> pd.DataFrame:
-    """Clean and add variables used for the modelisation.
+def get_datetime(DateKey: pd.Series) -> pd.Series:
+    """Transform the DateKey (yyyymmdd as integer or string) to datetime,
+    with integer operations on the whole column.
+
+    Args:
+        DateKey (pd.Series): the DateKey column
 
     Returns:
-        pd.DataFrame:  dataframe of the proceed data
+        pd.Series: the DateKey as datetime64
     """
+    key = pd.to_numeric(DateKey).astype('int64')
+    return pd.to_datetime(pd.DataFrame({
+        'year': key // 10000,
+        'month': key // 100 % 100,
+        'day': key % 100,
+    }))
 
-    path = "./assets/dataset.parquet"
-    # Path to the data parquet file
-    df = get_data(path)
-    print('Number of observation:', len(df))
-    print('Number of features:', len(list(df)))
 
-    # Useless Column (No different Value)
-    uselessColumns = [x for x in list(df) if len(df[x].unique()) == 1]
-    print(
-        'Variable with an unique Value',
-        uselessColumns
-    )
+@timed('date_parse')
+def get_calendar_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Transform the DateKey to a proper variable and create the columns
+    years, month (as string '2017', '01') and weekday (0 is Monday) from it.
+
+    Args:
+        df (pd.DataFrame): dataframe with the DateKey as yyyymmdd
+
+    Returns:
+        pd.DataFrame: the same dataframe with the calendar columns
+    """
+    df['DateKey'] = get_datetime(df.DateKey)
+
+    # Only a few distinct years and months: format them once and map the column
+    years = df.DateKey.dt.year
+    df['years'] = years.map({x: str(x) for x in years.unique()})
+    month = df.DateKey.dt.month
+    df['month'] = month.map({x: '{:02d}'.format(x) for x in month.unique()})
+    df['weekday'] = df.DateKey.dt.weekday
+    return df
+
+
+@timed('clean')
+def get_clean_data(df: pd.DataFrame, uselessColumns: List[str]) -> pd.DataFrame:
+    """Clean and add variables used for the modelisation, row by row:
+    the result for some rows does not depend on the other rows.
+
+    Args:
+        df (pd.DataFrame): raw data
+        uselessColumns (List[str]): columns with an unique value to drop
+
+    Returns:
+        pd.DataFrame: clean data, before the categorical variables
+    """
     df = df.drop(columns=uselessColumns)
 
     # Create Column dummies values only for Hollydays
+    # (only when the columns have been read)
     isNationalHolidayColumns = [x for x in list(df) if 'national_holiday' in x]
-    df['isNationalHoliday'] = df[isNationalHolidayColumns].max(axis=1)
+    if isNationalHolidayColumns:
+        df['isNationalHoliday'] = df[isNationalHolidayColumns].max(axis=1)
     isSchoolHolidayColumns = [x for x in list(df) if 'SchoolHoliday' in x]
-    df[isSchoolHolidayColumns] = df[isSchoolHolidayColumns].fillna(0)
-    df['isSchoolHoliday'] = df[isSchoolHolidayColumns].sum(axis=1)
+    if isSchoolHolidayColumns:
+        df[isSchoolHolidayColumns] = df[isSchoolHolidayColumns].fillna(0)
+        df['isSchoolHoliday'] = df[isSchoolHolidayColumns].sum(axis=1)
 
-    # Create a column for Years and month
-    df['years'] = df['DateKey'].apply(lambda x: str(x)[0:4])
-    df['month'] = df['DateKey'].apply(lambda x: str(x)[4:6])
+    # Transforn the DateKey to a proper variable, and create a column for Years, month and weekday
+    df = get_calendar_features(df)
 
     # Column with NaN values
     NaNColumns = [x for x in list(df) if len(df[df[x].isna()]) > 1]
@@ -56,36 +177,741 @@ def get_procceed_data() -> pd.DataFrame:
             len(df[df[column].isna()]) / len(df)
         )
 
-    # Transforn the DateKey to a proper variable
-
-    def func(x):
-        return datetime.strptime(str(x), '%Y%m%d')
-
-    pandarallel.initialize()
-    df['DateKey'] = df.DateKey.parallel_apply(lambda x: func(x))
-
     # Drop some observation with None Values ShelfCapacity / UnitSales - See explanation Markdown Below
     df = df[
         (~df.ShelfCapacity.isna()) &
         (~df.UnitSales.isna())
     ]
+    return df
+
 
-    categorical_variable = [
+def _get_categorical_columns(df: pd.DataFrame) -> List[str]:
+    return [
         x for x in list(df) if 'holiday' in x.lower()
     ] + [
-        'ItemNumber', 'GroupCode', 'CategoryCode', 'CommunicationChannel'
+        x for x in ['ItemNumber', 'GroupCode', 'CategoryCode', 'CommunicationChannel']
+        if x in df
     ]
 
-    df[categorical_variable] = df[categorical_variable].astype("category")
 
-    print('Number of observation:', len(df))
-    print('Number of features:', len(list(df)))
+def get_categories(df: pd.DataFrame, categories: Optional[Dict] = None) -> Dict:
+    """Get the categories of the categorical variables of the clean data.
+    With the categories already known, the new values are added at the end:
+    the code of a value never changes when new rows are added.
+
+    Args:
+        df (pd.DataFrame): clean data
+        categories (Dict, optional): the categories already known. Defaults to None.
+
+    Returns:
+        Dict: column -> list of its categories, saved in the manifest of the cache.
+    """
+    categories = {x: list(values) for x, values in (categories or {}).items()}
+    for column in _get_categorical_columns(df):
+        known = set(categories.get(column, []))
+        new = sorted(x for x in df[column].dropna().unique().tolist() if x not in known)
+        categories[column] = categories.get(column, []) + new
+    return categories
+
+
+@timed('categorical')
+def get_categorical_data(df: pd.DataFrame, categories: Optional[Dict] = None) -> pd.DataFrame:
+    """Cast the categorical variables and create the code for communication Channel.
+    The categories are the ones of the whole dataset (see get_categories): the
+    codes of a slice of ItemNumber or dates are the same than a full proceed.
+
+    Args:
+        df (pd.DataFrame): clean data
+        categories (Dict, optional): column -> its categories.
+            Defaults to None (the sorted values of df).
+
+    Returns:
+        pd.DataFrame: data with the categorical variables
+    """
+    if categories is None:
+        categories = get_categories(df)
+    for column in _get_categorical_columns(df):
+        df[column] = pd.Categorical(df[column], categories=categories.get(column))
 
     # Create code for communication Channel
-    df['CommunicationChannelCode'] = df.CommunicationChannel.cat.codes
+    if 'CommunicationChannel' in df:
+        df['CommunicationChannelCode'] = df.CommunicationChannel.cat.codes
+    return df
+
+
+def _get_memory_usage(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+@timed('compact')
+def get_compact_data(
+    df: pd.DataFrame,
+    model_columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """Reduce the memory of the proceed data, to keep more ItemNumber in a worker:
+    - the wide holiday columns are dropped, isNationalHoliday and
+      isSchoolHoliday are kept
+    - years and month are categorical (the values are still '2017', '01')
+    - the numerical columns not used by the models are downcast to the
+      smallest type (float32, int8, ...)
+
+    Args:
+        df (pd.DataFrame): proceed data
+        model_columns (List[str], optional): columns used by the models, kept
+            at their type. Defaults to None (MODEL_COLUMNS).
+
+    Returns:
+        pd.DataFrame: the compact data
+    """
+    if model_columns is None:
+        model_columns = MODEL_COLUMNS
+    before = _get_memory_usage(df)
+    df = df.drop(columns=[
+        x for x in list(df)
+        if ('national_holiday' in x or 'SchoolHoliday' in x)
+        and x not in ['isNationalHoliday', 'isSchoolHoliday']
+    ])
+
+    for column in ['years', 'month']:
+        if column in df:
+            df[column] = df[column].astype('category')
+
+    for column in df.select_dtypes(include='integer'):
+        if column not in model_columns:
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    for column in df.select_dtypes(include='floating'):
+        if column not in model_columns:
+            df[column] = pd.to_numeric(df[column], downcast='float')
+
+    print('Memory of the proceed data: {:.1f}MB -> {:.1f}MB'.format(
+        before,
+        _get_memory_usage(df)
+    ))
+    return df
+
+
+def _get_row_group_hash(row_group: pq.RowGroupMetaData) -> str:
+    """Hash of the statistics (min, max, number of nulls and values) and of
+    the size of each column chunk of a row group: a row group rewritten
+    with other values has another hash.
+    """
+    key = hashlib.sha256()
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        values = [column.path_in_schema, column.total_compressed_size]
+        statistics = column.statistics
+        if statistics is not None:
+            values += [statistics.null_count, statistics.num_values]
+            if statistics.has_min_max:
+                try:
+                    values += [statistics.min, statistics.max]
+                except Exception:
+                    # Logical type without conversion, the raw bytes are used
+                    values += [statistics.min_raw, statistics.max_raw]
+        key.update(repr(values).encode())
+    return key.hexdigest()
+
+
+def _get_raw_fingerprint(path: str) -> Dict:
+    """Get the fingerprint of the raw parquet file: its size, its time of
+    modification, its schema and the number of rows, bytes and the hash of
+    the statistics of each row group (see _get_row_group_hash).
+    New rows appended to the file are new row groups at the end.
+
+    Args:
+        path (str): path of the raw parquet file
+
+    Returns:
+        Dict: fingerprint of the raw file
+    """
+    stat = os.stat(path)
+    parquet_file = pq.ParquetFile(path)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'schema': str(parquet_file.schema_arrow),
+        'row_groups': [
+            [
+                parquet_file.metadata.row_group(i).num_rows,
+                parquet_file.metadata.row_group(i).total_byte_size,
+                _get_row_group_hash(parquet_file.metadata.row_group(i))
+            ]
+            for i in range(parquet_file.num_row_groups)
+        ],
+    }
+
+
+@contextmanager
+def _lock_cache(cache_path: str) -> Iterator[None]:
+    """Lock of the cache between the threads and the processes (app, ingestion,
+    jobs): the parts and the manifest are written, or the cache proceed again,
+    by one of them at a time and never while another one reads them.
+    The lock file is next to the folder of the cache, not removed with it.
+    """
+    lock_file = os.path.normpath(cache_path) + '.lock'
+    if os.path.dirname(lock_file):
+        os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    with open(lock_file, 'a') as f:
+        # One open file by call: the threads of a process lock each other too
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _get_unique_value(serie: pd.Series) -> str:
+    return str(serie.unique()[0])
+
+
+def _read_cache(
+    cache_path: str,
+    items: Optional[List[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    with open(os.path.join(cache_path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if columns is not None:
+        names = pq.read_schema(os.path.join(cache_path, manifest['parts'][0])).names
+        columns = [x for x in _get_proceed_columns(columns) if x in names]
+    df = pd.concat([
+        get_data(os.path.join(cache_path, part), items, start_date, end_date, columns)
+        for part in _get_parts(manifest)
+    ])
+    # The categories of the whole dataset, the codes are the same than a full proceed
+    return get_categorical_data(df, manifest['categories'])
+
+
+def _get_proceed_columns(columns: List[str]) -> List[str]:
+    proceed_columns = KEY_COLUMNS + ['years', 'month', 'weekday'] + [
+        x for x in columns if x not in KEY_COLUMNS
+    ]
+    if 'CommunicationChannelCode' in columns:
+        proceed_columns.append('CommunicationChannel')
+    return list(dict.fromkeys(proceed_columns))
+
+
+def _get_slice(
+    df: pd.DataFrame,
+    items: Optional[List[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """Same selection than _read_cache, on the proceed data in memory."""
+    if items is not None:
+        df = df[df.ItemNumber.astype(str).isin([str(x) for x in items]).values]
+    if start_date is not None:
+        df = df[df.DateKey >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        df = df[df.DateKey <= pd.Timestamp(end_date)]
+    if columns is not None:
+        df = df[[x for x in _get_proceed_columns(columns) if x in list(df)]]
+    return df
+
+
+def _get_parts(manifest: Dict) -> List[str]:
+    """Parts of the cache in the order of a full proceed: the rows of the raw
+    file first (new row groups appended after batches included), then the batches."""
+    raw = [x for x, source in zip(manifest['parts'], manifest['sources']) if source == 'raw']
+    return raw + [x for x in manifest['parts'] if x not in raw]
+
+
+def _write_cache_part(
+    cache_path: str,
+    manifest: Dict,
+    df: pd.DataFrame,
+    source: str = 'raw'
+) -> None:
+    part = 'part-{:05d}.parquet'.format(len(manifest['parts']))
+    # The categories of the new rows are added at the end, the codes never change
+    manifest['categories'] = get_categories(df, manifest['categories'])
+    # Small row groups, the reader skip the ones without the ItemNumber or the dates wanted
+    df.to_parquet(os.path.join(cache_path, part), row_group_size=100000)
+    manifest['parts'].append(part)
+    manifest['sources'].append(source)
+    # The manifest is written last, a reader never see a partial cache
+    with open(os.path.join(cache_path, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(
+        os.path.join(cache_path, 'manifest.json.tmp'),
+        os.path.join(cache_path, 'manifest.json')
+    )
+
+
+def get_batches(batch_path: str = BATCH_PATH) -> List[str]:
+    """Get the raw batches ingested after the raw file, the oldest first.
+
+    Args:
+        batch_path (str, optional): folder of the batches. Defaults to BATCH_PATH.
+
+    Returns:
+        List[str]: names of the batch files, empty without batch.
+    """
+    manifest_file = os.path.join(batch_path, 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return []
+    with open(manifest_file) as f:
+        return json.load(f)['batches']
+
+
+def write_batch(df: pd.DataFrame, batch_path: str = BATCH_PATH) -> str:
+    """Save a raw batch in the append only folder of the batches,
+    read again by every full proceed of the data.
+
+    Args:
+        df (pd.DataFrame): raw data of the batch
+        batch_path (str, optional): folder of the batches. Defaults to BATCH_PATH.
+
+    Returns:
+        str: name of the batch file.
+    """
+    batches = get_batches(batch_path)
+    os.makedirs(batch_path, exist_ok=True)
+    batch = 'batch-{:05d}.parquet'.format(len(batches))
+    file = os.path.join(batch_path, batch)
+    df.to_parquet(file + '.tmp')
+    os.replace(file + '.tmp', file)
+    # The manifest is written last, a batch is listed once it is complete
+    manifest_file = os.path.join(batch_path, 'manifest.json')
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({'batches': batches + [batch]}, f)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return batch
+
+
+def _check_batch(manifest: Dict, df: pd.DataFrame) -> None:
+    """Raise a ValueError if new raw rows can not be appended to the cache."""
+    changed = [
+        x for x, value in manifest['uselessColumns'].items()
+        if x in df and not (len(df[x].unique()) == 1 and _get_unique_value(df[x]) == value)
+    ]
+    if changed:
+        raise ValueError('Variable with an unique Value has changed: {}'.format(changed))
+
+
+def _append_cache_part(
+    cache_path: str,
+    manifest: Dict,
+    df: pd.DataFrame,
+    batch: Optional[str] = None
+) -> pd.DataFrame:
+    """Clean new raw rows and write them as a new part of the cache.
+
+    Args:
+        cache_path (str): folder of the cache.
+        manifest (Dict): manifest of the cache.
+        df (pd.DataFrame): new raw rows.
+        batch (str, optional): name of the batch of the rows. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the clean rows, before the categorical variables
+    """
+    _check_batch(manifest, df)
+    # The index follows the one of all the raw rows already proceed (raw
+    # file and batches), an index is never used twice in the cache
+    nb_rows = manifest['nb_rows'] + len(df)
+    df = df.set_index(pd.RangeIndex(manifest['nb_rows'], nb_rows))
+    df = get_clean_data(df, [x for x in manifest['uselessColumns'] if x in df])
+    names = pq.read_schema(os.path.join(cache_path, manifest['parts'][0])).names
+    missing = set(names) - set(df) - {'__index_level_0__'}
+    if missing:
+        raise ValueError('Columns missing in the batch: {}'.format(sorted(missing)))
+
+    if batch is not None:
+        manifest['batches'] = manifest.get('batches', []) + [batch]
+    manifest['nb_rows'] = nb_rows
+    _write_cache_part(
+        cache_path, manifest, df[[x for x in names if x in df]], batch or 'raw'
+    )
+    return df
+
+
+def _add_batches(cache_path: str, manifest: Dict, batch_path: str) -> bool:
+    """Append to the cache the batches saved since the cache was written.
+
+    Returns:
+        bool: False when the cache has to be proceed again (a batch of the
+        cache is not in the batches anymore, or a batch can not be appended).
+    """
+    batches = get_batches(batch_path)
+    cached = manifest.get('batches', [])
+    if batches[:len(cached)] != cached:
+        return False
+    for batch in batches[len(cached):]:
+        try:
+            _append_cache_part(
+                cache_path, manifest, pd.read_parquet(os.path.join(batch_path, batch)), batch
+            )
+        except ValueError as e:
+            print('Batch {} can not be appended ({}), proceed all the data'.format(batch, e))
+            return False
+    return True
+
+
+def append_proceed_data(
+    df: pd.DataFrame,
+    cache_path: str = CACHE_PATH,
+    batch_path: str = BATCH_PATH
+) -> pd.DataFrame:
+    """Clean a batch of new raw rows (same schema than the raw file) and
+    append it to the cache of the proceed data as a new part.
+    The raw batch is first saved in batch_path: the cache can be deleted and
+    proceed again (new PIPELINE_VERSION, new raw file) without losing it.
+    The next get_procceed_data returns the cache with the batch.
+
+    Args:
+        df (pd.DataFrame): raw data of the batch
+        cache_path (str, optional): folder of the cache. Defaults to CACHE_PATH.
+        batch_path (str, optional): folder of the batches. Defaults to BATCH_PATH.
+
+    Returns:
+        pd.DataFrame: the clean data of the batch, before the categorical variables
+    """
+    manifest_file = os.path.join(cache_path, 'manifest.json')
+    with _lock_cache(cache_path):
+        if not os.path.exists(manifest_file):
+            raise FileNotFoundError(
+                'No proceed data in {}, run get_procceed_data first'.format(cache_path)
+            )
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['pipeline_version'] != PIPELINE_VERSION:
+            raise ValueError('The cache is not proceed with the PIPELINE_VERSION {}'.format(
+                PIPELINE_VERSION
+            ))
+
+        _check_batch(manifest, df)
+        # The batches saved before and not in the cache yet (stopped ingestion)
+        if not _add_batches(cache_path, manifest, batch_path):
+            raise ValueError(
+                'The cache is not up to date with the batches, run get_procceed_data'
+            )
+        batch = write_batch(df, batch_path)
+        return _append_cache_part(cache_path, manifest, df, batch)
+
+
+def _get_raw_columns(names: List[str], columns: Optional[List[str]]) -> Optional[List[str]]:
+    """Raw columns to read for the proceed columns wanted (see _get_proceed_columns),
+    with the holiday columns of isNationalHoliday and isSchoolHoliday."""
+    if columns is None:
+        return None
+    wanted = _get_proceed_columns(columns)
+    return [
+        x for x in names
+        if x in wanted
+        or ('isNationalHoliday' in wanted and 'national_holiday' in x)
+        or ('isSchoolHoliday' in wanted and 'SchoolHoliday' in x)
+    ]
+
+
+def _get_statistics_values(path: str) -> Dict:
+    """Get the values of each column of a parquet file known from the statistics
+    of its row groups: the set of the min and max of the row groups as string,
+    None for a column with nulls or a row group without statistics.
+    """
+    metadata = pq.ParquetFile(path).metadata
+    values = {}
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        if row_group.num_rows == 0:
+            continue
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            name = column.path_in_schema
+            if name in values and values[name] is None:
+                continue
+            statistics = column.statistics
+            try:
+                if statistics is None or not statistics.has_min_max or statistics.null_count:
+                    raise ValueError
+                # The min of a float column of 0 is written -0.0, the same value
+                value = {
+                    str(x + 0.0) if isinstance(x, float) else str(x)
+                    for x in (statistics.min, statistics.max)
+                }
+            except Exception:
+                # Logical type without conversion, the column is read
+                values[name] = None
+                continue
+            values[name] = values.get(name, set()) | value
+    return values
+
+
+def _get_useless_values(files: List[str]) -> Dict:
+    """Get the columns with an unique value in all the files and their value
+    (the same than _get_unique_value on the full data), from the statistics
+    of the row groups: only a column without statistics is read, alone.
+
+    Args:
+        files (List[str]): the raw parquet file and the batches.
+
+    Returns:
+        Dict: column -> its unique value, as saved in the manifest of the cache.
+    """
+    statistics = [_get_statistics_values(x) for x in files]
+    uselessValues = {}
+    for column in pq.read_schema(files[0]).names:
+        # A column missing in a batch has NaN in the full data
+        if column == '__index_level_0__' or any(column not in x for x in statistics):
+            continue
+        values = set()
+        for file, file_values in zip(files, statistics):
+            if file_values[column] is None:
+                serie = pd.read_parquet(file, columns=[column])[column]
+                values |= {str(x) for x in serie.unique()}
+            else:
+                values |= file_values[column]
+            if len(values) > 1:
+                break
+        if len(values) == 1:
+            uselessValues[column] = values.pop()
+    return uselessValues
+
+
+def _get_proceed_slice(
+    files: List[str],
+    items: Optional[List[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """Proceed only a slice of the raw file and the batches, without the cache:
+    the ItemNumber, the dates and the columns are pushed down to the parquet
+    reader (see get_data). The columns with an unique value come from the
+    statistics of the row groups (see _get_useless_values) and the categories
+    from a read of the categorical columns only: the codes are the same than
+    a full proceed.
+
+    Args:
+        files (List[str]): the raw parquet file and the batches.
+        items (List[str], optional): ItemNumber to read. Defaults to None (all).
+        start_date (str, optional): first date to read (included). Defaults to None.
+        end_date (str, optional): last date to read (included). Defaults to None.
+        columns (List[str], optional): proceed columns wanted. Defaults to None (all).
+
+    Returns:
+        pd.DataFrame: the proceed data of the slice
+    """
+    uselessValues = _get_useless_values(files)
+    print('Variable with an unique Value', list(uselessValues))
+    df = pd.concat([
+        get_data(
+            file, items, start_date, end_date,
+            _get_raw_columns(pq.read_schema(file).names, columns)
+        )
+        for file in files
+    ], ignore_index=True)
+    df = get_clean_data(df, [x for x in uselessValues if x in df])
+
+    # The categories of all the rows of the clean data, one file at a time
+    categorical_columns = _get_categorical_columns(df)
+    categories = {}
+    for file in files:
+        raw_columns = _get_raw_columns(pq.read_schema(file).names, categorical_columns)
+        tmp = pd.read_parquet(file, columns=[x for x in raw_columns if x not in uselessValues])
+        tmp = get_clean_data(tmp, [])
+        tmp = tmp[[x for x in categorical_columns if x in tmp]]
+        for column, values in get_categories(tmp).items():
+            categories[column] = sorted(set(categories.get(column, [])) | set(values))
+    df = get_categorical_data(df, categories)
+    df = _get_slice(df, items, start_date, end_date, columns)
+
+    print('Number of observation:', len(df))
+    print('Number of features:', len(list(df)))
     return df
 
 
+def get_procceed_data(
+    path: str = DATA_PATH,
+    cache_path: str = CACHE_PATH,
+    use_cache: bool = True,
+    items: Optional[List[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+    compact: bool = False,
+    batch_path: str = BATCH_PATH,
+    fingerprint: Optional[Dict] = None
+) -> pd.DataFrame:
+    """Clean and add variables used for the modelisation.
+    The proceed data is the raw file and the batches ingested after it (see
+    append_proceed_data). It is saved in a cache, keyed by the fingerprint of
+    the raw file, the batches and the PIPELINE_VERSION:
+    - the cache is loaded directly when it is valid.
+    - when new rows are appended to the raw file or new batches are saved,
+      only the new rows are proceed.
+    - otherwise all the data is proceed again.
+    With a selection of ItemNumber, dates or columns, only this slice is read
+    from the cache. Without a valid cache (or use_cache=False), the selection
+    is pushed down to the raw file and the batches, the cache is only written
+    by a call without selection (see _get_proceed_slice): the categories are
+    always the ones of the whole data.
+    The cache is locked while it is read or written (see _lock_cache).
+
+    Args:
+        path (str, optional): path of the raw parquet file. Defaults to DATA_PATH.
+        cache_path (str, optional): folder of the cache. Defaults to CACHE_PATH.
+        use_cache (bool, optional): False to proceed the data without the cache
+            (not read nor written). Defaults to True.
+        items (List[str], optional): ItemNumber to read. Defaults to None (all).
+        start_date (str, optional): first date to read (included) as '%Y-%m-%d'.
+            Defaults to None.
+        end_date (str, optional): last date to read (included) as '%Y-%m-%d'.
+            Defaults to None.
+        columns (List[str], optional): proceed columns wanted, in addition to
+            the KEY_COLUMNS and the calendar columns. Defaults to None (all).
+        compact (bool, optional): True to reduce the memory of the proceed data
+            with get_compact_data (the cache is not changed). Defaults to False.
+        batch_path (str, optional): folder of the batches. Defaults to BATCH_PATH.
+        fingerprint (Dict, optional): fingerprint of the raw file already computed
+            by the caller (see _get_raw_fingerprint), for many reads of the same
+            raw file. Defaults to None (computed).
+
+    Returns:
+        pd.DataFrame:  dataframe of the proceed data
+    """
+    lock = _lock_cache(cache_path) if use_cache else nullcontext()
+    with lock:
+        if use_cache and fingerprint is None:
+            fingerprint = _get_raw_fingerprint(path)
+        manifest = None
+        if use_cache and os.path.exists(os.path.join(cache_path, 'manifest.json')):
+            with open(os.path.join(cache_path, 'manifest.json')) as f:
+                manifest = json.load(f)
+            if (
+                manifest['pipeline_version'] != PIPELINE_VERSION
+                or manifest['raw']['schema'] != fingerprint['schema']
+            ):
+                manifest = None
+
+        if manifest is not None and manifest['raw'] != fingerprint:
+            # New row groups appended at the end of the raw file, the same row
+            # groups in a file rewritten (size or mtime changed) are proceed again
+            nb_row_groups = len(manifest['raw']['row_groups'])
+            if (
+                len(fingerprint['row_groups']) > nb_row_groups
+                and fingerprint['row_groups'][:nb_row_groups] == manifest['raw']['row_groups']
+            ):
+                df = pq.ParquetFile(path).read_row_groups(
+                    range(nb_row_groups, len(fingerprint['row_groups']))
+                ).to_pandas()
+                print('Number of new observation:', len(df))
+                try:
+                    manifest['raw'] = fingerprint
+                    _append_cache_part(cache_path, manifest, df)
+                except ValueError as e:
+                    print('{}, proceed all the data'.format(e))
+                    manifest = None
+            else:
+                manifest = None
+
+        if manifest is not None and _add_batches(cache_path, manifest, batch_path):
+            print('Load the proceed data from the cache', cache_path)
+            df = _read_cache(cache_path, items, start_date, end_date, columns)
+            return get_compact_data(df) if compact else df
+
+        # Path to the data parquet file, and the batches ingested after it
+        batches = get_batches(batch_path)
+        selection = [items, start_date, end_date, columns]
+        if not use_cache or any(x is not None for x in selection):
+            files = [path] + [os.path.join(batch_path, batch) for batch in batches]
+            df = _get_proceed_slice(files, items, start_date, end_date, columns)
+            return get_compact_data(df) if compact else df
+
+        df = get_data(path)
+        nb_raw_rows = len(df)
+        df = pd.concat(
+            [df] + [
+                pd.read_parquet(os.path.join(batch_path, batch)) for batch in batches
+            ],
+            ignore_index=True
+        )
+        nb_rows = len(df)
+        print('Number of observation:', len(df))
+        print('Number of features:', len(list(df)))
+
+        # Useless Column (No different Value)
+        uselessColumns = [x for x in list(df) if len(df[x].unique()) == 1]
+        print(
+            'Variable with an unique Value',
+            uselessColumns
+        )
+        uselessValues = {x: _get_unique_value(df[x]) for x in uselessColumns}
+
+        df = get_clean_data(df, uselessColumns)
+
+        # The cache is written before the categorical variables:
+        # the filters on ItemNumber can be pushed down to the cache.
+        # The rows of the raw file and of the batches are in two parts: the new
+        # row groups of the raw file are read before the batches (see _get_parts)
+        manifest = {
+            'pipeline_version': PIPELINE_VERSION,
+            'raw': fingerprint,
+            'uselessColumns': uselessValues,
+            'categories': get_categories(df),
+            'batches': batches,
+            'nb_rows': nb_rows,
+            'parts': [],
+            'sources': [],
+        }
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.makedirs(cache_path)
+        isRaw = df.index < nb_raw_rows
+        _write_cache_part(cache_path, manifest, df[isRaw])
+        if not isRaw.all():
+            _write_cache_part(cache_path, manifest, df[~isRaw], 'batches')
+        df = get_categorical_data(df, manifest['categories'])
+
+        print('Number of observation:', len(df))
+        print('Number of features:', len(list(df)))
+        return get_compact_data(df) if compact else df
+
+
+def check_proceed_cache(
+    path: str = DATA_PATH,
+    cache_path: str = CACHE_PATH,
+    batch_path: str = BATCH_PATH
+) -> None:
+    """Check that the cache, updated with the new row groups of the raw file
+    and the batches, has the same rows in the same order than a full proceed
+    of the raw file and the batches. A ValueError is raised on a difference.
+    The categorical variables are compared on their values (and not
+    CommunicationChannelCode): the codes of the cache keep the order in which
+    the values arrived, a full proceed sorts them.
+
+    Args:
+        path (str, optional): path of the raw parquet file. Defaults to DATA_PATH.
+        cache_path (str, optional): folder of the cache. Defaults to CACHE_PATH.
+        batch_path (str, optional): folder of the batches. Defaults to BATCH_PATH.
+    """
+    with _lock_cache(cache_path):
+        cached = _read_cache(cache_path)
+    # The index of the rows appended after the batches is not the one of a
+    # full proceed (the rows of the raw file are first), but never used twice
+    if not cached.index.is_unique:
+        raise ValueError('The index of the cache has duplicated values')
+    cached = cached.reset_index(drop=True)
+    full = get_procceed_data(
+        path, cache_path, use_cache=False, batch_path=batch_path
+    ).reset_index(drop=True)
+
+    if sorted(cached) != sorted(full) or len(cached) != len(full):
+        raise ValueError('The cache has {} rows and the columns {}, expected {} and {}'.format(
+            len(cached), sorted(cached), len(full), sorted(full)
+        ))
+    for column in [x for x in list(full) if x != 'CommunicationChannelCode']:
+        values = cached[column].astype(object).where(cached[column].notna(), None)
+        expected = full[column].astype(object).where(full[column].notna(), None)
+        if not values.equals(expected):
+            raise ValueError('The column {} of the cache is not the one of a full proceed'.format(
+                column
+            ))
+    print('The cache is the same than a full proceed:', len(full), 'rows')
+
+
 def get_sample(df: pd.DataFrame, n=10, sample_extract=True) -> pd.DataFrame:
     """Return a dataFrame to use for the evaluation.
         or to get only the data we want to forecats
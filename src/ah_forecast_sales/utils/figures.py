@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+# Resolution of the history in the figures
+RESOLUTIONS = ['day', 'week', 'month', 'lttb']
+FREQUENCIES = {'week': 'W', 'month': 'M'}
+
+
+def get_lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Get the points kept by the Largest Triangle Three Buckets downsampling:
+    the first and last points, then in each bucket the point making the
+    largest triangle with the point kept in the previous bucket and the
+    mean of the next bucket. The peaks (promotions) are kept.
+
+    Args:
+        x (np.ndarray): x of the points, sorted.
+        y (np.ndarray): y of the points.
+        n_out (int): number of points wanted.
+
+    Returns:
+        np.ndarray: positions of the points kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = x.astype(float)
+    y = np.nan_to_num(y.astype(float))
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges = np.append(edges, n)
+    indices = np.zeros(n_out, dtype=int)
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_x = x[stop:edges[i + 2]].mean()
+        next_y = y[stop:edges[i + 2]].mean()
+        area = np.abs(
+            (x[a] - next_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def get_resampled(
+    df: pd.DataFrame,
+    column: str,
+    resolution: str = 'day',
+    max_points: int = 1000
+) -> pd.DataFrame:
+    """Reduce the number of points of a daily series.
+
+    Args:
+        df (pd.DataFrame): series with the columns ds and column.
+        column (str): column of the values.
+        resolution (str, optional): day (every point), week or month (mean of the
+            days of the period), lttb (at most max_points points kept with
+            get_lttb_indices). Defaults to 'day'.
+        max_points (int, optional): number of points kept by lttb. Defaults to 1000.
+
+    Returns:
+        pd.DataFrame: the series with the columns ds and column.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(
+            'Unknown resolution {}, expected one of {}'.format(resolution, RESOLUTIONS)
+        )
+    df = df[['ds', column]].sort_values('ds')
+    if resolution == 'day' or len(df) == 0:
+        return df
+    if resolution == 'lttb':
+        return df.iloc[get_lttb_indices(
+            df.ds.values.astype('int64'),
+            df[column].values,
+            max_points
+        )]
+    return df.groupby(
+        pd.Grouper(key='ds', freq=FREQUENCIES[resolution])
+    )[column].mean().dropna().reset_index()
+
+
+def _get_trace(name: str, x: pd.Series, y: pd.Series, n_points: int, webgl_threshold: int):
+    """Bar for a short series, WebGL line when the series had more than
+    webgl_threshold points before the resampling (n_points)."""
+    if n_points > webgl_threshold:
+        return go.Scattergl(name=name, x=x, y=y, mode='lines')
+    return go.Bar(name=name, x=x, y=y)
+
+
+def get_forecast_figure(
+    history: pd.DataFrame,
+    forecast_no_promo: pd.DataFrame,
+    forecast_promo: pd.DataFrame,
+    resolution: str = 'lttb',
+    max_points: int = 1000,
+    webgl_threshold: int = 500,
+    title: str = 'Times Series of Daily UniteSales'
+) -> go.Figure:
+    """Figure of the history split by promotion or not and of the
+    forecast of the week. Only the history is resampled, the forecast
+    is always in full detail.
+
+    Args:
+        history (pd.DataFrame): history with the columns ds, y and IsPromo.
+        forecast_no_promo (pd.DataFrame): forecast without promotion, columns ds and yhat.
+        forecast_promo (pd.DataFrame): forecast with promotion, columns ds and yhat.
+        resolution (str, optional): resolution of the history, see get_resampled.
+            Defaults to 'lttb' (a series shorter than max_points is not changed).
+        max_points (int, optional): number of points of each history series
+            with lttb. Defaults to 1000.
+        webgl_threshold (int, optional): number of points of the history before
+            the resampling above which a series is drawn with WebGL, lower than
+            max_points. Defaults to 500.
+        title (str, optional): title of the figure.
+
+    Returns:
+        go.Figure: the figure
+    """
+    isPromo = history.IsPromo.astype(bool)
+    fig = go.Figure()
+    for name, serie in [
+        ('No Promotion', history[~isPromo]),
+        ('Promotion', history[isPromo]),
+    ]:
+        n_points = len(serie)
+        serie = get_resampled(serie, 'y', resolution, max_points)
+        fig.add_trace(_get_trace(name, serie.ds, serie.y, n_points, webgl_threshold))
+
+    for name, serie in [
+        ('Forecast No Promotion', forecast_no_promo),
+        ('Forecast Promotion', forecast_promo),
+    ]:
+        fig.add_trace(go.Bar(name=name, x=serie.ds, y=serie.yhat))
+
+    fig.update_layout(title_text=title)
+    return fig
+
+
+def get_store_figure(
+    forecast: pd.DataFrame,
+    resolution: str = 'lttb',
+    max_points: int = 1000,
+    webgl_threshold: int = 1000
+) -> go.Figure:
+    """Figure of the forecast columns saved in the store, without the model.
+
+    Args:
+        forecast (pd.DataFrame): the columns ds, type, IsPromo, y and yhat,
+            type is history, forecast_promo or forecast_no_promo.
+        resolution (str, optional): resolution of the history, see get_resampled.
+            Defaults to 'lttb'.
+        max_points (int, optional): number of points of each history series
+            with lttb. Defaults to 1000.
+        webgl_threshold (int, optional): number of points of the history before
+            the resampling above which a series is drawn with WebGL, lower than
+            max_points. Defaults to 500.
+
+    Returns:
+        go.Figure: the figure
+    """
+    return get_forecast_figure(
+        forecast[forecast.type == 'history'],
+        forecast[forecast.type == 'forecast_no_promo'],
+        forecast[forecast.type == 'forecast_promo'],
+        resolution=resolution,
+        max_points=max_points,
+        webgl_threshold=webgl_threshold,
+    )
+
+
+def get_metrics_figure(
+    metrics: pd.DataFrame,
+    resolution: str = 'lttb',
+    max_points: int = 1000,
+    webgl_threshold: int = 500,
+    title: str = 'Final Times Series of Daily UniteSales'
+) -> go.Figure:
+    """Figure of the actual vs forecast data.
+
+    Args:
+        metrics (pd.DataFrame): the columns ds, y and yhat.
+        resolution (str, optional): resolution of the series, see get_resampled.
+            Defaults to 'lttb'.
+        max_points (int, optional): number of points of each series with lttb.
+            Defaults to 1000.
+        webgl_threshold (int, optional): number of points of the history before
+            the resampling above which a series is drawn with WebGL, lower than
+            max_points. Defaults to 500.
+        title (str, optional): title of the figure.
+
+    Returns:
+        go.Figure: the figure
+    """
+    fig = go.Figure()
+    for name, column in [('Actual', 'y'), ('Forecast', 'yhat')]:
+        serie = get_resampled(metrics, column, resolution, max_points)
+        fig.add_trace(_get_trace(name, serie.ds, serie[column], webgl_threshold))
+    fig.update_layout(title_text=title)
+    return fig
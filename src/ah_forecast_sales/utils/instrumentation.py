@@ -0,0 +1,148 @@
+from collections import deque
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger('ah_forecast_sales.stages')
+
+# Last records kept in memory, and totals by stage and model variant
+MAX_RECORDS = 10000
+_records = deque(maxlen=MAX_RECORDS)
+_totals: Dict = {}
+_lock = threading.Lock()
+_enabled = True
+
+
+def set_enabled(enabled: bool) -> None:
+    """Enable or disable the records of the stages.
+
+    Args:
+        enabled (bool): False to only time the stages, without keeping them.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def _get_max_rss() -> float:
+    """Peak resident memory of the process in MB (0 when not available)."""
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextmanager
+def stage(name: str, **tags) -> Iterator[Dict]:
+    """Record the wall time and the CPU time of the thread for a stage of the
+    pipeline (load, clean, date_parse, fit, predict, merge_metrics, figure),
+    with the peak resident memory of the process (process_max_rss_mb, since
+    the start of the process) and how much the stage raised it
+    (max_rss_growth_mb, 0 when the stage stays under a previous peak).
+    Neither is the memory used by the stage alone: see benchmarks/run.py.
+    The cost is two clock reads and two getrusage, it can stay on in production.
+
+    Example:
+        with stage('fit', item='10469', variant='univariate') as record:
+            model.fit(data)
+        record['wall_time']
+
+    Args:
+        name (str): name of the stage.
+        **tags: tags of the record (item, variant, ...).
+
+    Yields:
+        Iterator[Dict]: the record, with the timings once the stage is finished.
+    """
+    record = {'stage': name}
+    record.update(tags)
+    max_rss = _get_max_rss()
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.perf_counter() - wall_start
+        record['cpu_time'] = time.thread_time() - cpu_start
+        record['process_max_rss_mb'] = _get_max_rss()
+        record['max_rss_growth_mb'] = record['process_max_rss_mb'] - max_rss
+        if _enabled:
+            _add_record(record)
+
+
+def timed(name: str) -> Callable:
+    """Decorator to record each call of a function as a stage.
+
+    Args:
+        name (str): name of the stage.
+
+    Returns:
+        Callable: the decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _add_record(record: Dict) -> None:
+    key = (record['stage'], str(record.get('variant', '')))
+    with _lock:
+        _records.append(record)
+        total = _totals.setdefault(key, {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0})
+        total['count'] += 1
+        total['wall_time'] += record['wall_time']
+        total['cpu_time'] += record['cpu_time']
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record, default=str))
+
+
+def get_records() -> List[Dict]:
+    """Get the last records of the stages (at most MAX_RECORDS).
+
+    Returns:
+        List[Dict]: the records, one by stage executed.
+    """
+    with _lock:
+        return list(_records)
+
+
+def get_prometheus_metrics() -> str:
+    """Get the totals of the stages in the Prometheus text format.
+    The labels are the stage and the model variant: the ItemNumber is only
+    in the records, one serie by item would be too many for Prometheus.
+
+    Returns:
+        str: the metrics in the Prometheus text format
+    """
+    metrics = [
+        ('ah_forecast_sales_stage_calls_total', 'count', 'Number of executions of the stage'),
+        ('ah_forecast_sales_stage_seconds_total', 'wall_time', 'Wall time spent in the stage'),
+        ('ah_forecast_sales_stage_cpu_seconds_total', 'cpu_time', 'CPU time spent in the stage'),
+    ]
+    with _lock:
+        totals = {key: dict(total) for key, total in _totals.items()}
+
+    lines = []
+    for metric, field, description in metrics:
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        for (name, variant), total in sorted(totals.items()):
+            lines.append('{}{{stage="{}",variant="{}"}} {}'.format(
+                metric, name, variant, total[field]
+            ))
+    lines.append('# HELP ah_forecast_sales_max_rss_bytes Peak resident memory of the process')
+    lines.append('# TYPE ah_forecast_sales_max_rss_bytes gauge')
+    lines.append('ah_forecast_sales_max_rss_bytes {}'.format(int(_get_max_rss() * 1024 * 1024)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Tuple
+
+
+class ItemIndex():
+    """
+        Index of the proceed data by ItemNumber:
+        - the data is sorted once by ItemNumber and DateKey
+        - the offsets of each ItemNumber are kept in a dict
+        The times series of an ItemNumber is then a slice of the sorted data,
+        without a scan nor a copy of the whole dataset.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        """Init the ItemIndex Class.
+
+        Args:
+            df (pd.DataFrame): proceed data with the columns ItemNumber and DateKey.
+        """
+        self.data = df.take(self._set_offsets(df))
+
+    def _set_offsets(self, df: pd.DataFrame) -> np.ndarray:
+        """Set the offsets of each ItemNumber in df sorted by ItemNumber and DateKey.
+
+        Args:
+            df (pd.DataFrame): proceed data with the columns ItemNumber and DateKey.
+
+        Returns:
+            np.ndarray: the positions of the rows of df in the sorted order.
+        """
+        codes, uniques = pd.factorize(df.ItemNumber, sort=True)
+        order = np.lexsort((df.DateKey.values, codes))
+
+        codes = codes[order]
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate([[0], boundaries]) if len(codes) else np.array([], int)
+        stops = np.concatenate([boundaries, [len(codes)]]) if len(codes) else np.array([], int)
+        self.offsets: Dict[str, Tuple[int, int]] = {
+            str(uniques[code]): (start, stop)
+            for code, start, stop in zip(codes[starts], starts, stops)
+        }
+        return order
+
+    def get(self, ItemNumber: str) -> pd.DataFrame:
+        """Get the times series of an ItemNumber, sorted by DateKey.
+        The DataFrame is a slice of the index: copy it before to modify it.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            pd.DataFrame: data of the ItemNumber, empty if the ItemNumber is unknown.
+        """
+        start, stop = self.offsets.get(str(ItemNumber), (0, 0))
+        return self.data.iloc[start:stop]
+
+    def get_payload(self, ItemNumber: str) -> pd.DataFrame:
+        """Get the data of an ItemNumber to send to a worker process (see run_items):
+        the slice itself, pickled with the payload. A SharedItemIndex sends a
+        reference to a shared file instead.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            pd.DataFrame: data of the ItemNumber, empty if the ItemNumber is unknown.
+        """
+        return self.get(ItemNumber)
+
+    @property
+    def items(self) -> List[str]:
+        """List of the ItemNumber in the index."""
+        return list(self.offsets)
+
+    def __contains__(self, ItemNumber: str) -> bool:
+        return str(ItemNumber) in self.offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[Tuple[str, pd.DataFrame]]:
+        for ItemNumber, (start, stop) in self.offsets.items():
+            yield ItemNumber, self.data.iloc[start:stop]
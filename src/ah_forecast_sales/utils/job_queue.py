@@ -0,0 +1,286 @@
+from src.ah_forecast_sales.utils.parallel import _run_item
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+PENDING, RUNNING, SUCCESS, FAILED = 'pending', 'running', 'success', 'failed'
+
+
+class JobQueue():
+    """
+        Queue of background jobs saved in a sqlite file (no broker to deploy):
+        - a job is identified by a key (the ItemNumber), a key has at most
+          one job pending or running, a new submit returns the job in flight
+        - worker threads claim the pending jobs and run them in a process pool,
+          so a fit never blocks the threads serving the app
+        - the jobs running when the app stopped are pending again at the
+          start, a running job is marked alive every heartbeat second by its
+          worker thread, a job without heartbeat for stale_after seconds
+          (process killed) is claimed again: the queue survives a restart of
+          the app, however long a fit is
+        Several processes of the app can share the same file: a job is
+        claimed in a transaction, it is only run once (only one of them
+        resets the running jobs, see reset_running).
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        path: str = './assets/jobs.sqlite',
+        n_workers: int = 2,
+        get_payload: Optional[Callable[[str, Dict], Any]] = None,
+        timeout: Optional[float] = None,
+        stale_after: float = 60,
+        heartbeat: float = 10,
+        poll_interval: float = 0.5,
+        reset_running: bool = True,
+        mp_context: Optional[Any] = None,
+    ) -> None:
+        """Init the JobQueue Class. The workers start with start(), to call
+        before the threads of the server exist (or with the first submit).
+
+        Args:
+            func (Callable): picklable function called as func(payload) in the workers.
+            path (str, optional): sqlite file of the queue. Defaults to './assets/jobs.sqlite'.
+            n_workers (int, optional): number of jobs run at the same time. Defaults to 2.
+            get_payload (Callable[[str, Dict], Any], optional): function called as
+                get_payload(key, params) in the app process to build the payload of func
+                from the json params saved with the job. Defaults to None (the params).
+            timeout (float, optional): maximum number of second for a job.
+                Defaults to None (no limit).
+            stale_after (float, optional): number of second without heartbeat after
+                which a running job is considered lost and run again. Defaults to 60.
+            heartbeat (float, optional): number of second between two heartbeats
+                of a running job, lower than stale_after. Defaults to 10.
+            poll_interval (float, optional): number of second between two checks
+                of the queue by an idle worker. Defaults to 0.5.
+            reset_running (bool, optional): True to set the running jobs back to
+                pending: no process runs them after a restart. False for the other
+                processes sharing the file with a running one. Defaults to True.
+            mp_context (Any, optional): multiprocessing context of the process pool,
+                multiprocessing.get_context('spawn') to never fork from a thread
+                (the pool rebuilt after a crash is created by a worker thread).
+                Defaults to None (the default context, fork on linux).
+        """
+        self.func = func
+        self.path = path
+        self.n_workers = n_workers
+        self.get_payload = get_payload
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self.mp_context = mp_context
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                )"""
+            )
+            columns = [row['name'] for row in connection.execute('PRAGMA table_info(jobs)')]
+            if 'heartbeat_at' not in columns:
+                # File of a previous version of the queue
+                connection.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)')
+            if reset_running:
+                # The jobs of the stopped app would block their key until stale_after
+                connection.execute(
+                    'UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL '
+                    'WHERE status = ?',
+                    (PENDING, RUNNING)
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection by call: the sqlite connections are not shared between threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def submit(self, key: str, params: Optional[Dict] = None) -> int:
+        """Add a job for a key, unless one is already pending or running.
+
+        Args:
+            key (str): identifier of the job (ItemNumber).
+            params (Dict, optional): json parameters of the job. Defaults to None.
+
+        Returns:
+            int: id of the job added, or of the job already in flight for the key.
+        """
+        self.start()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT id FROM jobs WHERE key = ? AND status IN (?, ?)',
+                (str(key), PENDING, RUNNING)
+            ).fetchone()
+            if row is not None:
+                connection.execute('COMMIT')
+                return row['id']
+            cursor = connection.execute(
+                'INSERT INTO jobs (key, params, status, created_at) VALUES (?, ?, ?, ?)',
+                (str(key), json.dumps(params or {}), PENDING, time.time())
+            )
+            connection.execute('COMMIT')
+            return cursor.lastrowid
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def get_status(self, key: str) -> Optional[Dict]:
+        """Get the last job of a key.
+
+        Args:
+            key (str): identifier of the job (ItemNumber).
+
+        Returns:
+            Dict: id, status (pending, running, success or failed), error and dates
+            of the last job, None if no job has been submitted for the key.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT * FROM jobs WHERE key = ? ORDER BY id DESC LIMIT 1',
+                (str(key),)
+            ).fetchone()
+        finally:
+            connection.close()
+        return dict(row) if row is not None else None
+
+    def start(self) -> None:
+        """Start the process pool and the worker threads (once)."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._executor = self._get_executor()
+            # The processes are forked now, before the worker threads exist
+            self._executor.submit(int).result()
+            for _ in range(self.n_workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.n_workers, mp_context=self.mp_context)
+
+    def stop(self) -> None:
+        """Stop the worker threads after their current job, and the process pool."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _claim(self) -> Optional[Dict]:
+        """Mark the oldest pending (or lost) job as running and return it."""
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                """SELECT * FROM jobs
+                WHERE status = ?
+                OR (status = ? AND COALESCE(heartbeat_at, started_at) < ?)
+                ORDER BY id LIMIT 1""",
+                (PENDING, RUNNING, now - self.stale_after)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ? WHERE id = ?',
+                    (RUNNING, now, now, row['id'])
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+        return dict(row) if row is not None else None
+
+    def _beat(self, job_id: int) -> None:
+        """Mark a running job as alive, it is not claimed again while it runs."""
+        connection = self._connect()
+        try:
+            connection.execute(
+                'UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?',
+                (time.time(), job_id, RUNNING)
+            )
+        finally:
+            connection.close()
+
+    def _finish(self, job_id: int, status: str, error: Optional[str]) -> None:
+        connection = self._connect()
+        try:
+            connection.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, error, time.time(), job_id)
+            )
+        finally:
+            connection.close()
+
+    def _run(self, job: Dict) -> Dict:
+        params = json.loads(job['params'])
+        payload = params
+        if self.get_payload is not None:
+            payload = self.get_payload(job['key'], params)
+        self._beat(job['id'])
+        executor = self._executor
+        try:
+            future = executor.submit(
+                _run_item, self.func, job['key'], payload, self.timeout
+            )
+            while True:
+                try:
+                    return future.result(timeout=self.heartbeat)
+                except FutureTimeoutError:
+                    self._beat(job['id'])
+        except BrokenProcessPool:
+            # A worker process crashed (Stan segfault, out of memory):
+            # the pool is rebuilt once for all the threads, the job failed
+            with self._start_lock:
+                if self._executor is executor:
+                    self._executor = self._get_executor()
+            raise
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                output = self._run(job)
+            except Exception as e:
+                # Payload not built or worker process crashed
+                output = {'status': FAILED, 'error': '{}: {}'.format(type(e).__name__, e)}
+            status = SUCCESS if output['status'] == 'success' else FAILED
+            self._finish(job['id'], status, output['error'])
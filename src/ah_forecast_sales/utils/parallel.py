@@ -0,0 +1,214 @@
+from src.ah_forecast_sales.utils.shared_data import SharedSlice
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+
+# Second given to the alarm of a worker before its pool is terminated by run_items
+TIMEOUT_GRACE = 1.0
+
+
+class ItemTimeoutError(Exception):
+    """Raised inside a worker when an item runs longer than its timeout."""
+
+
+def _raise_timeout(signum, frame):
+    raise ItemTimeoutError()
+
+
+def _get_payload(payload: Any) -> Any:
+    """Replace the SharedSlice of a payload by their data, in the worker."""
+    if isinstance(payload, SharedSlice):
+        return payload.get()
+    if isinstance(payload, dict):
+        return {
+            key: value.get() if isinstance(value, SharedSlice) else value
+            for key, value in payload.items()
+        }
+    return payload
+
+
+def _run_item(
+    func: Callable,
+    key: Any,
+    payload: Any,
+    timeout: Optional[float]
+) -> Dict:
+    """Run the function for one item and catch every failure,
+    so one bad series does not stop the other items.
+
+    The timeout use SIGALRM, only on the main thread of the process: it is
+    checked by the python interpreter, so a long call inside Stan is stopped
+    when it returns. The deadline of an item in a pool is enforced by run_items,
+    which terminates the worker processes.
+    The SharedSlice of the payload (see SharedItemIndex) are read in the worker.
+
+    Args:
+        func (Callable): function to run on the payload.
+        key (Any): identifier of the item (ItemNumber).
+        payload (Any): argument given to the function.
+        timeout (float, optional): maximum number of second for the item.
+
+    Returns:
+        Dict: key, status (success, failed or timeout), result, error and elapsed time.
+    """
+    use_alarm = (
+        timeout is not None
+        and hasattr(signal, 'SIGALRM')
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    start = time.perf_counter()
+    result, status, error = None, 'success', None
+    try:
+        result = func(_get_payload(payload))
+    except ItemTimeoutError:
+        status, error = 'timeout', 'Timeout after {}s'.format(timeout)
+    except Exception as e:
+        status, error = 'failed', '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    return {
+        'key': key,
+        'status': status,
+        'result': result,
+        'error': error,
+        'elapsed': time.perf_counter() - start,
+    }
+
+
+def _get_output(key: Any, status: str, error: str, elapsed: Optional[float]) -> Dict:
+    return {'key': key, 'status': status, 'result': None, 'error': error, 'elapsed': elapsed}
+
+
+def _terminate(executor: ProcessPoolExecutor) -> None:
+    """Kill the worker processes of a pool, a call inside Stan cannot be interrupted."""
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    executor.shutdown(wait=False)
+
+
+def run_items(
+    func: Callable,
+    payloads: Iterable[Tuple[Any, Any]],
+    n_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[Dict]:
+    """Run a function for each item across a process pool and yield
+    the result of every item as soon as it is finished.
+
+    At most n_workers items are in the pool at the same time, each one with its
+    deadline: an item still running after timeout (a fit hanging in Stan) is
+    reported as timeout and the worker processes are terminated, the other
+    items in flight are run again in a new pool.
+    If a worker process crashes (Stan segfault, out of memory), the items in
+    flight are run again alone in a new pool: an item crashing alone is failed.
+
+    Args:
+        func (Callable): picklable function called as func(payload) in the workers.
+        payloads (Iterable[Tuple[Any, Any]]): couple (key, payload) for each item.
+        n_workers (int, optional): number of worker processes.
+            Defaults to the number of CPU. With 1 the items run in the current process
+            (the timeout is then only checked by the alarm on the main thread).
+        timeout (float, optional): maximum number of second for each item.
+            Defaults to None (no limit).
+
+    Yields:
+        Iterator[Dict]: the output of _run_item for each item.
+    """
+    payloads = list(payloads)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if n_workers == 1:
+        for key, payload in payloads:
+            yield _run_item(func, key, payload, timeout)
+        return
+
+    todo = deque(payloads)
+    # Items in flight during a crash, run one at a time to find the culprit
+    suspects = deque()
+    while todo or suspects:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        # future -> (key, payload, start)
+        running = {}
+        broken = False
+        try:
+            while (todo or suspects or running) and not broken:
+                if suspects:
+                    if not running:
+                        key, payload = suspects.popleft()
+                        future = executor.submit(_run_item, func, key, payload, timeout)
+                        running[future] = (key, payload, time.monotonic())
+                else:
+                    while todo and len(running) < n_workers:
+                        key, payload = todo.popleft()
+                        future = executor.submit(_run_item, func, key, payload, timeout)
+                        running[future] = (key, payload, time.monotonic())
+
+                wait_time = None
+                if timeout is not None:
+                    first_start = min(start for _, _, start in running.values())
+                    wait_time = max(0.0, first_start + timeout + TIMEOUT_GRACE - time.monotonic())
+                done, _ = wait(list(running), timeout=wait_time, return_when=FIRST_COMPLETED)
+
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    # The pool is broken: every item in flight is lost
+                    broken = True
+                    if len(running) == 1:
+                        key, _, start = running.pop(next(iter(running)))
+                        yield _get_output(
+                            key, 'failed', 'BrokenProcessPool: the worker process crashed',
+                            time.monotonic() - start
+                        )
+                    else:
+                        suspects.extend((key, payload) for key, payload, _ in running.values())
+                        running = {}
+                    break
+
+                for future in done:
+                    key, _, start = running.pop(future)
+                    if future.exception() is not None:
+                        # Payload or result not picklable
+                        e = future.exception()
+                        yield _get_output(
+                            key, 'failed', '{}: {}'.format(type(e).__name__, e),
+                            time.monotonic() - start
+                        )
+                    else:
+                        yield future.result()
+
+                if timeout is not None:
+                    now = time.monotonic()
+                    expired = [
+                        future for future, (_, _, start) in running.items()
+                        if not future.done() and now - start > timeout + TIMEOUT_GRACE
+                    ]
+                    for future in expired:
+                        key, _, start = running.pop(future)
+                        yield _get_output(
+                            key, 'timeout', 'Timeout after {}s'.format(timeout), now - start
+                        )
+                    if expired:
+                        broken = True
+        finally:
+            if broken:
+                _terminate(executor)
+            else:
+                executor.shutdown()
+
+        # The items in flight in a terminated pool are run again first
+        todo.extendleft(reversed([(key, payload) for key, payload, _ in running.values()]))
@@ -0,0 +1,174 @@
+from src.ah_forecast_sales.utils.item_index import ItemIndex
+from contextlib import contextmanager
+import os
+import pandas as pd
+import pyarrow as pa
+import tempfile
+import weakref
+from typing import Dict, Iterator, Optional, Tuple
+
+
+# Folder of the shared files: in memory on linux, the temporary folder otherwise
+SHARED_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Tables memory mapped in the current process, by path and version of the file
+_tables: Dict[Tuple[str, int], pa.Table] = {}
+
+# Number of rows converted and written at a time in the shared file
+CHUNK_ROWS = 1000000
+
+
+def _get_table(path: str, version: int) -> pa.Table:
+    """Memory map an Arrow IPC file once by process.
+    The table is a view on the pages of the file, shared by all the processes
+    mapping it: nothing is read nor copied until a slice is converted.
+    """
+    key = (path, version)
+    if key not in _tables:
+        # A new version of the file replaces the old one
+        for old in [x for x in _tables if x[0] == path]:
+            del _tables[old]
+        _tables[key] = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return _tables[key]
+
+
+def _remove_file(path: str, version: int) -> None:
+    """Remove a shared file, the processes already mapping it keep their view."""
+    _tables.pop((path, version), None)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class SharedSlice():
+    """
+        Reference to the rows of an ItemNumber in a SharedItemIndex.
+        It is sent to the worker processes in place of the data: a few bytes
+        to pickle, the worker maps the file and converts only these rows.
+    """
+
+    def __init__(self, path: str, version: int, start: int, stop: int) -> None:
+        self.path = path
+        self.version = version
+        self.start = start
+        self.stop = stop
+
+    def get(self) -> pd.DataFrame:
+        """Get the rows of the slice.
+
+        Returns:
+            pd.DataFrame: the data of the ItemNumber, sorted by DateKey.
+        """
+        table = _get_table(self.path, self.version)
+        return table.slice(self.start, self.stop - self.start).to_pandas()
+
+
+class SharedItemIndex(ItemIndex):
+    """
+        ItemIndex published once as a memory mapped Arrow IPC file:
+        - the data sorted by ItemNumber and DateKey is written once in SHARED_PATH
+        - the worker processes receive a SharedSlice (get_payload) and map the
+          file instead of receiving the pickled rows of their ItemNumber
+        The memory and the start of a worker no longer depend on the size of
+        the dataset: the pages of the file are shared by all the processes.
+        The file is removed by close, at the end of a with block, or when the
+        index is garbage collected (or the process exits).
+    """
+
+    def __init__(self, df: pd.DataFrame, path: Optional[str] = None) -> None:
+        """Init the SharedItemIndex Class.
+
+        Args:
+            df (pd.DataFrame): proceed data with the columns ItemNumber and DateKey.
+            path (str, optional): path of the Arrow IPC file.
+                Defaults to None (a new file in SHARED_PATH).
+        """
+        # No sorted copy of df: the rows are taken in order from the Arrow
+        # table of df (without copy of the numerical columns), by chunk
+        order = self._set_offsets(df)
+        self.data = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='ah_forecast_sales_', suffix='.arrow', dir=SHARED_PATH)
+            os.close(fd)
+        self.path = path
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Write in a temporary file first, a worker never map a partial file
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                for start in range(0, len(order), CHUNK_ROWS):
+                    writer.write_table(table.take(pa.array(order[start:start + CHUNK_ROWS])))
+        os.replace(path + '.tmp', path)
+        self.version = os.stat(path).st_mtime_ns
+        del table
+        self._finalizer = weakref.finalize(self, _remove_file, self.path, self.version)
+
+    @property
+    def table(self) -> pa.Table:
+        """The memory mapped table of the index."""
+        return _get_table(self.path, self.version)
+
+    def get(self, ItemNumber: str) -> pd.DataFrame:
+        """Get the times series of an ItemNumber, sorted by DateKey.
+        The DataFrame is a new frame converted from the mapped file.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            pd.DataFrame: data of the ItemNumber, empty if the ItemNumber is unknown.
+        """
+        return self.get_payload(ItemNumber).get()
+
+    def get_payload(self, ItemNumber: str) -> SharedSlice:
+        """Get the data of an ItemNumber to send to a worker process:
+        a reference to its rows in the mapped file.
+
+        Args:
+            ItemNumber (str): the ItemNumber wanted.
+
+        Returns:
+            SharedSlice: the rows of the ItemNumber, resolved by run_items in the worker.
+        """
+        start, stop = self.offsets.get(str(ItemNumber), (0, 0))
+        return SharedSlice(self.path, self.version, start, stop)
+
+    def __iter__(self) -> Iterator[Tuple[str, pd.DataFrame]]:
+        for ItemNumber in self.offsets:
+            yield ItemNumber, self.get(ItemNumber)
+
+    def close(self) -> None:
+        """Remove the file of the index, the processes already mapping it keep their view."""
+        self._finalizer()
+
+    def __enter__(self) -> 'SharedItemIndex':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+@contextmanager
+def open_item_index(
+    df: pd.DataFrame,
+    n_workers: Optional[int] = None,
+    item_index: Optional[ItemIndex] = None
+) -> Iterator[ItemIndex]:
+    """Index of df by ItemNumber for a batch run in worker processes (see run_items):
+    the item_index given by the caller, else a SharedItemIndex with more than one
+    worker (removed at the end of the with block), else an ItemIndex.
+
+    Args:
+        df (pd.DataFrame): proceed data with the columns ItemNumber and DateKey.
+        n_workers (int, optional): number of worker processes. Defaults to the number of CPU.
+        item_index (ItemIndex, optional): index of df already created. Defaults to None.
+
+    Yields:
+        Iterator[ItemIndex]: the index of df.
+    """
+    if item_index is not None:
+        yield item_index
+    elif (n_workers or os.cpu_count() or 1) > 1:
+        with SharedItemIndex(df) as shared_index:
+            yield shared_index
+    else:
+        yield ItemIndex(df)
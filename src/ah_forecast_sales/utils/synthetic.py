@@ -0,0 +1,164 @@
+from dateutil.easter import easter
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+
+# Day of the national holidays: fixed date (month, day) or days after easter
+NATIONAL_HOLIDAYS = {
+    'national_holiday_new_years_day': (1, 1),
+    'national_holiday_good_friday': -2,
+    'national_holiday_easter_sunday': 0,
+    'national_holiday_easter_monday': 1,
+    'national_holiday_kings_day': (4, 27),
+    'national_holiday_rememberance_day': (5, 4),
+    'national_holiday_liberation_day': (5, 5),
+    'national_holiday_ascension': 39,
+    'national_holiday_white_sunday': 49,
+    'national_holiday_white_monday': 50,
+    'national_holiday_christmas': (12, 25),
+    'national_holiday_boxing_day': (12, 26),
+}
+
+# Summer vacation of each region: (month, day) of the first and last day
+SCHOOL_HOLIDAYS = {
+    'SchoolHolidayNorth': ((7, 8), (8, 20)),
+    'SchoolHolidayMiddle': ((7, 15), (8, 27)),
+    'SchoolHolidaySouth': ((7, 22), (9, 3)),
+}
+
+COMMUNICATION_CHANNELS = ['Folder', 'Online', 'Radio', 'TV', 'Instore']
+
+
+def _get_holiday_dates(name: str, years) -> set:
+    rule = NATIONAL_HOLIDAYS[name]
+    if isinstance(rule, tuple):
+        return {dt.date(year, *rule) for year in years}
+    return {easter(year) + dt.timedelta(days=rule) for year in years}
+
+
+def get_synthetic_data(
+    n_rows: int = 100000,
+    n_items: int = 100,
+    end_date: str = '2017-12-31',
+    seed: int = 1
+) -> pd.DataFrame:
+    """Create a synthetic dataset with the same schema than ./assets/dataset.parquet:
+    daily UnitSales of n_items ItemNumber until the end date, with a weekly
+    seasonality, a trend, promotions with an uplift, holidays and weather.
+
+    Args:
+        n_rows (int, optional): number of rows (about). Defaults to 100000.
+        n_items (int, optional): number of ItemNumber. Defaults to 100.
+        end_date (str, optional): last DateKey of the data. Defaults to '2017-12-31'.
+        seed (int, optional): seed of the random generator. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: raw data, DateKey as integer yyyymmdd
+    """
+    random = np.random.RandomState(seed)
+    n_days = max(n_rows // n_items, 1)
+    dates = pd.date_range(end=end_date, periods=n_days, freq='D')
+
+    # ---------- Variables by date (same for all the items)
+    weather = pd.DataFrame({'DateKey': dates})
+    seasonal = np.cos(2 * np.pi * (dates.dayofyear.values - 200) / 365)
+    weather['TempAvg'] = 10 + 7 * seasonal + random.normal(0, 2, n_days)
+    weather['TempMin'] = weather.TempAvg - random.uniform(1, 5, n_days)
+    weather['TempMax'] = weather.TempAvg + random.uniform(1, 6, n_days)
+    weather['SundurationSum'] = np.clip(5 + 3 * seasonal + random.normal(0, 2, n_days), 0, 13)
+    weather['RainFallSum'] = 0.0
+
+    days = set(dates.date)
+    years = set(dates.year)
+    for name in NATIONAL_HOLIDAYS:
+        holidays = _get_holiday_dates(name, years) & days
+        weather[name] = dates.to_series().dt.date.isin(holidays).astype(int).values
+    for name, (first, last) in SCHOOL_HOLIDAYS.items():
+        month_day = dates.month * 100 + dates.day
+        weather[name] = np.where(
+            (month_day >= first[0] * 100 + first[1]) & (month_day <= last[0] * 100 + last[1]),
+            1.0,
+            np.nan
+        )
+
+    # ---------- Variables by item
+    items = pd.DataFrame({
+        'ItemNumber': [str(10000 + i) for i in range(n_items)],
+        'GroupCode': ['G{}'.format(x) for x in random.randint(0, max(n_items // 50, 1), n_items)],
+        'level': random.lognormal(5, 1.5, n_items),
+        'trend': random.normal(0, 0.2, n_items),
+        'uplift': random.uniform(1.5, 4, n_items),
+        'promo_rate': random.uniform(0, 0.3, n_items),
+        'StoreCount': random.randint(1, 934, n_items),
+        'BasePrice': np.round(random.lognormal(1, 0.6, n_items), 2),
+    })
+    items['CategoryCode'] = items.GroupCode + 'C' + random.randint(0, 5, n_items).astype(str)
+    weekly = random.uniform(0.7, 1.4, (n_items, 7))
+
+    # ---------- One row by item and date
+    item_idx = np.repeat(np.arange(n_items), n_days)
+    date_idx = np.tile(np.arange(n_days), n_items)
+    df = items.iloc[item_idx].reset_index(drop=True)
+    df = pd.concat([df, weather.iloc[date_idx].reset_index(drop=True)], axis=1)
+
+    # Promotions by week, the same week for all the days
+    week = date_idx // 7
+    promo_draw = random.uniform(0, 1, (n_items, n_days // 7 + 1))
+    df['IsPromo'] = promo_draw[item_idx, week] < df.promo_rate.values
+    n = len(df)
+
+    expected = (
+        df.level.values
+        * (1 + df.trend.values * date_idx / 365)
+        * weekly[item_idx, dates.weekday.values[date_idx]]
+        * np.where(df.IsPromo.values, df.uplift.values, 1)
+        * (1 + 0.3 * df.national_holiday_christmas.values)
+    )
+    df['UnitSales'] = random.poisson(np.clip(expected, 0.1, None)).astype(float)
+    df.loc[df.UnitSales < 1, 'UnitSales'] = 1.0
+
+    df['ShelfCapacity'] = np.round(df.StoreCount.values * random.uniform(5, 15, n))
+    df['PromoShelfCapacity'] = np.where(df.IsPromo, np.round(df.ShelfCapacity * 0.2), 0)
+    df['UnitPromotionThreshold'] = np.where(df.IsPromo, random.randint(1, 3, n), np.nan)
+    df['CommunicationChannel'] = np.where(
+        df.IsPromo,
+        np.array(COMMUNICATION_CHANNELS)[random.randint(0, len(COMMUNICATION_CHANNELS), n)],
+        None
+    )
+    df['BasePrice'] = np.where(df.IsPromo, df.BasePrice, np.nan)
+    df['DiscountPercentage'] = np.where(df.IsPromo, random.choice([0.1, 0.25, 0.5], n), np.nan)
+    df['MinAge'] = 0
+    df['AlcoholPercentage'] = 0.0
+
+    # Missing values like the real dataset
+    df.loc[random.uniform(0, 1, n) < 0.02, 'ShelfCapacity'] = np.nan
+    df.loc[random.uniform(0, 1, n) < 0.06, 'UnitSales'] = np.nan
+
+    df['DateKey'] = (dates.year * 10000 + dates.month * 100 + dates.day).values[date_idx]
+
+    return df[
+        ['DateKey', 'StoreCount', 'ShelfCapacity', 'PromoShelfCapacity',
+         'UnitPromotionThreshold', 'IsPromo']
+        + list(NATIONAL_HOLIDAYS)
+        + list(SCHOOL_HOLIDAYS)
+        + ['TempMin', 'TempMax', 'TempAvg', 'RainFallSum', 'SundurationSum',
+           'MinAge', 'AlcoholPercentage', 'CommunicationChannel', 'ItemNumber',
+           'CategoryCode', 'GroupCode', 'UnitSales', 'BasePrice', 'DiscountPercentage']
+    ]
+
+
+def write_synthetic_dataset(path: str, **kwargs) -> pd.DataFrame:
+    """Write a synthetic dataset in a parquet file, to use in place of
+    ./assets/dataset.parquet.
+
+    Args:
+        path (str): path of the parquet file.
+        **kwargs: arguments of get_synthetic_data.
+
+    Returns:
+        pd.DataFrame: the data written
+    """
+    df = get_synthetic_data(**kwargs)
+    df.to_parquet(path, index=False, row_group_size=100000)
+    return df
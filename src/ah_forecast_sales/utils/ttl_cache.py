@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class TTLCache():
+    """
+        Bounded in-process cache shared by the threads of the server:
+        - the least recently used entry is dropped above maxsize entries
+        - an entry expires ttl second after it was computed
+        - the concurrent misses of the same key wait for one computation
+          instead of computing it once by thread
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300) -> None:
+        """Init the TTLCache Class.
+
+        Args:
+            maxsize (int, optional): maximum number of entries. Defaults to 1024.
+            ttl (float, optional): number of second an entry is valid. Defaults to 300.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expiry time, value), the most recently used last
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        # key -> Future of the computation in progress
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def get(self, key: Hashable, func: Callable[[Hashable], Any]) -> Any:
+        """Get the value of a key, computed by func(key) on a miss.
+        A value None is returned but not cached (the next call computes it again).
+        An exception of func is raised in every thread waiting for the key.
+
+        Args:
+            key (Hashable): key of the value.
+            func (Callable[[Hashable], Any]): function computing the value of a key.
+
+        Returns:
+            Any: the value of the key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self._entries.pop(key, None)
+
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                self.stats['misses'] += 1
+                owner = True
+            else:
+                self.stats['coalesced'] += 1
+                owner = False
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = func(key)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            if value is not None:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop the entry of a key, the next call computes it again."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop all the entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)